@@ -0,0 +1,70 @@
+"""Maximin latin hypercube benchmark
+
+Time the ESE optimizer of `lhs(..., criterion='ese')` on designs up to
+10k samples x 30 dimensions, and compare its minimum pairwise distance and
+phi_p criterion (lower is better) with a random latin hypercube.
+
+    python benchmarks/bench_lhs.py --cases 100x5 1000x10 10000x30
+"""
+from __future__ import print_function, absolute_import, division
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from runner.lib.doelhs import lhs, _lhsclassic, _phisum, _sqdist_rows, PHI_P
+
+CASES = ['100x5', '1000x10', '10000x30']
+
+
+def mindist(H, block=1000):
+    " minimum pairwise distance, by blocks of rows "
+    sqnorm = (H**2).sum(axis=1)
+    dmin = np.inf
+    for start in range(0, H.shape[0], block):
+        rows = np.arange(start, min(start+block, H.shape[0]))
+        d2 = _sqdist_rows(H, rows, sqnorm)
+        d2[np.arange(rows.size), rows] = np.inf
+        dmin = min(dmin, d2.min())
+    return np.sqrt(dmin)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+', default=CASES, metavar='SAMPLESxDIMS',
+                        help='design sizes (default: %(default)s)')
+    parser.add_argument('--iterations', type=int, default=5,
+                        help='ESE outer iterations (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write results to a JSON file')
+    o = parser.parse_args(argv)
+
+    print("{:>8} {:>5} {:>10} {:>12} {:>12} {:>12} {:>12}".format(
+        'samples', 'dims', 'time (s)', 'mind random', 'mind ESE', 'phi random', 'phi ESE'))
+    results = []
+    for case in o.cases:
+        samples, dims = [int(v) for v in case.split('x')]
+        random = _lhsclassic(dims, samples, np.random.default_rng(o.seed))
+        start = time.time()
+        H = lhs(dims, samples, 'ese', o.iterations, random_state=o.seed)
+        elapsed = time.time() - start
+        r = {'samples': samples, 'dims': dims, 'time': elapsed,
+             'mind_random': mindist(random), 'mind_ese': mindist(H),
+             'phi_random': _phisum(random)**(1./PHI_P), 'phi_ese': _phisum(H)**(1./PHI_P)}
+        results.append(r)
+        print("{samples:>8} {dims:>5} {time:>10.2f} {mind_random:>12.4f} {mind_ese:>12.4f} "
+              "{phi_random:>12.4f} {phi_ese:>12.4f}".format(**r))
+        sys.stdout.flush()
+
+    if o.json:
+        with open(o.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Orchestration-overhead benchmarks
+
+Drive `XRun.run`, `job run --shell`, `job analyze` and `job resample` on
+synthetic ensembles of trivial members (the no-op model `true`), and report
+wall time, per-member time, throughput and peak memory (max RSS) of each
+case. Each case runs in its own process, so that peak memory is measured
+independently.
+
+For `xrun` and `shell`, the mean per-member orchestration overhead is also
+derived from the experiment trace (member span minus model span, see
+runner.trace). The `analyze` ensemble is written directly (runner.json files
+with a scalar output), so that it does not depend on the run benchmarks.
+
+    python benchmarks/bench_orchestration.py --sizes 1000 10000 --json bench.json
+"""
+from __future__ import print_function, absolute_import, division
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from collections import OrderedDict as odict
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from runner.model import Model, ModelInterface
+from runner.xparams import XParams
+from runner.xrun import XRun, XPARAM
+from runner.trace import TRACE, read_trace
+from runner.job.run import runio, EXPCONFIG
+
+SIZES = [1000, 10000, 100000]
+CASES = ['xrun', 'shell', 'analyze', 'resample']
+NOOP = 'true'  # no-op model
+
+JOB = [sys.executable, '-m', 'runner.job']
+
+
+def _environ():
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join([ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    return env
+
+
+def measure(cmd):
+    """run command, return wall time (s) and peak memory (MB)
+    """
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(cmd, stdout=devnull, env=_environ())
+        _, status, rusage = os.wait4(proc.pid, 0)
+    wall = time.time() - start
+    proc.returncode = os.WEXITSTATUS(status)
+    if proc.returncode:
+        raise RuntimeError("benchmark command failed: "+" ".join(cmd))
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    maxrss = rusage.ru_maxrss / (1024**2 if sys.platform == 'darwin' else 1024)
+    return wall, maxrss
+
+
+def trace_overhead(expdir):
+    " mean member time not spent in the model, in seconds "
+    spans = read_trace(os.path.join(expdir, TRACE))
+    member = sum(s['duration'] for s in spans if s['name'] == 'member')
+    model = sum(s['duration'] for s in spans if s['name'] == 'model')
+    count = sum(1 for s in spans if s['name'] == 'member')
+    return (member - model) / count if count else np.nan
+
+
+def write_params(file, size, seed=0):
+    values = np.random.RandomState(seed).uniform(size=(size, 2))
+    XParams(values, ['a', 'b']).write(file)
+
+
+def write_ensemble(expdir, size, seed=0):
+    """synthetic experiment directory with successful members and output y
+    """
+    rng = np.random.RandomState(seed)
+    interface = ModelInterface()
+    xrun = XRun(Model(interface), XParams(rng.uniform(size=(size, 2)), ['a', 'b']), expdir=expdir)
+    xrun.setup(force=True)
+    runio.dump(runio.namespace(expdir=expdir), open(os.path.join(expdir, EXPCONFIG), 'w'))
+    y = rng.normal(size=size)
+    for i, m in enumerate(xrun):
+        os.makedirs(m.rundir)
+        interface._write(m.rundir, {'params': m.params, 'status': 'success',
+                                    'output': {'y': y[i]}})
+
+
+def bench_xrun(tmpdir, size, workers):
+    expdir = os.path.join(tmpdir, 'xrun')
+    wall, maxrss = measure([sys.executable, os.path.abspath(__file__), '_xrun', expdir,
+                            str(size), str(workers)])
+    return wall, maxrss, trace_overhead(expdir)
+
+
+def _xrun(expdir, size, workers):
+    " called in a separate process by bench_xrun "
+    xparams = XParams(np.random.RandomState(0).uniform(size=(size, 2)), ['a', 'b'])
+    xrun = XRun(Model(ModelInterface([NOOP])), xparams, expdir=expdir, max_workers=workers)
+    xrun.setup(force=True)
+    xrun.run()
+
+
+def bench_shell(tmpdir, size, workers):
+    expdir = os.path.join(tmpdir, 'shell')
+    pfile = os.path.join(tmpdir, 'params.shell.txt')
+    write_params(pfile, size)
+    wall, maxrss = measure(JOB + ['run', '-i', pfile, '-o', expdir, '--shell', '-f', '--', NOOP])
+    return wall, maxrss, trace_overhead(expdir)
+
+
+def bench_analyze(tmpdir, size, workers):
+    expdir = os.path.join(tmpdir, 'analyze')
+    write_ensemble(expdir, size)
+    wall, maxrss = measure(JOB + ['analyze', expdir, '-l', 'y=N?0,1'])
+    return wall, maxrss, np.nan
+
+
+def bench_resample(tmpdir, size, workers):
+    pfile = os.path.join(tmpdir, 'params.resample.txt')
+    wfile = os.path.join(tmpdir, 'weights.txt')
+    write_params(pfile, size)
+    np.savetxt(wfile, np.random.RandomState(1).uniform(size=size))
+    wall, maxrss = measure(JOB + ['resample', pfile, '-w', wfile, '--iis', '--seed', '1',
+                                  '-o', os.path.join(tmpdir, 'params.resampled.txt')])
+    return wall, maxrss, np.nan
+
+
+BENCHMARKS = {
+    'xrun': bench_xrun,
+    'shell': bench_shell,
+    'analyze': bench_analyze,
+    'resample': bench_resample,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='ensemble sizes (default: %(default)s)')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES,
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() if hasattr(os, 'cpu_count') else 4,
+                        help='workers for XRun.run (default: %(default)s)')
+    parser.add_argument('--json', help='also write results to a JSON file')
+    o = parser.parse_args(argv)
+
+    print("{:<10} {:>8} {:>10} {:>14} {:>14} {:>14} {:>10}".format(
+        'case', 'size', 'wall (s)', 'member (ms)', 'overhead (ms)', 'members/s', 'RSS (MB)'))
+    results = []
+    for size in o.sizes:
+        for case in o.cases:
+            tmpdir = tempfile.mkdtemp(prefix='runner-bench-')
+            try:
+                wall, maxrss, overhead = BENCHMARKS[case](tmpdir, size, o.max_workers)
+            finally:
+                shutil.rmtree(tmpdir)
+            r = odict([('case', case), ('size', size), ('wall', wall),
+                       ('member_ms', wall/size*1e3), ('overhead_ms', overhead*1e3),
+                       ('throughput', size/wall), ('maxrss_mb', maxrss)])
+            results.append(r)
+            print("{case:<10} {size:>8} {wall:>10.2f} {member_ms:>14.3f} {overhead_ms:>14.3f} "
+                  "{throughput:>14.0f} {maxrss_mb:>10.1f}".format(**r))
+            sys.stdout.flush()
+
+    if o.json:
+        with open(o.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '_xrun':
+        _xrun(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main()
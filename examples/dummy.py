@@ -4,7 +4,7 @@ input: "aa" and "bb" parameters
     param file in json format, or command line
 
 output "aa" and "bb":
-    output.json : output aa and bb
+    output.json : output aa and bb (and time series "ts" if --ts is provided)
     output : output aa and bb
 """
 from __future__ import print_function
@@ -20,6 +20,7 @@ parser.add_argument('--aa', type=float)
 parser.add_argument('--bb', type=float)
 parser.add_argument('--sleep', type=int)
 parser.add_argument('--hang-if-not-aa', action='store_true')
+parser.add_argument('--ts', type=int, help='also output a time series of that length')
 
 o = parser.parse_args()
 
@@ -56,6 +57,11 @@ with open(path, 'w') as f:
     for k in output:
         f.write("{} {}\n".format(k, output[k]))
 
+if o.ts:
+    output_json = dict(output, ts=[aa + bb*t for t in range(o.ts)])
+else:
+    output_json = output
+
 print("Write output to", path+'.json')
 with open(path+'.json', 'w') as f:
-    json.dump(output, f, sort_keys=True)
+    json.dump(output_json, f, sort_keys=True)
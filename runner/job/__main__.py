@@ -8,9 +8,10 @@ import argparse
 import logging
 from runner import __version__
 from runner.job.config import jobs
+from runner.tools.profiler import profile, PROFILE_FILE, PROFILE_TOP
 
 # import module to register job
-from runner.job import stats, run, analysis
+from runner.job import stats, run, analysis, monitor
 
 
 # pull main job together
@@ -23,6 +24,12 @@ def main(argv=None):
 
     job.add_argument('-v','--version', action='version', version=__version__)
     job.add_argument('--debug', action="store_true", help='print full traceback')
+    job.add_argument('--profile', nargs='?', const=PROFILE_FILE, metavar='FILE',
+                     help='run command under cProfile and write results to FILE (default: %(const)s), ensemble workers included, as `--profile[=FILE]`')
+    job.add_argument('--profile-top', type=int, default=PROFILE_TOP, 
+                     help='number of hot functions to print with --profile (default: %(default)s)')
+    job.add_argument('--profile-sampling', action='store_true', 
+                     help='use a sampling profiler (pyinstrument) if available, with --profile')
     
     top = argparse.ArgumentParser(parents=[job], add_help=False)
     tops = top.add_subparsers(dest='cmd') # just for the command
@@ -43,6 +50,12 @@ def main(argv=None):
     if argv is None:
         argv = sys.argv[1:]
 
+    # `--profile` without value must not take the subcommand as FILE 
+    # (main options only: later tokens belong to the subcommand)
+    icmd = next((i for i, arg in enumerate(argv) if arg in jobs), len(argv))
+    argv = ['--profile='+PROFILE_FILE if arg == '--profile' and i < icmd else arg 
+            for i, arg in enumerate(argv)]
+
     # parse arguments and select sub-parser
     o = job.parse_args(argv)
     j = jobs[o.cmd]
@@ -60,7 +73,11 @@ def main(argv=None):
     cmdo = j.parser.parse_args(cmdargs)
 
     try:
-        j.run(cmdo)
+        if o.profile:
+            with profile(o.profile, top=o.profile_top, sampling=o.profile_sampling):
+                j.run(cmdo)
+        else:
+            j.run(cmdo)
     except Exception as error:
         if o.debug:
             raise
@@ -11,12 +11,13 @@ import shutil
 import os
 import sys
 import subprocess
+import time
 from collections import OrderedDict as odict
 from runner.tools import norm
 
-from runner.param import ScipyParam
+from runner.param import Param, ScipyParam, MultiParam
 from runner.model import Model
-from runner.xrun import XRun, XData
+from runner.xrun import XRun, XData, find_params_file, XPRIOR
 from runner.job.config import Job
 from runner.job.run import runio, EXPCONFIG, interface
 from runner.job.run import XPARAM, EXPDIR
@@ -27,6 +28,10 @@ analyze.add_argument('expdir', default=EXPDIR,
                                help='experiment directory to analyze')
 analyze.add_argument('--out', default=None,
                                help='experiment directory to write the diagnostics to (by default same as expdir)')
+analyze.add_argument('--incremental', action='store_true',
+                               help='only read members that are new or changed since the last incremental analysis')
+analyze.add_argument('--watch', type=float, metavar='SECONDS',
+                               help='repeat incremental analysis every SECONDS until all members have finished')
 
 grp =analyze.add_argument_group("model output", description='')
 
@@ -49,6 +54,17 @@ grp.add_argument('-l', '--likelihood',
 
 grp.add_argument('-J', '--cost', nargs='+', default=[], help='output variables that shall be treated as the result of an objective (or cost) function, this is equivalent to have the likelihood N?0,1')
 
+grp = analyze.add_argument_group(
+    "prior", 
+    description='prior of the ensemble parameters, for logprior.txt and logposterior.txt \
+(flat if not provided)')
+x = grp.add_mutually_exclusive_group()
+x.add_argument('--prior', type=Param.parse, nargs='+', default=[], metavar="NAME=DIST",
+               help='prior distribution (same convention as job sample)')
+x.add_argument('--prior-file',
+               help='prior file written by `job sample -o` (default: EXPDIR/{}, \
+copied there by `job run` if present)'.format(XPRIOR))
+
 
 def analyze_post(o):
 
@@ -57,16 +73,54 @@ def analyze_post(o):
 
     likelihood = o.likelihood + [Param.parse(name+"=N?0,1") for name in o.cost]
 
-    model = Model(interface.get(orun), likelihood=likelihood)
-    paramsfile = os.path.join(o.expdir, XPARAM)
+    if o.prior:
+        prior = MultiParam(o.prior)
+    elif o.prior_file or os.path.exists(os.path.join(o.expdir, XPRIOR)):
+        prior = MultiParam.read(o.prior_file or os.path.join(o.expdir, XPRIOR))
+    else:
+        prior = None  # flat
+
+    model = Model(interface.get(orun), prior=prior, likelihood=likelihood)
+    paramsfile = find_params_file(o.expdir)
     xparams = XData.read(paramsfile) # for the size & autodir
     xrun = XRun(model, xparams, expdir=o.expdir, autodir=orun.auto_dir)
 
-    xrun.analyze(o.output_variables, anadir=o.out)
+    while True:
+        index = xrun.analyze(o.output_variables, anadir=o.out, 
+                             incremental=o.incremental or bool(o.watch))
+        if not o.watch or index.finished(xrun):
+            break
+        time.sleep(o.watch)
 
 
 analyze = Job(analyze, analyze_post)
-analyze.register('analyze', help="analyze ensemble (output + loglik + stats) for resampling")
+analyze.register('analyze', help="analyze ensemble (output + loglik + logprior + stats) for resampling")
+
+
+postprocess = argparse.ArgumentParser(description="Apply model postprocess to ensemble members (in parallel)")
+postprocess.add_argument('expdir', default=EXPDIR, 
+                               help='experiment directory')
+postprocess.add_argument('-f', '--force', action='store_true',
+                               help='postprocess all successful members, even if up-to-date')
+postprocess.add_argument('--max-workers', type=int, 
+                               help='number of worker processes (default to the number of CPUs)')
+
+
+def postprocess_post(o):
+
+    orun = runio.load(open(os.path.join(o.expdir, EXPCONFIG)))
+
+    model = Model(interface.get(orun))
+    xparams = XData.read(find_params_file(o.expdir))
+    xrun = XRun(model, xparams, expdir=o.expdir, autodir=orun.auto_dir, 
+                max_workers=o.max_workers)
+    res = xrun.postprocess(force=o.force)
+    print("{} members postprocessed, {} up-to-date, {} not successful".format(
+        res.count(True), res.count(False), res.count(None)))
+
+
+postprocess = Job(postprocess, postprocess_post)
+postprocess.register('postprocess', help="apply model postprocess again (e.g. after model output changed)")
 
 #
 #    def add_iis(self):
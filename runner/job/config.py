@@ -40,7 +40,7 @@ class ParserIO(object):
         return json.dumps(js, indent=indent, **kwargs)
 
     def loads(self, string, update={}):
-        js = json.loads(string)
+        js = json.loads(string)['defaults']
         js = self._load_filter(js)
         js.update(update)
         return self.namespace(**js)
@@ -56,10 +56,7 @@ class ParserIO(object):
         " for I/O only, forget about get "
         parser = argparse.ArgumentParser(add_help=False, 
                                          parents=[self.parser, other.parser], **kwargs)
-        return ParserIO(parser, 
-                        lambda x: other._dump_filter(self._dump_filter(x)),
-                        lambda x: other._load_filter(self._load_filter(x)),
-                        get = self.get or other.get)
+        return ParserIO(parser, get = self.get or other.get)
 
 
 jobs = odict()
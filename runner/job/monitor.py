@@ -0,0 +1,66 @@
+"""Monitor experiment progress
+"""
+from __future__ import print_function, absolute_import
+import argparse
+import os
+import json
+import time
+from runner.journal import Journal, JournalSummary, JOURNAL
+from runner.trace import TRACE, read_trace, summarize, to_chrome
+from runner.job.config import Job
+from runner.job.run import EXPDIR
+
+
+status = argparse.ArgumentParser(description="""Experiment status from its journal 
+(member counts, throughput, ETA and recent failures), without reading run directories""")
+status.add_argument('expdir', default=EXPDIR, help='experiment directory')
+status.add_argument('--watch', type=float, metavar='SECONDS', 
+                    help='print status every SECONDS until all members have finished')
+status.add_argument('--failures', type=int, default=5, 
+                    help='number of recent failures to display (default: %(default)s)')
+
+
+def status_post(o):
+    file = os.path.join(o.expdir, JOURNAL)
+    if not os.path.exists(file):
+        raise ValueError("no journal found: "+file)
+    journal = Journal(file)
+    summary = JournalSummary()
+    offset = 0
+    while True:
+        records, offset = journal.read(offset)  # only replay new records
+        summary.update(records)
+        print("Experiment directory: "+o.expdir)
+        print(summary.format(o.failures))
+        if not o.watch or summary.done():
+            break
+        time.sleep(o.watch)
+        print()
+
+
+status = Job(status, status_post)
+status.register('status', help='experiment progress from the journal')
+
+
+trace = argparse.ArgumentParser(description="""Summarize the per-phase trace of member 
+execution (setup, spawn, model, postprocess, write) and orchestration overheads""")
+trace.add_argument('expdir', default=EXPDIR, help='experiment directory')
+trace.add_argument('--top', type=int, default=5, 
+                   help='number of overheads to display (default: %(default)s)')
+trace.add_argument('--chrome', metavar='FILE', 
+                   help='also convert the trace to Chrome trace format (chrome://tracing, Perfetto)')
+
+
+def trace_post(o):
+    file = os.path.join(o.expdir, TRACE)
+    if not os.path.exists(file):
+        raise ValueError("no trace found: "+file)
+    spans = read_trace(file)
+    print(summarize(spans, top=o.top))
+    if o.chrome:
+        with open(o.chrome, 'w') as f:
+            json.dump(to_chrome(spans), f)
+
+
+trace = Job(trace, trace_post)
+trace.register('trace', help='per-phase timing of member execution')
@@ -69,16 +69,22 @@ import numpy as np
 from runner.param import MultiParam, DiscreteParam
 from runner.model import Model
 #from runner.xparams import XParams
-from runner.xrun import XParams, XRun, XPARAM
+from runner.xrun import XParams, XRun, XPARAM, XPARAM_LEVELS, XPRIOR, find_params_file
+from runner.xparams import XFactorial
+from runner.tools.frame import is_binary
 from runner.job.model import interface
 from runner.job.config import ParserIO, program
+from runner.job.stats import design, prior_file
+from runner.metrics import MetricsServer
 import os
+import shutil
 
 import pandas as pd 
 from tabulate import tabulate
 
 EXPCONFIG = 'experiment.json'
 EXPDIR = 'out'
+LAZY_PARAMS_SIZE = 1000000  # larger factorial designs are saved as levels only
 
 def to_fwf(df, fname):
     content = tabulate(df.values.tolist(), list(df.columns), tablefmt="plain")
@@ -132,7 +138,11 @@ grp.add_argument('--echo', action='store_true',
 #grp.add_argument('-b', '--array', action='store_true', 
 #                 help='submit using sbatch --array (faster!), EXPERIMENTAL)')
 grp.add_argument('-f', '--force', action='store_true', 
-                 help='perform run even if params.txt already exists directory')
+                 help='perform run even if params.txt already exists directory (the journal starts a new segment)')
+grp.add_argument('--resume', action='store_true',
+                 help='in an existing experiment directory, only run members that did not succeed yet (according to its journal, or their runner.json file), e.g. after extending the ensemble with `job sample --extend`. Params default to the experiment params file, and a new params file must start with the existing members.')
+grp.add_argument('--metrics-port', type=int,
+                 help='serve live metrics (Prometheus text format) on http://localhost:PORT/metrics while the ensemble runs')
 
 folders = argparse.ArgumentParser(add_help=False)
 grp = folders.add_argument_group("simulation settings")
@@ -152,7 +162,7 @@ x.add_argument('-p', '--params',
         or a range `START:STOP:N`.""",
                  metavar="NAME=SPEC",
                  nargs='*')
-x.add_argument('-i','--params-file', help='ensemble parameters file')
+x.add_argument('-i','--params-file', help='ensemble parameters file (text, or binary .npy or .npz), `-` to read from standard input')
 x.add_argument('--continue', dest="continue_simu", action='store_true', 
                  help=argparse.SUPPRESS)
                  #help='load params.txt from simulation directory')
@@ -180,11 +190,23 @@ params_parser.add_argument('--include-default',
 #                 nargs='+')
 
 
-parser = argparse.ArgumentParser(parents=[interface.parser, params_parser, folders, submit], epilog=examples, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser = argparse.ArgumentParser(parents=[interface.parser, params_parser, design, folders, submit], epilog=examples, description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
 
 runio = interface.join(ParserIO(folders)) # interface + folder: saveit
 
 
+def _starts_with(xparams, pfile):
+    " True if xparams starts with the members of pfile, compared block by block "
+    start = 0
+    for block in XParams.iter_read(pfile):
+        stop = start + block.size
+        if (list(block.names) != list(xparams.names) or stop > xparams.size 
+                or not np.allclose(xparams[start:stop].values, block.values)):
+            return False
+        start = stop
+    return True
+
+
 @program(parser)
 def main(o):
 
@@ -195,10 +217,16 @@ def main(o):
 
     model = Model(interface.get(o))
 
-    pfile = os.path.join(o.expdir, XPARAM)
-
     if o.continue_simu:
-        o.params_file = pfile
+        o.params_file = find_params_file(o.expdir)
+        o.force = True
+
+    if o.resume:
+        existing_file = find_params_file(o.expdir)
+        if existing_file is None:
+            parser.error("--resume: no params file found in "+repr(o.expdir))
+        if not o.params_file and not o.params:
+            o.params_file = existing_file
         o.force = True
 
     if o.params_file:
@@ -206,17 +234,33 @@ def main(o):
 
     elif o.params:
         prior = MultiParam(o.params)
-        xparams = prior.product() # only product allowed as direct input
+        xparams = prior.product(fraction=o.fraction, orthogonal_array=o.orthogonal_array) # only product allowed as direct input
         #update = {p.name:p.value for p in o.params}
     else:
         xparams = XParams(np.empty((0,0)), names=[])
         o.include_default = True
 
-    xrun = XRun(model, xparams, expdir=o.expdir, autodir=o.auto_dir, max_workers=o.max_workers, timeout=o.timeout)
+    if o.resume and o.params_file != existing_file:
+        if not _starts_with(xparams, existing_file):
+            parser.error("--resume: new params must start with the existing members of "+repr(existing_file))
+
+    # large ensembles: keep binary params as binary in expdir
+    if o.params_file and is_binary(o.params_file):
+        params_file = 'params'+os.path.splitext(o.params_file)[1]
+    elif isinstance(xparams, XFactorial) and xparams.size > LAZY_PARAMS_SIZE:
+        params_file = XPARAM_LEVELS  # never build huge grids
+    else:
+        params_file = XPARAM
+
+    xrun = XRun(model, xparams, expdir=o.expdir, autodir=o.auto_dir, max_workers=o.max_workers, timeout=o.timeout,
+                params_file=params_file)
     # create dir, write params.txt file, as well as experiment configuration
     try:
         if not o.continue_simu:
-            xrun.setup(force=o.force)  
+            xrun.setup(force=o.force, segment=not o.resume)
+            # sampling prior written by `job sample -o`, for `job analyze`
+            if o.params_file and os.path.exists(prior_file(o.params_file)):
+                shutil.copy(prior_file(o.params_file), os.path.join(o.expdir, XPRIOR))
     except RuntimeError as error:
         print("ERROR :: "+str(error))
         print("Use -f/--force to bypass this check")
@@ -233,39 +277,66 @@ def main(o):
     if o.include_default:
         indices = list(indices) + [None]
 
-    # test: run everything serially
-    if o.shell:
+    if o.resume:
+        # journal state, or runner.json status for members absent from the journal
+        states = xrun.journal.summary().states
+        def succeeded(runid):
+            if runid in states:
+                return states[runid] == 'success'
+            m = xrun[runid]
+            return os.path.exists(m.runfile) and m.load().status == 'success'
+        indices = [i for i in indices if not succeeded(None if i is None else int(i))]
+
+    metrics = None
+    if o.metrics_port:
+        metrics = MetricsServer(xrun.journal, o.metrics_port,
+                                max_workers=1 if o.shell else o.max_workers or len(indices)).start()
+
+    try:
+        # test: run everything serially
+        if o.shell:
         
-        # Load params.txt into a list
-        params_list = open(o.expdir+"/params.txt",'r').read().split('\n')
+            # Load params.txt into a list
+            if params_file == XPARAM:
+                params_list = open(o.expdir+"/params.txt",'r').read().split('\n')
+            else:
+                # only format selected members (lazy designs may be huge)
+                params_list = {0: " ".join(xparams.names)}
+                params_list.update((i+1, " ".join(str(v) for v in xparams.pset_as_array(i)))
+                                   for i in indices if i is not None)
+
+            gen_info = True 
+            if len(params_list) == 1: gen_info = False 
 
-        gen_info = True 
-        if len(params_list) == 1: gen_info = False 
+            if gen_info:
+                # Generate a new list 
+                info_header = ["runid"] + params_list[0].split() + ["rundir"]
+                info_list = []
+
+            xrun.journal.extend(indices, 'queued')
 
-        if gen_info:
-            # Generate a new list 
-            info_header = ["runid"] + params_list[0].split() + ["rundir"]
-            info_list = []
+            for i in indices:
+                xrun._run(i, background=False)
 
-        for i in indices:
-            xrun[i].run(background=False)
+                if gen_info:
+                    # Add runid and rundir to list for writing 
+                    runid     = i 
+                    rundir    = os.path.basename(xrun[i].rundir)
+                    info_line = [runid] + params_list[i+1].split() + [rundir]
+                    info_list.append(info_line)
 
             if gen_info:
-                # Add runid and rundir to list for writing 
-                runid     = i 
-                rundir    = os.path.basename(xrun[i].rundir)
-                info_line = [runid] + params_list[i+1].split() + [rundir]
-                info_list.append(info_line)
-
-        if gen_info:
-            # Write the info list to file
-            exp_file = o.expdir+"/info.txt"
-            info = pd.DataFrame(info_list,columns=info_header)
-            info.to_fwf(exp_file)
+                # Write the info list to file
+                exp_file = o.expdir+"/info.txt"
+                info = pd.DataFrame(info_list,columns=info_header)
+                info.to_fwf(exp_file)
             
-    # the default
-    else:
-        xrun.run(indices=indices)
+        # the default
+        else:
+            xrun.run(indices=indices)
+    finally:
+        if metrics is not None:
+            metrics.stop()
 
     return
 
@@ -1,6 +1,8 @@
 import argparse
+import os
+import sys
 import numpy as np
-from runner.param import MultiParam, Param, DiscreteParam
+from runner.param import MultiParam, Param, DiscreteParam, UNCORRELATED_METHODS
 import runner.resample as xp
 from runner.xparams import XParams, Resampler
 from runner.job.config import Job
@@ -8,27 +10,77 @@ from runner.job.config import Job
 # generate params.txt (XParams)
 # =============================
 def _return_params(xparams, out):
-    "Return new ensemble parameters"
+    "Return new ensemble parameters (binary for .npy or .npz output file)"
     if out:
-        with open(out, "w") as f:
-            f.write(str(xparams))
+        xparams.write(out)
     else:
-        print(str(xparams))
+        xparams.write(sys.stdout)  # streamed, e.g. to `job run -i -`
+        sys.stdout.write("\n")
+
+def prior_file(params_file):
+    "prior (and correlation) file written alongside an ensemble parameter file"
+    return os.path.splitext(params_file)[0] + '.prior.json'
+
+def _corr_pair(string):
+    "NAME,NAME=R"
+    try:
+        names, r = string.split('=')
+        a, b = names.split(',')
+        return a, b, float(r)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected NAME,NAME=R, got: "+string)
+
+def _corr_matrix(names, pairs=(), corr_file=None):
+    "correlation matrix from a text file (parameter order) and/or pairs, or None"
+    if corr_file:
+        corr = np.loadtxt(corr_file, ndmin=2)
+    elif pairs:
+        corr = np.eye(len(names))
+    else:
+        return None
+    for a, b, r in pairs:
+        for name in (a, b):
+            if name not in names:
+                raise ValueError("correlation: unknown parameter: "+name)
+        i, j = names.index(a), names.index(b)
+        corr[i, j] = corr[j, i] = r
+    return corr
 
 # product
 # -------
-product_parser = argparse.ArgumentParser(description="Factorial combination of parameter values")
+RESOLUTIONS = {'III': 3, 'IV': 4, 'V': 5}
+
+def _resolution(string):
+    if string.upper() in RESOLUTIONS:
+        return RESOLUTIONS[string.upper()]
+    if string in [str(r) for r in RESOLUTIONS.values()]:
+        return int(string)
+    raise argparse.ArgumentTypeError("resolution must be one of III, IV, V (or 3, 4, 5)")
+
+design = argparse.ArgumentParser(add_help=False)
+grp = design.add_argument_group("fractional designs", 
+                                description="subsets of the full factorial design")
+x = grp.add_mutually_exclusive_group()
+x.add_argument('--fraction', type=_resolution, metavar='RESOLUTION', 
+               help="two-level fractional factorial design of resolution III, IV or V, \
+               with each parameter's min and max values as levels")
+x.add_argument('--orthogonal-array', action='store_true', 
+               help="strength-2 orthogonal array, for parameters with the same \
+               prime number of values (e.g. 2, 3, 5)")
+
+product_parser = argparse.ArgumentParser(description="Factorial combination of parameter values", parents=[design])
 product_parser.add_argument('factors',
                  type=DiscreteParam.parse,
                  metavar="NAME=VAL1[,VAL2 ...]",
                  nargs='*')
-product_parser.add_argument('-o','--out', help="output parameter file")
+product_parser.add_argument('-o','--out', help="output parameter file (binary format for .npy or .npz extension)")
 
 
 def product_post(o):
     if not o.factors:
         product_parser.error("must provide at least one parameter")
-    xparams = MultiParam(o.factors).product()
+    xparams = MultiParam(o.factors).product(fraction=o.fraction, 
+                                            orthogonal_array=o.orthogonal_array)
     return _return_params(xparams, o.out)
 
 product = Job(product_parser, product_post)
@@ -49,31 +101,67 @@ lhs = argparse.ArgumentParser(add_help=False)
 grp = lhs.add_argument_group("Latin hypercube sampling")
 grp.add_argument('--lhs-criterion', 
                    choices=('center', 'c', 'maximin', 'm', 
-                            'centermaximin', 'cm', 'correlation', 'corr'), 
+                            'centermaximin', 'cm', 'correlation', 'corr', 'ese'), 
                  help='randomized by default')
 grp.add_argument('--lhs_iterations', type=int)
 
 
 sample = argparse.ArgumentParser(description="Sample prior parameter distribution", parents=[prior, lhs])
-sample.add_argument('-o', '--out', help="output parameter file")
+sample.add_argument('-o', '--out', help="output parameter file (binary format for .npy or .npz extension)")
 
 sample.add_argument('-N', '--size',type=int, 
                   help="Sample size")
 sample.add_argument('--seed', type=int, 
                   help="random seed, for reproducible results (default to None)")
-sample.add_argument('--method', choices=['montecarlo','lhs'], default='lhs', 
-                    help="sampling method (default=%(default)s)")
+sample.add_argument('--method', choices=['montecarlo','lhs','lhsmdu','nolh','sobol','halton'], default='lhs', 
+                    help="sampling method (default=%(default)s). The nearly orthogonal "
+                    "latin hypercube (nolh) size is set by the number of parameters. "
+                    "Scrambled sobol sequences are balanced for powers of 2.")
+sample.add_argument('--extend', metavar='PARAMS_FILE',
+                    help="add SIZE space-filling samples to an existing ensemble (same parameters), "
+                    "and output the whole ensemble, existing samples first, e.g. for `job run --resume`")
+sample.add_argument('--skip', type=int, default=0,
+                    help="sobol, halton: skip the first points of the sequence, "
+                    "e.g. `--seed S --skip N` extends the sample of size N drawn with `--seed S`")
+
+grp = sample.add_argument_group("correlated parameters",
+                                description="target rank (Spearman) correlation, induced by reordering \
+the samples of each parameter (Iman and Conover, 1982), for random designs only (not with nolh, \
+sobol, halton or --extend). With -o, the prior and correlation matrix \
+are written alongside the ensemble as OUT.prior.json, for `job resample --iis` (jitter within \
+the prior support, with the prior correlation).")
+grp.add_argument('--corr', nargs='+', type=_corr_pair, default=[], metavar='NAME,NAME=R',
+                 help="rank correlation between two parameters (others are uncorrelated)")
+grp.add_argument('--corr-file',
+                 help="text file with the full correlation matrix, in parameter order \
+(pairs in --corr, if any, take precedence)")
 
 def sample_post(o):
-    if not o.size:
-        sample.error("argument -N/--size is required")
+    if not o.size and o.method != 'nolh':
+        sample.parser.error("argument -N/--size is required")
     if not o.dist:
-        sample.error("must provide at least one parameter")
-    prior = MultiParam(o.dist)
+        sample.parser.error("must provide at least one parameter")
+    try:
+        prior = MultiParam(o.dist)
+        corr = _corr_matrix(prior.names, o.corr, o.corr_file)
+        if corr is not None:
+            prior = MultiParam(prior, corr=corr)
+            if o.extend:
+                raise ValueError("--corr cannot be used with --extend")
+            if o.method in UNCORRELATED_METHODS:
+                raise ValueError("--corr is not supported by the {} method".format(o.method))
+    except ValueError as error:
+        sample.parser.error(str(error))
+    if o.out:
+        prior.write(prior_file(o.out))
+    if o.extend:
+        xparams = prior.extend_design(XParams.read(o.extend), o.size, seed=o.seed)
+        return _return_params(xparams, o.out)
     xparams = prior.sample(o.size, seed=o.seed, 
                            method=o.method,
                            criterion=o.lhs_criterion,
-                           iterations=o.lhs_iterations)
+                           iterations=o.lhs_iterations,
+                           skip=o.skip)
     return _return_params(xparams, o.out)
 
 sample = Job(sample, sample_post)
@@ -85,7 +173,7 @@ sample.register('sample', help='generate ensemble by sampling prior distribution
 resample = argparse.ArgumentParser(description=xp.__doc__, 
                                    formatter_class=argparse.RawDescriptionHelpFormatter)
 resample.add_argument("params_file", 
-                    help="ensemble parameter flle to resample")
+                    help="ensemble parameter flle to resample (text, .npy or .npz)")
 
 #grp = resample.add_argument_group('weights')
 resample.add_argument('--weights-file', '-w', required=True, 
@@ -102,6 +190,11 @@ variance as a fraction of resampled parameter variance. \
     If not provided 0.05 is used as a starting value but adjusted if the \
 effective ensemble size is not in the range specified by --neff-bounds.')
 
+grp.add_argument('--prior-file',
+                 help='prior written by `job sample` (default: PARAMS_FILE stem + .prior.json, \
+if present): the jitter follows the prior correlation matrix, if any, and remains \
+within the prior support (e.g. uniform or truncated distributions)')
+
 grp.add_argument('--neff-bounds', nargs=2, default=xp.NEFF_BOUNDS, type=int, 
                    help='Acceptable range for the effective ensemble size\
                    when --epsilon is not provided. Default to %(default)s.')
@@ -115,7 +208,7 @@ grp.add_argument('-N', '--size', help="New sample size (default: same size as be
 grp.add_argument('--seed', type=int, help="random seed, for reproducible results (default to None)")
 
 grp = resample.add_argument_group('output')
-grp.add_argument('-o', '--out', help="output parameter file (print to scree otherwise)")
+grp.add_argument('-o', '--out', help="output parameter file (print to scree otherwise), binary format for .npy or .npz extension")
 
 
 
@@ -127,15 +220,32 @@ def resample_post(o):
     if np.all(weights == 0):
         raise ValueError("all weights are zero")
     xpin = XParams.read(o.params_file)
+    priorfile = o.prior_file or prior_file(o.params_file)
+    prior = MultiParam.read(priorfile) if o.prior_file or os.path.exists(priorfile) else None
+    corr = bounds = None
+    if o.iis and prior is not None:
+        bounds = prior.bounds(xpin.names)
+    if o.iis and prior is not None and prior.corr is not None:
+        # prior correlation in ensemble order, uncorrelated if not in prior
+        pearson = prior.pearson_corr()
+        corr = np.eye(len(xpin.names))
+        idx = [xpin.names.index(name) if name in xpin.names else None for name in prior.names]
+        for i, ii in enumerate(idx):
+            for j, jj in enumerate(idx):
+                if ii is not None and jj is not None:
+                    corr[ii, jj] = pearson[i, j]
     xparams = xpin.resample(weights, size=o.size, seed=o.seed,
                             method=o.method,
                             iis=o.iis, epsilon=o.epsilon, 
                             neff_bounds=o.neff_bounds, 
+                            corr=corr, bounds=bounds,
                             )
+    if prior is not None and o.out:
+        prior.write(prior_file(o.out))
     return _return_params(xparams, o.out)
 
 
-resample = Job(resample, sample_post)
+resample = Job(resample, resample_post)
 resample.register('resample', help='resample parameters from previous simulation')
 
 
@@ -0,0 +1,183 @@
+"""Append-only experiment journal
+
+Workers record state transitions of ensemble members (queued, running,
+success, failed, timeout) as JSON lines in the experiment directory, e.g.
+
+    {"runid": 3, "state": "success", "time": 1476871834.2, "duration": 12.1}
+
+Each record is written with a single `os.write` on a file opened with
+O_APPEND, which does not interleave with concurrent writers for lines
+shorter than PIPE_BUF (4096 bytes on Linux) on a local file system, so no
+lock is needed. The journal can then be replayed to monitor the experiment
+without reading the run directories.
+
+Each new run of the experiment (`job run`, also with -f/--force) starts a
+segment with a marker record, e.g. {"event": "segment", "time": ...}, and
+only the last segment is replayed. A member that timed out stays so (the
+late report of its abandoned worker is ignored) until it is queued again.
+"""
+from __future__ import division
+import os
+import json
+import time
+import datetime
+from collections import OrderedDict as odict
+
+JOURNAL = 'journal.jsonl'
+STATES = ('queued', 'running', 'success', 'failed', 'timeout')
+FINAL_STATES = ('success', 'failed', 'timeout')
+SEGMENT = 'segment'
+
+
+def is_segment(record):
+    " marker record of a new experiment run "
+    return record.get('event') == SEGMENT
+
+
+def is_superseded(states, record):
+    """True if `record` is a late report for a member that timed out
+    (timeout is final until the member is queued again)
+    """
+    return states.get(record['runid']) == 'timeout' and record['state'] != 'queued'
+
+
+def append_lines(file, records):
+    """append records to a JSON lines file, in one system call
+    """
+    data = "".join(json.dumps(r)+"\n" for r in records).encode('utf-8')
+    fd = os.open(file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def read_lines(file, offset=0):
+    """read JSON lines records from `offset` (in bytes)
+    return records and new offset (incomplete last line is left out)
+    """
+    if not os.path.exists(file):
+        return [], offset
+    with open(file, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    records = [json.loads(line) for line in data[:end].decode('utf-8').splitlines() if line]
+    return records, offset + end
+
+
+class Journal(object):
+    """Experiment journal file
+    """
+    def __init__(self, file):
+        self.file = file
+
+    def record(self, runid, state, **info):
+        if runid is not None:
+            runid = int(runid)
+        r = odict([('runid', runid), ('state', state), ('time', time.time())])
+        r.update(info)
+        return r
+
+    def append(self, runid, state, **info):
+        append_lines(self.file, [self.record(runid, state, **info)])
+
+    def extend(self, runids, state, **info):
+        append_lines(self.file, [self.record(runid, state, **info) for runid in runids])
+
+    def segment(self, **info):
+        " start a new segment: earlier records are ignored by JournalSummary "
+        r = odict([('event', SEGMENT), ('time', time.time())])
+        r.update(info)
+        append_lines(self.file, [r])
+
+    def read(self, offset=0):
+        return read_lines(self.file, offset)
+
+    def summary(self):
+        return JournalSummary().update(self.read()[0])
+
+
+def _fmt_duration(seconds):
+    return str(datetime.timedelta(seconds=int(round(seconds))))
+
+
+class JournalSummary(object):
+    """Replay journal records: last state of each member, timings
+    """
+    def __init__(self):
+        self.states = {}  # runid : last state
+        self.start = None
+        self.last = None
+        self.durations = []  # of successful runs
+        self.failures = []
+
+    def update(self, records):
+        for r in records:
+            if is_segment(r):
+                self.__init__()
+                continue
+            if is_superseded(self.states, r):
+                continue
+            self.states[r['runid']] = r['state']
+            if r['state'] == 'running' and self.start is None:
+                self.start = r['time']
+            if r['state'] in FINAL_STATES:
+                self.last = r['time']
+            if r['state'] == 'success' and 'duration' in r:
+                self.durations.append(r['duration'])
+            elif r['state'] in ('failed', 'timeout'):
+                self.failures.append(r)
+        return self
+
+    def counts(self):
+        counts = odict([(state, 0) for state in STATES])
+        for state in self.states.values():
+            counts[state] += 1
+        return counts
+
+    def throughput(self, now=None):
+        " finished members per second "
+        finished = sum(self.counts()[s] for s in FINAL_STATES)
+        if self.start is None or not finished:
+            return None
+        end = self.last if self.done() else (now or time.time())
+        elapsed = end - self.start
+        return finished / elapsed if elapsed > 0 else None
+
+    def eta(self, now=None):
+        " estimated remaining time in seconds "
+        counts = self.counts()
+        remaining = counts['queued'] + counts['running']
+        throughput = self.throughput(now)
+        if not remaining:
+            return 0
+        return remaining / throughput if throughput else None
+
+    def done(self):
+        counts = self.counts()
+        return len(self.states) > 0 and counts['queued'] + counts['running'] == 0
+
+    def format(self, nfailures=5, now=None):
+        now = now or time.time()
+        counts = self.counts()
+        lines = ["Members: {} ({})".format(len(self.states),
+                    ", ".join("{} {}".format(s, counts[s]) for s in STATES))]
+        if self.start is not None:
+            end = self.last if self.done() else now
+            lines.append("Elapsed: "+_fmt_duration(end - self.start))
+        throughput = self.throughput(now)
+        if throughput:
+            lines.append("Throughput: {:.1f} members/hour".format(throughput*3600))
+        if self.durations:
+            lines.append("Mean run time: {:.1f} s".format(sum(self.durations)/len(self.durations)))
+        if not self.done():
+            eta = self.eta(now)
+            lines.append("ETA: "+(_fmt_duration(eta) if eta is not None else "unknown"))
+        if self.failures and nfailures:
+            lines.append("Recent failures:")
+            for r in self.failures[-nfailures:]:
+                date = datetime.datetime.fromtimestamp(r['time']).strftime('%Y-%m-%d %H:%M:%S')
+                lines.append("  {:<6} {:<8} {} {}".format(str(r['runid']), r['state'], date,
+                                                         r.get('error', '')))
+        return "\n".join(lines)
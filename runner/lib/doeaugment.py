@@ -0,0 +1,47 @@
+"""Augment an existing design with space-filling points
+
+New points are chosen one at a time among random candidates in the unit
+hypercube, as the candidate farthest from all existing and already added
+points (greedy maximin). The minimum distance of each candidate to the
+design is kept up to date, so that each new point costs one pass over the
+candidates, and the existing design is only visited once.
+"""
+from __future__ import division
+import numpy as np
+from runner.tools.rng import get_rng
+
+__all__ = ['augment']
+
+CANDIDATES = 20  # random candidates per new point
+BLOCK = 1000  # rows per block for distances to the existing design
+
+
+def _mindist2(candidates, design):
+    " squared distance of each candidate to the nearest design point "
+    d2min = np.full(candidates.shape[0], np.inf)
+    cnorm = (candidates**2).sum(axis=1)
+    for start in range(0, design.shape[0], BLOCK):
+        block = design[start:start+BLOCK]
+        d2 = cnorm[:, None] + (block**2).sum(axis=1)[None, :] - 2*candidates.dot(block.T)
+        d2min = np.minimum(d2min, d2.min(axis=1))
+    return np.maximum(d2min, 0)
+
+
+def augment(design, size, candidates=CANDIDATES, random_state=None):
+    """Return `size` new points in [0, 1]**n, as a size x n array
+
+    * design : existing points, m x n array in the unit hypercube
+    * candidates : number of random candidates per new point
+    * random_state : seed, SeedSequence or Generator (see runner.tools.rng)
+    """
+    design = np.asarray(design, dtype=float)
+    pool = get_rng(random_state).uniform(size=(max(size*candidates, size), design.shape[1]))
+    d2min = _mindist2(pool, design) if design.shape[0] else np.full(pool.shape[0], np.inf)
+    available = np.ones(pool.shape[0], dtype=bool)
+    new = np.empty((size, design.shape[1]))
+    for k in range(size):
+        i = np.argmax(np.where(available, d2min, -1))
+        new[k] = pool[i]
+        available[i] = False
+        d2min = np.minimum(d2min, ((pool - pool[i])**2).sum(axis=1))
+    return new
@@ -0,0 +1,134 @@
+"""Fractional factorial designs and orthogonal arrays
+
+Both return designs as level indices (n runs x k factors), to be mapped to
+actual parameter values by the caller.
+
+- fracfact : regular two-level fractional factorial 2**(k-p) of given
+  resolution, with the smallest number of runs that could be found. The k-p
+  base factors form a full factorial, and each additional factor is
+  generated as the product (interaction) of a subset of base factors. The
+  generators are searched depth-first (within a budget, after which more
+  runs are used) so that every word of the defining relation has at least
+  `resolution` letters, i.e. main effects are not aliased with interactions
+  of fewer than `resolution-1` factors.
+
+- oa : strength-2 orthogonal array OA(s**t, k, s, 2) for a prime number of
+  levels s (Rao-Hamming construction over GF(s)): runs are all vectors x of
+  GF(s)**t and each factor is the linear form x.c mod s, for distinct
+  normalized vectors c. Each pair of columns contains every combination of
+  levels equally often.
+"""
+from __future__ import division
+import itertools
+import numpy as np
+
+__all__ = ['fracfact', 'oa']
+
+MAX_BASE = 16  # at most 2**16 runs
+SEARCH_BUDGET = 10000  # generator candidates tried for a given number of runs
+
+
+def _popcount(x):
+    return bin(x).count('1')
+
+
+def _full2(p):
+    " 2**p full factorial, 0/1 levels, last factor varying fastest "
+    return (np.arange(2**p)[:, None] >> np.arange(p-1, -1, -1)) & 1
+
+
+def _search_generators(p, ngen, resolution, budget=SEARCH_BUDGET):
+    """return ngen subsets (bit masks over p base factors), or None
+
+    Columns are seen as vectors of GF(2)**p (base factors are unit vectors):
+    the design has resolution R if and only if no R-1 or fewer columns sum 
+    to zero, i.e. a new column must differ from every sum of at most R-2 
+    columns already in the design.
+    """
+    m = resolution - 2
+    candidates = sorted((c for c in range(1, 2**p) if _popcount(c) >= resolution-1),
+                        key=lambda c: (-_popcount(c), c))  # high-order interactions first
+    # sums[j] : sums of exactly j distinct columns
+    sums = [set([0])] + [set() for j in range(m)]
+    for i in range(p):
+        c = 1 << i
+        for j in range(m, 0, -1):
+            sums[j].update(x ^ c for x in sums[j-1])
+    nodes = [0]
+
+    def extend(gens, sums, start):
+        if len(gens) == ngen:
+            return gens
+        for ic in range(start, len(candidates)):
+            nodes[0] += 1
+            if nodes[0] > budget:
+                return None
+            c = candidates[ic]
+            if any(c in sj for sj in sums):
+                continue
+            new = [set(sj) for sj in sums]
+            for j in range(m, 0, -1):
+                new[j].update(x ^ c for x in sums[j-1])
+            res = extend(gens+[c], new, ic+1)
+            if res is not None:
+                return res
+        return None
+
+    return extend([], sums, 0)
+
+
+def fracfact(k, resolution=3):
+    """two-level fractional factorial design with k factors
+
+    Returns an integer array of 0 (low) and 1 (high) levels, n x k,
+    with n = 2**(k-p) as small as possible for the requested resolution.
+    """
+    if resolution < 3:
+        raise ValueError("resolution must be at least 3")
+    p = 1
+    while 2**p < k + 1:  # resolution III needs at least k+1 runs
+        p += 1
+    while p < k:
+        if p > MAX_BASE:
+            raise ValueError("no fractional design found with at most 2**{} runs".format(MAX_BASE))
+        gens = _search_generators(p, k - p, resolution)
+        if gens is not None:
+            break
+        p += 1
+    else:
+        return _full2(k)  # full factorial
+
+    base = _full2(p)
+    design = np.empty((base.shape[0], k), dtype=int)
+    design[:, :p] = base
+    for j, mask in enumerate(gens):
+        cols = [i for i in range(p) if mask >> i & 1]
+        design[:, p+j] = base[:, cols].sum(axis=1) % 2  # product of +-1 columns
+    return design
+
+
+def _is_prime(s):
+    return s >= 2 and all(s % d for d in range(2, int(s**0.5)+1))
+
+
+def oa(k, s):
+    """strength-2 orthogonal array with k factors of s levels (s prime)
+
+    Returns an integer array of levels 0..s-1, n x k, with n = s**t the
+    smallest power of s such that (s**t-1)/(s-1) >= k.
+    """
+    if not _is_prime(s):
+        raise ValueError("orthogonal arrays need a prime number of levels, got {}".format(s))
+    t = 1
+    while (s**t - 1) // (s - 1) < k:
+        t += 1
+    # normalized vectors: first non-zero coordinate is 1
+    columns = [c for c in itertools.product(range(s), repeat=t)
+               if any(c) and c[next(i for i, ci in enumerate(c) if ci)] == 1]
+    # prefer columns with several non-zero coordinates after the unit vectors,
+    # so that the first t factors form a full factorial
+    units = [c for c in columns if sum(1 for ci in c if ci) == 1]
+    others = [c for c in columns if sum(1 for ci in c if ci) > 1]
+    columns = (units + others)[:k]
+    runs = np.array(list(itertools.product(range(s), repeat=t)))
+    return runs.dot(np.array(columns).T) % s
@@ -18,10 +18,11 @@ Commit: 33903b  on Jul 13, 2015
 
 import numpy as np
 from math import factorial
+from runner.tools.rng import get_rng
 
 __all__ = ['lhs']
 
-def lhs(n, samples=None, criterion=None, iterations=None):
+def lhs(n, samples=None, criterion=None, iterations=None, random_state=None):
     """
     Generate a latin-hypercube design
     
@@ -36,11 +37,16 @@ def lhs(n, samples=None, criterion=None, iterations=None):
         The number of samples to generate for each factor (Default: n)
     criterion : str
         Allowable values are "center" or "c", "maximin" or "m", 
-        "centermaximin" or "cm", and "correlation" or "corr". If no value 
-        given, the design is simply randomized.
+        "centermaximin" or "cm", "correlation" or "corr", and "ese". If no 
+        value given, the design is simply randomized. "ese" optimizes the 
+        maximin (phi_p) criterion of a random design (see `_ese`), slower 
+        but much better for large designs than the best of a few random 
+        designs ("maximin").
     iterations : int
-        The number of iterations in the maximin and correlations algorithms
-        (Default: 5).
+        The number of iterations in the maximin, correlations and ese 
+        algorithms (Default: 5). For ese, these are outer iterations.
+    random_state : int, SeedSequence or Generator
+        See runner.tools.rng (Default: None, unpredictable)
     
     Returns
     -------
@@ -92,6 +98,7 @@ def lhs(n, samples=None, criterion=None, iterations=None):
     
     """
     H = None
+    rng = get_rng(random_state)
     
     if samples is None:
         samples = n
@@ -99,9 +106,9 @@ def lhs(n, samples=None, criterion=None, iterations=None):
     if criterion is not None:
         assert criterion.lower() in ('center', 'c', 'maximin', 'm', 
             'centermaximin', 'cm', 'correlation', 
-            'corr'), 'Invalid value for "criterion": {}'.format(criterion)
+            'corr', 'ese'), 'Invalid value for "criterion": {}'.format(criterion)
     else:
-        H = _lhsclassic(n, samples)
+        H = _lhsclassic(n, samples, rng)
 
     if criterion is None:
         criterion = 'center'
@@ -111,24 +118,27 @@ def lhs(n, samples=None, criterion=None, iterations=None):
         
     if H is None:
         if criterion.lower() in ('center', 'c'):
-            H = _lhscentered(n, samples)
+            H = _lhscentered(n, samples, rng)
         elif criterion.lower() in ('maximin', 'm'):
-            H = _lhsmaximin(n, samples, iterations, 'maximin')
+            H = _lhsmaximin(n, samples, iterations, 'maximin', rng)
         elif criterion.lower() in ('centermaximin', 'cm'):
-            H = _lhsmaximin(n, samples, iterations, 'centermaximin')
-        elif criterion.lower() in ('correlate', 'corr'):
-            H = _lhscorrelate(n, samples, iterations)
+            H = _lhsmaximin(n, samples, iterations, 'centermaximin', rng)
+        elif criterion.lower() in ('correlation', 'correlate', 'corr'):
+            H = _lhscorrelate(n, samples, iterations, rng)
+        elif criterion.lower() == 'ese':
+            H = _lhsese(n, samples, iterations, rng)
     
     return H
 
 ################################################################################
 
-def _lhsclassic(n, samples):
+def _lhsclassic(n, samples, rng=None):
+    rng = get_rng(rng)
     # Generate the intervals
     cut = np.linspace(0, 1, samples + 1)    
     
     # Fill points uniformly in each interval
-    u = np.random.rand(samples, n)
+    u = rng.random((samples, n))
     a = cut[:samples]
     b = cut[1:samples + 1]
     rdpoints = np.zeros_like(u)
@@ -138,19 +148,20 @@ def _lhsclassic(n, samples):
     # Make the random pairings
     H = np.zeros_like(rdpoints)
     for j in range(n):
-        order = np.random.permutation(range(samples))
+        order = rng.permutation(samples)
         H[:, j] = rdpoints[order, j]
     
     return H
     
 ################################################################################
 
-def _lhscentered(n, samples):
+def _lhscentered(n, samples, rng=None):
+    rng = get_rng(rng)
     # Generate the intervals
     cut = np.linspace(0, 1, samples + 1)    
     
     # Fill points uniformly in each interval
-    u = np.random.rand(samples, n)
+    u = rng.random((samples, n))
     a = cut[:samples]
     b = cut[1:samples + 1]
     _center = (a + b)/2
@@ -158,38 +169,167 @@ def _lhscentered(n, samples):
     # Make the random pairings
     H = np.zeros_like(u)
     for j in range(n):
-        H[:, j] = np.random.permutation(_center)
+        H[:, j] = rng.permutation(_center)
     
     return H
     
 ################################################################################
 
-def _lhsmaximin(n, samples, iterations, lhstype):
+def _lhsmaximin(n, samples, iterations, lhstype, rng=None):
+    rng = get_rng(rng)
     maxdist = 0
     
     # Maximize the minimum distance between points
     for i in range(iterations):
         if lhstype=='maximin':
-            Hcandidate = _lhsclassic(n, samples)
+            Hcandidate = _lhsclassic(n, samples, rng)
         else:
-            Hcandidate = _lhscentered(n, samples)
+            Hcandidate = _lhscentered(n, samples, rng)
         
-        d = _pdist(Hcandidate)
-        if maxdist<np.min(d):
-            maxdist = np.min(d)
+        d = _mindist(Hcandidate)
+        if maxdist<d:
+            maxdist = d
             H = Hcandidate.copy()
     
     return H
 
 ################################################################################
 
-def _lhscorrelate(n, samples, iterations):
+def _lhsese(n, samples, iterations, rng=None):
+    # Start from a random design, then optimize it
+    rng = get_rng(rng)
+    H = _lhsclassic(n, samples, rng)
+    if samples < 3:
+        return H
+    return _ese(H, iterations, rng=rng)
+
+################################################################################
+
+PHI_P = 10  # exponent of the phi_p criterion (large p ~ maximin)
+ESE_MAX_SWAPS = 50  # candidate swaps per inner iteration
+ESE_MAX_INNER = 100  # inner iterations per outer iteration
+
+def _sqdist_rows(H, rows, sqnorm):
+    """squared distances between rows `rows` of H and all rows of H, 
+    len(rows)-by-samples (matrix product, no samples-by-samples matrix)
+    """
+    d2 = sqnorm[rows][:, None] + sqnorm[None, :] - 2*H[rows].dot(H.T)
+    return np.maximum(d2, 1e-300)
+
+def _mindist(H, block=1000):
+    """minimum distance between rows, computed by blocks of rows
+    """
+    sqnorm = (H**2).sum(axis=1)
+    d2min = np.inf
+    for start in range(0, H.shape[0], block):
+        rows = np.arange(start, min(start+block, H.shape[0]))
+        d2 = _sqdist_rows(H, rows, sqnorm)
+        mask = np.arange(H.shape[0])[None, :] > rows[:, None]  # pairs i < j
+        if mask.any():
+            d2min = min(d2min, d2[mask].min())
+    return np.sqrt(d2min)
+
+def _phisum(H, p=PHI_P, block=1000):
+    """sum of d**-p over all pairs of rows, computed by blocks of rows
+    """
+    sqnorm = (H**2).sum(axis=1)
+    total = 0.
+    for start in range(0, H.shape[0], block):
+        rows = np.arange(start, min(start+block, H.shape[0]))
+        d2 = _sqdist_rows(H, rows, sqnorm)
+        mask = np.arange(H.shape[0])[None, :] > rows[:, None]  # pairs i < j
+        total += (d2[mask]**(-p/2.)).sum()
+    return total
+
+def _ese(H, iterations, p=PHI_P, rng=None):
+    """Enhanced stochastic evolutionary (ESE) optimization of the phi_p
+    criterion of a latin hypercube design, by exchange of two elements 
+    within a column (Jin, Chen and Sudjianto, 2005)
+
+    A swap only changes the distances from the two swapped rows to all 
+    others, so that each candidate swap is evaluated in O(samples x n), 
+    vectorized over the batch of candidates, and the sum of d**-p is updated
+    incrementally. Candidates are accepted with a threshold that adapts 
+    to the acceptance and improvement rates of each outer iteration.
+    """
+    H = H.copy()
+    rng = get_rng(rng)
+    samples, n = H.shape
+    nswaps = min(ESE_MAX_SWAPS, max(1, samples*(samples-1)//10))
+    ninner = min(ESE_MAX_INNER, max(1, 2*samples*n//nswaps))
+    samplerange = np.arange(samples)
+
+    S = _phisum(H, p)
+    phi = S**(1./p)
+    best, best_phi = H.copy(), phi
+    T = 0.005*phi  # acceptance threshold
+
+    for outer in range(iterations):
+        best_before = best_phi
+        naccepted = nimproved = 0
+        sqnorm = (H**2).sum(axis=1)
+        for inner in range(ninner):
+            k = (outer*ninner + inner) % n  # column
+            # candidate pairs of distinct rows
+            i1 = rng.integers(0, samples, nswaps)
+            i2 = (i1 + rng.integers(1, samples, nswaps)) % samples
+            rows = np.concatenate([i1, i2])
+            d2 = _sqdist_rows(H, rows, sqnorm)
+            old1, old2 = d2[:nswaps], d2[nswaps:]
+            xk = H[:, k][None, :]
+            a, b = H[i1, k][:, None], H[i2, k][:, None]
+            new1 = old1 - (a - xk)**2 + (b - xk)**2
+            new2 = old2 - (b - xk)**2 + (a - xk)**2
+            # distances to the swapped rows themselves are unchanged
+            mask = (samplerange[None, :] != i1[:, None]) & (samplerange[None, :] != i2[:, None])
+            old1, old2, new1, new2 = [np.where(mask, np.maximum(d, 1e-300), 1.) 
+                                      for d in (old1, old2, new1, new2)]
+            q = -p/2.
+            delta = (new1**q + new2**q - old1**q - old2**q).sum(axis=1)
+            c = delta.argmin()
+            new_phi = max(S + delta[c], 0)**(1./p)
+            if new_phi - phi <= T*rng.random():
+                r1, r2 = i1[c], i2[c]
+                H[r1, k], H[r2, k] = H[r2, k], H[r1, k]
+                sqnorm[[r1, r2]] = (H[[r1, r2]]**2).sum(axis=1)
+                S += delta[c]
+                phi = new_phi
+                naccepted += 1
+                if phi < best_phi:
+                    best, best_phi = H.copy(), phi
+                    nimproved += 1
+
+        # exact sum again, to avoid the drift of incremental updates
+        S = _phisum(H, p)
+        phi = S**(1./p)
+
+        # update threshold
+        ratio = naccepted/float(ninner)
+        if best_phi < best_before - 1e-12:
+            # improvement process
+            if ratio > 0.1 and nimproved < naccepted:
+                T *= 0.8
+            elif ratio <= 0.1:
+                T /= 0.8
+        else:
+            # exploration process
+            if ratio < 0.1:
+                T /= 0.7
+            elif ratio > 0.8:
+                T *= 0.9
+
+    return best
+
+################################################################################
+
+def _lhscorrelate(n, samples, iterations, rng=None):
+    rng = get_rng(rng)
     mincorr = np.inf
     
     # Minimize the components correlation coefficients
     for i in range(iterations):
         # Generate a random LHS
-        Hcandidate = _lhsclassic(n, samples)
+        Hcandidate = _lhsclassic(n, samples, rng)
         R = np.corrcoef(Hcandidate)
         if np.max(np.abs(R[R!=1]))<mincorr:
             mincorr = np.max(np.abs(R-np.eye(R.shape[0])))
@@ -238,9 +378,5 @@ def _pdist(x):
     if m<2:
         return []
     
-    d = []
-    for i in range(m - 1):
-        for j in range(i + 1, m):
-            d.append((sum((x[j, :] - x[i, :])**2))**0.5)
-    
-    return np.array(d)
+    i, j = np.triu_indices(m, 1)
+    return np.sqrt(((x[j] - x[i])**2).sum(axis=1))
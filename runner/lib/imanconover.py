@@ -0,0 +1,54 @@
+"""Rank correlation induction (Iman and Conover, 1982)
+
+The values of each column of a sample are reordered, so that the sample has
+(approximately) a target rank correlation matrix. The marginal distributions
+are unchanged, e.g. each column of a latin hypercube design remains
+stratified.
+
+Iman, R. L., & Conover, W. J. (1982). A distribution-free approach to
+inducing rank correlation among input variables. Communications in
+Statistics - Simulation and Computation, 11(3), 311-334.
+"""
+from __future__ import division
+import numpy as np
+from runner.tools.rng import get_rng
+
+__all__ = ['iman_conover', 'check_corr']
+
+
+def check_corr(corr, n):
+    " check and return a n x n correlation matrix as array "
+    corr = np.asarray(corr, dtype=float)
+    if corr.shape != (n, n):
+        raise ValueError("correlation matrix: expected {} x {}, got {}".format(n, n, corr.shape))
+    if not np.allclose(corr, corr.T) or not np.allclose(np.diag(corr), 1):
+        raise ValueError("correlation matrix must be symmetric with unit diagonal")
+    try:
+        np.linalg.cholesky(corr)
+    except np.linalg.LinAlgError:
+        raise ValueError("correlation matrix must be positive definite")
+    return corr
+
+
+def iman_conover(values, corr, random_state=None):
+    """Reorder the columns of `values` (N x p) to match the rank correlation
+    matrix `corr` (p x p), return a new array
+
+    Van der Waerden scores are randomly permuted in each column, decorrelated
+    by the Cholesky factor of their sample correlation, and correlated by
+    the Cholesky factor of `corr`. Each column of `values` is then sorted to
+    follow the ranks of the scores. All steps are array operations.
+    """
+    from scipy.special import ndtri
+    values = np.asarray(values)
+    corr = check_corr(corr, values.shape[1])
+    size = values.shape[0]
+    rng = get_rng(random_state)
+    scores = ndtri(np.arange(1, size+1) / (size+1))
+    perm = np.argsort(rng.random(values.shape), axis=0)  # one permutation per column
+    M = scores[perm]
+    E = np.corrcoef(M, rowvar=False).reshape(values.shape[1], values.shape[1])
+    # T = M Q^-T P^T, with E = Q Q^T and corr = P P^T (rows of M are samples)
+    T = M.dot(np.linalg.solve(np.linalg.cholesky(E).T, np.linalg.cholesky(corr).T))
+    ranks = np.argsort(np.argsort(T, axis=0), axis=0)
+    return np.take_along_axis(np.sort(values, axis=0), ranks, axis=0)
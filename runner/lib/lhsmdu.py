@@ -5,7 +5,7 @@ Note from the author
 Author: Sahil Moza
 Date: Jan 21, 2016
 
-This is an implementation of Latin Hypercube Sampling with Multi-Dimensional Uniformity (LHS-MDU) from Deutsch and Deutsch, "Latin hypercube sampling with multidimensional uniformity", Journal of Statistical Planning and Inference 142 (2012) , 763-772 
+This is an implementation of Latin Hypercube Sampling with Multi-Dimensional Uniformity (LHS-MDU) from Deutsch and Deutsch, "Latin hypercube sampling with multidimensional uniformity", Journal of Statistical Planning and Inference 142 (2012) , 763-772
 
 ***Currently only for independent variables***
 
@@ -13,116 +13,184 @@ Copied from
 -----------
 https://github.com/sahilm89/lhsmdu/blob/master/lhsmdu/__init__.py
 on Oct 19, 2016 (0e4cd34)
+
+Note M. Perrette:
+Vectorized with numpy. The full I x I distance matrix is replaced by a cache
+of nearest neighbours per realization, and realizations are eliminated by
+batches (see eliminateRealizationsToStrata). Samples are drawn in the strata
+given by the ranks of the retained realizations.
 """
 
 from __future__ import absolute_import, division, print_function, unicode_literals
-from numpy.linalg import norm
-from numpy import random, matrix, zeros, triu_indices, sum, argsort, ravel, max
-from numpy import min as minimum
-from runner.tools import  rv_continuous, rv_discrete, rv_frozen
+import numpy as np
+from runner.tools.rng import get_rng
 
 ##### Default variables #####
 scalingFactor = 5 ## number > 1 (M) Chosen as 5 as suggested by the paper (above this no improvement.
 numToAverage = 2 ## Number of nearest neighbours to average, as more does not seem to add more information (from paper).
-randomSeed = 42 ## Seed for the random number generator 
+randomSeed = 42 ## Seed for the random number generator
+
+numNeighbours = 10 ## Size of the nearest neighbours cache (> numToAverage)
+eliminationBatch = 0.05 ## Max fraction of remaining realizations eliminated per batch
+kdTreeMaxDimensions = 10 ## k-d tree neighbour search up to this dimension, brute force above
+blockSize = 1000 ## Rows per block in brute force distance computations
 
 
-def createRandomStandardUniformMatrix(nrow, ncol):
+def createRandomStandardUniformMatrix(nrow, ncol, rng=None):
     ''' Creates a matrix with elements drawn from a uniform distribution in [0,1]'''
-    rows = [ [random.random() for i in range(ncol)] for j in range(nrow)]
-    return matrix(rows)
+    return get_rng(rng).random((nrow, ncol))
 
 def findUpperTriangularColumnDistanceVector(inputMatrix, ncol):
     ''' Finds the 1-D upper triangular euclidean distance vector for the columns of a matrix.'''
     assert ncol == inputMatrix.shape[1]
-    distance_1D = []
-    for i in range(ncol-1):
-        for j in range(i+1,ncol):
-            realization_i, realization_j  = inputMatrix[:,i], inputMatrix[:,j]
-            distance_1D.append(norm(realization_i - realization_j))
-    return distance_1D
+    points = np.asarray(inputMatrix).T
+    i, j = np.triu_indices(ncol, k=1)
+    return np.sqrt(((points[i] - points[j])**2).sum(axis=1))
 
 def createSymmetricDistanceMatrix(distance, nrow):
     ''' Creates a symmetric distance matrix from an upper triangular 1D distance vector.'''
-    distMatrix = zeros((nrow,nrow))
-    indices = triu_indices(nrow,k=1)
+    distMatrix = np.zeros((nrow,nrow))
+    indices = np.triu_indices(nrow,k=1)
     distMatrix[indices] = distance
     distMatrix[(indices[1], indices[0])] = distance # Making symmetric matrix
     return distMatrix
 
-def eliminateRealizationsToStrata(distance_1D, matrixOfRealizations, numSamples, numToAverage = numToAverage):
-    ''' Eliminating realizations using average distance measure to give Strata '''
-
+def _sqdist(points, rows, candidates):
+    ''' Squared euclidean distances between points[rows] and points[candidates], by matrix product '''
+    a, b = points[rows], points[candidates]
+    d2 = (a**2).sum(axis=1)[:, None] - 2*a.dot(b.T)
+    d2 += (b**2).sum(axis=1)[None, :]
+    return np.maximum(d2, 0, out=d2)
+
+def _queryNeighbours(points, rows, candidates, k):
+    ''' k+1 nearest candidates (including self) of points[rows]: k-d tree in
+    low dimension, brute force by blocks of rows otherwise '''
+    if points.shape[1] <= kdTreeMaxDimensions:
+        from scipy.spatial import cKDTree
+        d, i = cKDTree(points[candidates]).query(points[rows], k=k+1)
+        return d.reshape(rows.size, k+1), i.reshape(rows.size, k+1)
+    d = np.empty((rows.size, k+1))
+    i = np.empty((rows.size, k+1), dtype=int)
+    for start in range(0, rows.size, blockSize):
+        d2 = _sqdist(points, rows[start:start+blockSize], candidates)
+        part = np.argpartition(d2, k, axis=1)[:, :k+1]
+        dpart = np.take_along_axis(d2, part, axis=1)
+        order = np.argsort(dpart, axis=1)
+        i[start:start+blockSize] = np.take_along_axis(part, order, axis=1)
+        d[start:start+blockSize] = np.sqrt(np.take_along_axis(dpart, order, axis=1))
+    return d, i
+
+def _nearestNeighbours(points, rows, alive, k):
+    ''' Indices and distances of the k nearest alive neighbours of points[rows], sorted '''
+    candidates = np.flatnonzero(alive)
+    ncache, k = k, min(k, candidates.size - 1)
+    # when fewer neighbours remain, the last one is repeated at infinite distance
+    idx = np.empty((rows.size, ncache), dtype=int)
+    dist = np.full((rows.size, ncache), np.inf)
+    d, i = _queryNeighbours(points, rows, candidates, k)
+    i = candidates[i]
+    notself = np.argsort(i == rows[:, None], axis=1, kind='stable')[:, :k]  # rows are alive
+    idx[:, :k] = np.take_along_axis(i, notself, axis=1)
+    dist[:, :k] = np.take_along_axis(d, notself, axis=1)
+    idx[:, k:] = idx[:, k-1:k]
+    return idx, dist
+
+def eliminateRealizationsToStrata(matrixOfRealizations, numSamples, numToAverage = numToAverage):
+    ''' Eliminating realizations using average distance measure to give Strata
+
+    Realizations with the smallest average distance to their numToAverage
+    nearest (remaining) neighbours are eliminated first. Candidates are taken
+    by batches, in order of average distance, skipping those whose nearest
+    neighbours were eliminated in the same batch (their average distance
+    has increased, to be updated for the next batch).
+    '''
+    matrixOfRealizations = np.asarray(matrixOfRealizations)
     numDimensions = matrixOfRealizations.shape[0]
     numRealizations = matrixOfRealizations.shape[1]
-    ## Creating a symmetric IxI distance matrix from the triangular matrix 1D vector.
-    distMatrix = createSymmetricDistanceMatrix(distance_1D, numRealizations)
- 
-    ## Finding columns from the realization matrix by elimination of nearest neighbours L strata are left.
-    averageDistance = {i:0 for i in range(numRealizations)}
-    
-    while(len(averageDistance)>numSamples):
-        for rowNum in sorted(averageDistance.keys()):
-            meanAvgDist = sum( sorted( distMatrix[ rowNum, sorted(averageDistance.keys())])[:numToAverage+1])/numToAverage
-            averageDistance.update( {rowNum: meanAvgDist }) # +1 to remove the zero index, appending averageDistance to list
-        indexToDelete = min(averageDistance, key=averageDistance.get)
-        del averageDistance[indexToDelete]
-    
+    points = matrixOfRealizations.T
+    m = min(numToAverage, numSamples)  # at least numSamples+1 realizations are alive in update
+    alive = np.ones(numRealizations, dtype=bool)
+    nbr_idx, nbr_dist = _nearestNeighbours(points, np.arange(numRealizations), alive, max(numNeighbours, m))
+
+    top = np.empty((numRealizations, m), dtype=int)  # current m nearest alive neighbours
+    averageDistance = np.empty(numRealizations)
+
+    def update(rows):
+        valid = alive[nbr_idx[rows]]
+        short = valid.sum(axis=1) < m
+        if short.any():  # cache exhausted: search again among alive realizations
+            nbr_idx[rows[short]], nbr_dist[rows[short]] = _nearestNeighbours(points, rows[short], alive, nbr_idx.shape[1])
+            valid = alive[nbr_idx[rows]]
+        # first m valid entries of each (sorted) cache row
+        first = np.argsort(~valid, axis=1, kind='stable')[:, :m]
+        top[rows] = np.take_along_axis(nbr_idx[rows], first, axis=1)
+        averageDistance[rows] = np.take_along_axis(nbr_dist[rows], first, axis=1).mean(axis=1)
+
+    update(np.arange(numRealizations))
+
+    numAlive = numRealizations
+    while numAlive > numSamples:
+        batch = min(numAlive - numSamples, max(1, int(numAlive*eliminationBatch)))
+        dist = np.where(alive, averageDistance, np.inf)
+        candidates = np.argpartition(dist, batch-1)[:batch]
+        candidates = candidates[np.argsort(dist[candidates], kind='stable')]
+        deleted = []
+        for c in candidates:
+            if not alive[top[c]].all():
+                continue  # stale average distance
+            alive[c] = False
+            deleted.append(c)
+        numAlive -= len(deleted)
+        if numAlive > numSamples:
+            affected = np.flatnonzero(alive & ~alive[top].all(axis=1))
+            update(affected)
+
     # Creating the strata matrix to draw samples from.
-    StrataMatrix = matrixOfRealizations[:,sorted(averageDistance.keys())]
+    StrataMatrix = matrixOfRealizations[:, alive]
 
     assert numSamples == StrataMatrix.shape[1]
     assert numDimensions == StrataMatrix.shape[0]
-    #print ( StrataMatrix )
     return StrataMatrix
 
 def inverseTransformSample(distribution, uniformSamples):
     ''' This function lets you convert from a standard uniform sample [0,1] to
-    a sample from an arbitrary distribution. This is done by taking the cdf [0,1] of 
+    a sample from an arbitrary distribution. This is done by taking the cdf [0,1] of
     the arbitrary distribution, and calculating its inverse to picking the sample."
+
+    Any object with a `ppf` method is accepted (e.g. scipy.stats distribution,
+    frozen or not, or runner.tools.dist.DiscreteDist).
     '''
-    assert (isinstance(distribution, rv_continuous) or isinstance(distribution, rv_discrete) or isinstance(distribution,rv_frozen))
+    if not hasattr(distribution, 'ppf'):
+        raise TypeError("distribution must have a ppf method, got {}".format(type(distribution)))
     newSamples = distribution.ppf(uniformSamples)
     return newSamples
-    
-def resample():
+
+def resample(matrixOfStrata, rng=None):
     ''' Resampling function from the same strata'''
-    numDimensions = matrixOfStrata.shape[0]
-    numSamples = matrixOfStrata.shape[1]
-
-    matrixOfSamples = []
-    
-    # Creating Matrix of Samples from the strata ordering.
-    for row in range(numDimensions):
-        sortedIndicesOfStrata = argsort(ravel(matrixOfStrata[row,:]))
-    
-        # Generating stratified samples
-        newSamples =  [ (float(x)/numSamples) + (random.random()/numSamples) for x in sortedIndicesOfStrata ]
-        matrixOfSamples.append(newSamples)
-    
-    assert minimum(matrixOfSamples)>=0.
-    assert max(matrixOfSamples)<=1.
-    
-    return matrix(matrixOfSamples)
+    numDimensions, numSamples = matrixOfStrata.shape
+
+    # rank of each realization along each dimension is its stratum
+    ranks = np.argsort(np.argsort(matrixOfStrata, axis=1), axis=1)
+    matrixOfSamples = (ranks + get_rng(rng).random((numDimensions, numSamples)))/numSamples
+
+    assert matrixOfSamples.min() >= 0.
+    assert matrixOfSamples.max() <= 1.
+
+    return matrixOfSamples
 
 def sample(numDimensions, numSamples, scalingFactor=scalingFactor, numToAverage = numToAverage, randomSeed=randomSeed ):
-    ''' Main LHS-MDU sampling function '''
-    random.seed(randomSeed) ## Seeding the random number generator.
+    ''' Main LHS-MDU sampling function, returns a numDimensions x numSamples array '''
+    rng = get_rng(randomSeed) ## seed, SeedSequence or Generator (see runner.tools.rng)
 
     ### Number of realizations (I) = Number of samples(L) x scale for oversampling (M)
     numRealizations = scalingFactor*numSamples ## Number of realizations (I)
     ### Creating NxI realization matrix
-    matrixOfRealizations =  createRandomStandardUniformMatrix(numDimensions, numRealizations)
-    
-    ### Finding distances between column vectors of the matrix to create a distance matrix.
-    distance_1D = findUpperTriangularColumnDistanceVector(matrixOfRealizations, numRealizations)
-    
+    matrixOfRealizations =  createRandomStandardUniformMatrix(numDimensions, numRealizations, rng)
+
     ## Eliminating columns from the realization matrix, using the distance measure  to get a strata
     ## matrix with number of columns as number of samples requried.
+    matrixOfStrata = eliminateRealizationsToStrata(matrixOfRealizations, numSamples, numToAverage)
 
-    global matrixOfStrata
-    matrixOfStrata = eliminateRealizationsToStrata(distance_1D, matrixOfRealizations, numSamples)
+    matrixOfSamples = resample(matrixOfStrata, rng)
 
-    matrixOfSamples = resample() 
-    
     return matrixOfSamples
@@ -11,29 +11,22 @@ import math
 
 import numpy
 
-def nolh(conf, remove=None):
-    """Constructs a Nearly Orthogonal Latin Hypercube (NOLH) of order *m* from
-    a configuration vector *conf*. The configuration vector may contain either
-    the numbers in $[0 q-1]$ or $[1 q]$ where $q = 2^{m-1}$. The columns to be
-    *removed* are also in $[0 d-1]$ or $[1 d]$ where $d = m + \binom{m-1}{2}$
-    is the NOLH dimensionality.
+from runner.tools.rng import get_rng
+
+NOLH_ITERATIONS = 5000  # swap search on the configuration vector, see design
+
+def _structure(q):
+    """Row permutations P and signs S of the NOLH of order *m* (q = 2^{m-1}),
+    such that the design columns are conf[P] * S, for a 0-based *conf*.
     """
     I = numpy.identity(2, dtype=int)
     R = numpy.array(((0, 1),
                      (1, 0)), dtype=int)
 
-    if 0 in conf:
-        conf = numpy.array(conf) + 1
-
-        if remove is not None:
-            remove = numpy.array(remove) + 1
-
-
-    q = len(conf)
-    m = math.log(q, 2) + 1
-    s = m + (math.factorial(m - 1) / (2 * math.factorial(m - 3)))
-    # Factorial checks if m is an integer
-    m = int(m)
+    m = int(round(math.log(q, 2))) + 1
+    if 2**(m - 1) != q:
+        raise ValueError("configuration length must be a power of 2, got {}".format(q))
+    s = m + (m - 1) * (m - 2) // 2
 
     A = numpy.zeros((q, q, m - 1), dtype=int)
     for i in range(1, m):
@@ -45,17 +38,19 @@ def nolh(conf, remove=None):
                 Ai = numpy.kron(Ai, R)
 
         A[:, :, i-1] = Ai
-    
-    M = numpy.zeros((q, s), dtype=int)
-    M[:, 0] = conf
-    
+
+    # A are permutation matrices: apply them to the row indices
+    index = numpy.arange(q)
+    P = numpy.zeros((q, s), dtype=int)
+    P[:, 0] = index
+
     col = 1
     for i in range(0, m - 1):
         for j in range(i + 1, m):
             if i == 0:
-                M[:, col] = numpy.dot(A[:, :, j-1], conf)
+                P[:, col] = numpy.dot(A[:, :, j-1], index)
             else:
-                M[:, col] = numpy.dot(A[:, :, i-1], numpy.dot(A[:, :, j-1], conf))
+                P[:, col] = numpy.dot(A[:, :, i-1], numpy.dot(A[:, :, j-1], index))
             col += 1
 
     S = numpy.ones((q, s), dtype=int)
@@ -72,13 +67,32 @@ def nolh(conf, remove=None):
             S[:, col] = S[:, i] * S[:, j]
             col += 1
 
-    T = M * S
-    
+    return P, S
+
+def nolh(conf, remove=None):
+    """Constructs a Nearly Orthogonal Latin Hypercube (NOLH) of order *m* from
+    a configuration vector *conf*. The configuration vector may contain either
+    the numbers in $[0 q-1]$ or $[1 q]$ where $q = 2^{m-1}$. The columns to be
+    *removed* are also in $[0 d-1]$ or $[1 d]$ where $d = m + \binom{m-1}{2}$
+    is the NOLH dimensionality.
+    """
+    if 0 in conf:
+        conf = numpy.array(conf) + 1
+
+        if remove is not None:
+            remove = numpy.array(remove) + 1
+
+    conf = numpy.asarray(conf)
+    q = len(conf)
+    P, S = _structure(q)
+    s = P.shape[1]
+    T = conf[P] * S
+
     keep = numpy.ones(s, dtype=bool)
     if remove is not None:
-        keep[numpy.array(remove) - 1] = [False] * len(remove)
+        keep[numpy.asarray(remove, dtype=int) - 1] = False
     
-    return (numpy.concatenate((T, numpy.zeros((1, s)), -T), axis=0)[:, keep] + 8) / (2.0 * q)
+    return (numpy.concatenate((T, numpy.zeros((1, s)), -T), axis=0)[:, keep] + q) / (2.0 * q)
 
 def params(dim):
     """Returns the NOLH order $m$, the required configuration length $q$
@@ -90,7 +104,7 @@ def params(dim):
     
     while s < dim:
         m += 1
-        s = m + math.factorial(m - 1) / (2 * math.factorial(m - 3))
+        s = m + (m - 1) * (m - 2) // 2
         q = 2**(m-1)
 
     return m, q, s - dim
@@ -217,6 +231,104 @@ CONF = dict()
 CONF.update(C_CONF)
 CONF.update(EA_CONF)
 
+
+def _max_correlation(H):
+    """Largest absolute correlation between two columns, and sum of squares"""
+    if H.shape[1] < 2:
+        return 0., 0.
+    C = numpy.corrcoef(H.T)
+    numpy.fill_diagonal(C, 0)
+    return numpy.abs(C).max(), (C**2).sum()
+
+def _reduce(H, dim):
+    """Greedily remove the column whose removal most reduces the correlation"""
+    keep = list(range(H.shape[1]))
+    while len(keep) > dim:
+        scores = [_max_correlation(H[:, [k for k in keep if k != j]]) for j in keep]
+        keep.pop(scores.index(min(scores)))
+    return keep
+
+def _repair(conf):
+    """Make a (1-based) configuration vector a permutation of 1..q
+
+    Some of the vendored EA configurations are not permutations (a value
+    repeated, or out of range, as in the original package). Repeated and
+    out-of-range entries are replaced, in order, by the missing values, 
+    and the tables themselves are left unchanged.
+    """
+    conf = numpy.array(conf)
+    q = len(conf)
+    missing = iter(sorted(set(range(1, q+1)) - set(conf.tolist())))
+    seen = set()
+    for i, c in enumerate(conf.tolist()):
+        if c < 1 or c > q or c in seen:
+            conf[i] = next(missing)
+        seen.add(c)
+    return conf
+
+def _improve(conf, keep, iterations=NOLH_ITERATIONS, random_state=0):
+    """Swap pairs of elements of the (1-based) configuration vector as long
+    as the sum of squared correlations between *keep* columns does not 
+    increase, and then their maximum. The design
+    stays a latin hypercube. Columns of [T; 0; -T] have zero mean and the
+    same norm, so that their correlation is T'T / conf'conf.
+    """
+    P, S = _structure(len(conf))
+    P, S = P[:, keep], S[:, keep]
+    norm = float(numpy.dot(conf, conf))
+
+    def score(c):
+        T = c[P] * S
+        C = numpy.dot(T.T, T) / norm
+        numpy.fill_diagonal(C, 0)
+        return (C**2).sum(), numpy.abs(C).max()
+
+    rng = get_rng(random_state)
+    conf = numpy.array(conf)
+    # the sum of squares is smoother, then lower the maximum
+    for order in (1, -1):
+        best = score(conf)[::order]
+        for i, j in rng.integers(len(conf), size=(iterations, 2)):
+            conf[i], conf[j] = conf[j], conf[i]
+            new = score(conf)[::order]
+            if new <= best:
+                best = new
+            else:
+                conf[i], conf[j] = conf[j], conf[i]
+    return conf
+
+def design(dim, iterations=NOLH_ITERATIONS):
+    """Best NOLH design with *dim* columns, in [0, 1]
+
+    The configurations of the smallest order with at least *dim* columns are
+    evaluated, after _repair: the published column removals for each dimension
+    (CONF), followed by greedy removal of the most correlated columns until *dim* are 
+    left. The configuration vector of the design with the lowest maximum 
+    (then sum of squared) correlation between columns is then improved by 
+    a seeded swap search (see _improve). The 2q+1 levels are mapped 
+    to the centers of 2q+1 equal strata, so that the design can be 
+    transformed by any distribution's ppf.
+    """
+    orders = sorted(set(len(conf) for d, (conf, remove) in CONF.items() if d >= dim))
+    if not orders:
+        raise ValueError("NOLH designs are available for at most {} parameters".format(max(CONF)))
+    q = orders[0]
+    best = None
+    for d, (conf, remove) in sorted(CONF.items()):
+        if len(conf) != q or d < dim:
+            continue
+        conf = _repair(conf)
+        H = nolh(conf)
+        kept = numpy.setdiff1d(numpy.arange(H.shape[1]), numpy.asarray(remove, dtype=int) - 1)
+        keep = kept[_reduce(H[:, kept], dim)]
+        score = _max_correlation(H[:, keep])
+        if best is None or score < best[0]:
+            best = score, conf, keep
+    score, conf, keep = best
+    conf = _improve(conf, keep, iterations)
+    H = nolh(conf)[:, keep]
+    return (H * 2 * q + 0.5) / (2 * q + 1)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=("Compute a Nearly "
         "Orthogonal Latin hypercube from a configuration vector."))
@@ -0,0 +1,152 @@
+"""Live metrics of a running ensemble, in Prometheus text format
+
+Metrics are derived from the experiment journal (see runner.journal), so they
+do not depend on how members are executed, and are served by a minimal HTTP
+server running in a background thread of the orchestrator:
+
+    job run --metrics-port 8000 ...
+    curl http://localhost:8000/metrics
+"""
+from __future__ import division
+import threading
+from collections import OrderedDict as odict
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from runner.journal import STATES, is_segment, is_superseded
+
+# histogram buckets, in seconds
+RUNTIME_BUCKETS = (1, 5, 10, 30, 60, 300, 600, 1800, 3600, 3*3600, 12*3600, 48*3600)
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, 300, 3600)
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0]*len(buckets)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name):
+        lines = []
+        for b, c in zip(self.buckets, self.counts):
+            lines.append('{}_bucket{{le="{}"}} {}'.format(name, b, c))
+        lines.append('{}_bucket{{le="+Inf"}} {}'.format(name, self.count))
+        lines.append('{}_sum {}'.format(name, self.sum))
+        lines.append('{}_count {}'.format(name, self.count))
+        return lines
+
+
+class JournalMetrics(object):
+    """Aggregate journal records into metrics, reading only new records
+    """
+    def __init__(self, journal, max_workers=None):
+        self.journal = journal
+        self.max_workers = max_workers
+        self.offset = 0
+        self.states = {}
+        self.queued = {}  # runid: time queued
+        self.runtime = Histogram(RUNTIME_BUCKETS)
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self._lock = threading.Lock()
+
+    def update(self):
+        records, self.offset = self.journal.read(self.offset)
+        for r in records:
+            if is_segment(r):
+                # new experiment run: histograms restart too (a counter reset)
+                self.states = {}
+                self.queued = {}
+                self.runtime = Histogram(self.runtime.buckets)
+                self.latency = Histogram(self.latency.buckets)
+                continue
+            if is_superseded(self.states, r):
+                continue
+            runid, state = r['runid'], r['state']
+            self.states[runid] = state
+            if state == 'queued':
+                self.queued[runid] = r['time']
+            elif state == 'running' and runid in self.queued:
+                self.latency.observe(r['time'] - self.queued.pop(runid))
+            elif state in ('success', 'failed') and 'duration' in r:
+                self.runtime.observe(r['duration'])
+        return self
+
+    def counts(self):
+        counts = odict([(state, 0) for state in STATES])
+        for state in self.states.values():
+            counts[state] += 1
+        return counts
+
+    def render(self):
+        with self._lock:
+            self.update()
+            counts = self.counts()
+            lines = [
+                '# HELP runner_members Number of ensemble members in each state',
+                '# TYPE runner_members gauge',
+            ]
+            for state in STATES:
+                lines.append('runner_members{{state="{}"}} {}'.format(state, counts[state]))
+            lines += [
+                '# HELP runner_member_runtime_seconds Run time of finished members',
+                '# TYPE runner_member_runtime_seconds histogram',
+            ] + self.runtime.lines('runner_member_runtime_seconds') + [
+                '# HELP runner_dispatch_latency_seconds Time from queued to running',
+                '# TYPE runner_dispatch_latency_seconds histogram',
+            ] + self.latency.lines('runner_dispatch_latency_seconds')
+            if self.max_workers:
+                lines += [
+                    '# HELP runner_workers Number of workers',
+                    '# TYPE runner_workers gauge',
+                    'runner_workers {}'.format(self.max_workers),
+                    '# HELP runner_worker_utilisation Fraction of workers running a member',
+                    '# TYPE runner_worker_utilisation gauge',
+                    'runner_worker_utilisation {}'.format(counts['running']/self.max_workers),
+                ]
+            return "\n".join(lines)+"\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.rstrip('/') not in ('', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsServer(object):
+    """Serve JournalMetrics over HTTP (localhost only by default)
+    """
+    def __init__(self, journal, port, max_workers=None, host='127.0.0.1'):
+        self.httpd = HTTPServer((host, port), _MetricsHandler)
+        self.httpd.metrics = JournalMetrics(journal, max_workers)
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
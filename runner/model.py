@@ -4,23 +4,60 @@ import os
 import logging
 import sys
 import json, pickle
+import inspect
 import datetime
+import time
 from collections import OrderedDict as odict, namedtuple
 import six
+import numpy as np
 from argparse import Namespace
 from runner import __version__
 from runner.filetype import FileType
 from runner.param import Param, MultiParam
 from runner.tools import parse_val
+from runner.trace import Tracer
 #from runner.model.generic import get_or_make_filetype
 
 # default values
 ENV_OUT = "RUNDIR"
+OUTPUT_ARRAY = "runner.{}.npy"  # binary storage of array output, in rundir
+
+
+def _dump_arrays(rundir, output):
+    """save array-like output variables to .npy files in rundir, and return 
+    output with these variables replaced by a reference {"npy": file}
+    """
+    output = odict(output)
+    for name, value in output.items():
+        if isinstance(value, dict) or np.ndim(value) == 0:
+            continue
+        value = np.asarray(value)
+        if value.dtype.kind not in 'biuf':
+            continue
+        fname = OUTPUT_ARRAY.format(name)
+        np.save(os.path.join(rundir, fname), value)
+        output[name] = {'npy': fname, 'shape': list(value.shape)}
+    return output
+
+
+def _load_arrays(rundir, output):
+    " inverse of _dump_arrays "
+    output = odict(output)
+    for name, value in output.items():
+        if isinstance(value, dict) and 'npy' in value:
+            output[name] = np.load(os.path.join(rundir, value['npy']))
+    return output
 
 
 ParamIO = namedtuple("ParamIO", ["name","value"])
 
 
+def _accepts_tracer(run):
+    " True if an interface `run` method takes the `tracer` argument "
+    params = inspect.signature(run).parameters
+    return 'tracer' in params or any(p.kind == p.VAR_KEYWORD for p in params.values())
+
+
 class ModelInterface(object):
     def __init__(self, args=None, 
                  filetype=None, filename=None, 
@@ -155,6 +192,10 @@ class ModelInterface(object):
         else:
             runfile = self.runfile(rundir)
 
+        if runinfo.get('output'):
+            runinfo = odict(runinfo)
+            runinfo['output'] = _dump_arrays(os.path.dirname(runfile), runinfo['output'])
+
         if update:
             updateinfo = runinfo
             runinfo = json.load(open(runfile))
@@ -182,18 +223,26 @@ class ModelInterface(object):
             self.filetype.dump(params, open(filepath, 'w'))
             
 
+    def outputfile(self, rundir):
+        """model output file read by postprocess, if any (None otherwise)
+        used to detect whether postprocess needs to be applied again
+        """
+        if not self.filename_output:
+            return None
+        return os.path.join(rundir, self.filename_output)
+
     def postprocess(self, rundir):
         """return model output as dictionary or None
         """
         if not self.filename_output:
             info = json.load(open(self.runfile(rundir)))
-            return info.pop("output", {})
+            return _load_arrays(rundir, info.pop("output", {}))
 
         assert self.filetype_output, "filetype_output is required"
         return self.filetype_output.load(open(os.path.join(rundir, self.filename_output)))
 
 
-    def run(self, rundir, params, background=True, shell=False):
+    def run(self, rundir, params, background=True, shell=False, tracer=None):
         """Run the model
 
         Arguments:
@@ -202,6 +251,7 @@ class ModelInterface(object):
         * params : dict of parameters (will be updated with default params)
         * background : if False, no log file will be created
         * shell : passed to subprocess
+        * tracer : runner.trace.Tracer instance, optional, to time each step
 
         Steps:
 
@@ -211,16 +261,19 @@ class ModelInterface(object):
         - postprocess() : read output
         - write runner.json
         """
-        # create run directory
-        if not os.path.exists(rundir):
-            os.makedirs(rundir)
+        tracer = tracer or Tracer()
+
+        with tracer.span('setup'):
+            # create run directory
+            if not os.path.exists(rundir):
+                os.makedirs(rundir)
 
-        params_kw = odict(self.defaults)
-        params_kw.update(params)
+            params_kw = odict(self.defaults)
+            params_kw.update(params)
 
-        args = self.command(rundir, params_kw)
-        workdir = self.workdir(rundir)
-        env = self.environ(rundir, params_kw, env=os.environ.copy())
+            args = self.command(rundir, params_kw)
+            workdir = self.workdir(rundir)
+            env = self.environ(rundir, params_kw, env=os.environ.copy())
 
         # also write parameters in a format runner understands, for the record
         info = odict()
@@ -229,11 +282,11 @@ class ModelInterface(object):
         info['env'] = env
         info['params'] = params_kw
         info['status'] = 'running'
-        self._write(rundir, info)
-
-        self.setup(rundir, params_kw)
+        with tracer.span('write'):
+            self._write(rundir, info)
 
-        #print("Hello after setup.") 
+        with tracer.span('setup'):
+            self.setup(rundir, params_kw)
 
         if background:
             output = os.path.join(rundir, 'log.out')
@@ -248,10 +301,17 @@ class ModelInterface(object):
         try:
             if shell:
                 args = " ".join(args)
-            subprocess.check_call(args, env=env, cwd=workdir, 
-                                  stdout=stdout, stderr=stderr, shell=shell)
+            with tracer.span('spawn'):
+                proc = subprocess.Popen(args, env=env, cwd=workdir, 
+                                        stdout=stdout, stderr=stderr, shell=shell)
+            with tracer.span('model'):
+                retcode = proc.wait()
+            if retcode:
+                raise subprocess.CalledProcessError(retcode, args)
             info['status'] = 'success'
-            info['output'] = output = self.postprocess(rundir)
+            with tracer.span('postprocess'):
+                info['output'] = output = self.postprocess(rundir)
+            info['postprocess_time'] = time.time()
 
         except OSError as error:
             info['status'] = 'failed'
@@ -262,7 +322,8 @@ class ModelInterface(object):
             raise
 
         finally:
-            self._write(rundir, info)
+            with tracer.span('write'):
+                self._write(rundir, info)
 
         return output
 
@@ -352,6 +413,7 @@ class FrozenModel(object):
         self.params = params
         self.output = output or {}
         self.status = None
+        self.postprocess_time = None
 
     @property
     def prior(self):
@@ -378,10 +440,12 @@ class FrozenModel(object):
 
     def load(self, file=None):
         " load model output + params from output directory "
-        cfg = json.load(open(file or self.runfile))
+        file = file or self.runfile
+        cfg = json.load(open(file))
         self.params = cfg["params"]
-        self.output = cfg.pop("output",{})
+        self.output = _load_arrays(os.path.dirname(file), cfg.pop("output",{}))
         self.status = cfg.pop("status", None)
+        self.postprocess_time = cfg.pop("postprocess_time", None)
         return self
 
     def save(self, file=None):
@@ -389,18 +453,37 @@ class FrozenModel(object):
         self.model.interface._write(self.rundir, {
             'output':self.output, 
             'params':self.params,
+            'postprocess_time':self.postprocess_time,
         }, update=True)
 
 
-    def run(self, background=True, shell=False):
-        """Run the model
+    def run(self, background=True, shell=False, tracer=None):
+        """Run the model (the tracer is ignored by interfaces whose `run` 
+        method does not take it, e.g. subclasses that override it)
         """
-        self.output = self.model.interface.run(self.rundir, self.params, background=background, shell=shell)
+        kwargs = {}
+        if tracer is not None and _accepts_tracer(self.model.interface.run):
+            kwargs['tracer'] = tracer
+        self.output = self.model.interface.run(self.rundir, self.params, background=background, shell=shell,
+                                               **kwargs)
         self.status = "success"
         return self
 
 
+    def is_postprocessed(self):
+        """True if postprocess was applied after the last change of the model 
+        output file (always False if the interface has no output file and 
+        postprocess was never applied)
+        """
+        if self.postprocess_time is None:
+            return False
+        outputfile = self.model.interface.outputfile(self.rundir)
+        if outputfile is None or not os.path.exists(outputfile):
+            return True
+        return os.path.getmtime(outputfile) <= self.postprocess_time
+
     def postprocess(self):
         self.output = self.model.interface.postprocess(self.rundir)
+        self.postprocess_time = time.time()
         self.save()
         return self
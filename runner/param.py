@@ -4,19 +4,28 @@ from __future__ import division
 import json
 import logging
 import sys
-import itertools
+import warnings
 from collections import OrderedDict as odict
 import numpy as np
+import six
 
 import runner.xparams as xp
-from runner.xparams import XParams
+from runner.xparams import XParams, XFactorial
 from runner.lib.doelhs import lhs
-from runner.tools.dist import parse_val, DiscreteDist, cost
+from runner.lib.doefrac import fracfact, oa
+from runner.lib.doeaugment import augment
+from runner.lib.imanconover import iman_conover, check_corr
+from runner.lib import lhsmdu, pynolh
+from runner.tools.dist import parse_val, DiscreteDist, DummyDist, MarginalNormal, cost
+from runner.tools.rng import get_rng, spawn
 from runner.tools.dist import parse_dist2, dist_to_str2, dist_todict2, dist_fromkw2
 
 # default criterion for the lhs method
 LHS_CRITERION = 'centermaximin' 
 
+# structured designs, which rank reordering (corr) would break
+UNCORRELATED_METHODS = ('nolh', 'sobol', 'halton')
+
 # for reading...
 ALPHA = 0.99  # validity interval
 
@@ -61,7 +70,11 @@ class Param(object):
         or a range `START:STOP:N`.
         A distribution is provided as `TYPE?ARG,ARG[,ARG,...]`.
         Pre-defined `U?min,max` (uniform) and `N?mean,sd` (normal)
-        or any scipy.stats distribution as TYPE?[SHP,]LOC,SCALE.
+        or any scipy.stats distribution as TYPE?[SHP,]LOC,SCALE, 
+        optionally truncated as `TYPE?ARG,ARG[LOWER,UPPER]`.
+        A joint multivariate normal prior is provided as 
+        `NAME,NAME[,...]=MVN?MEAN1,MEAN2;COV11,COV12;COV21,COV22` 
+        (see MultiParam).
         """
         # otherwise custom, command-line specific representation
         try:
@@ -103,6 +116,8 @@ class Param(object):
 class FrozenParam(object):
     """Parameter / State variable with fixed value
     """
+    __slots__ = ('param', 'value')
+
     def __init__(self, param, value=None):
         self.param = param
         self.value = value if value is not None else param.default
@@ -114,7 +129,7 @@ class FrozenParam(object):
     @property
     def dist(self):
         " scipy or custom distribution (frozen) "
-        return self.param.dist if self.param.dist else dummydist(self.default)
+        return self.param.dist if self.param.dist else DummyDist(self.param.default)
 
     def __str__(self):
         if self.value is None:
@@ -133,6 +148,8 @@ class FrozenParam(object):
     def isvalid(self, alpha=ALPHA):
         """params in the confidence interval
         """
+        if hasattr(self.dist, 'isvalid'):
+            return bool(self.dist.isvalid(self.value, alpha))
         lo, hi = self.dist.interval(alpha)
         if not np.isfinite(self.value) or self.value < lo or self.value > hi:
             return False
@@ -165,49 +182,174 @@ def filterkeys(kwargs, keys):
     return {k:kwargs[k] for k in kwargs if k in keys}
 
 
+def _expand_joint(param):
+    " NAME,NAME,...=MVN?... --> one Param per component, with MarginalNormal dist "
+    if not getattr(param.dist, 'multivariate', False) or ',' not in param.name:
+        return [param]
+    names = param.name.split(',')
+    if len(names) != param.dist.mean().size:
+        raise ValueError("joint prior {}: expected {} names, got {}".format(
+            param.name, param.dist.mean().size, len(names)))
+    return [Param(name, dist=param.dist.marginal(i)) for i, name in enumerate(names)]
+
+
+def _joint_groups(params):
+    """complete groups of MarginalNormal components of a same joint prior 
+    --> list of (joint, positions in params, ordered as joint components)
+    """
+    groups = odict()
+    for i, p in enumerate(params):
+        if isinstance(p.dist, MarginalNormal):
+            groups.setdefault(id(p.dist.joint), (p.dist.joint, {}))[1][p.dist.index] = i
+    return [(joint, [pos[k] for k in range(joint.mean().size)]) 
+            for joint, pos in groups.values() if len(pos) == joint.mean().size]
+
+
 class ParamList(list):
     """enhanced list: pure python data structure, does not do any work
+
+    Items are accessed by position or by name, through a name -> index map
+    which is rebuilt after the list is modified (not if a name is changed).
     """
     def __init__(self, params):
         " list of Param instances"
         super(ParamList, self).__init__(params)
+        self._index = None
         for p in self:
             if not hasattr(p, 'name'):
                 raise TypeError("Param-like with 'name' attribute required, got:"+repr(type(p)))
 
+    @property
+    def index_map(self):
+        " name -> index (first occurrence) "
+        if self._index is None:
+            index = odict()
+            for i, p in enumerate(self):
+                index.setdefault(p.name, i)
+            self._index = index
+        return self._index
+
     @property
     def names(self):
         return [p.name for p in self]
 
     def __getitem__(self, name):
-        if type(name) is int:
-            return super(ParamList, self)[name]
+        if isinstance(name, (six.integer_types, np.integer, slice)):
+            return super(ParamList, self).__getitem__(name)
         else:
-            return {p.name:p for p in self}[name]
+            return super(ParamList, self).__getitem__(self.index_map[name])
 
 
     def __add__(self, other):
         return type(self)(list(self) + list(other))
 
 
+def _invalidates_index(method):
+    " wrap a list method that modifies the list "
+    def wrapper(self, *args, **kwargs):
+        self._index = None
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+for _name in ['__setitem__', '__delitem__', '__setslice__', '__delslice__', '__iadd__', '__imul__',
+              'append', 'extend', 'insert', 'pop', 'remove', 'reverse', 'sort', 'clear']:
+    if hasattr(list, _name):
+        setattr(ParamList, _name, _invalidates_index(getattr(list, _name)))
+
+
 class MultiParam(ParamList):
     """Combine a list of parameters or state variables, can sample, compute likelihood etc
-    """
 
-    def product(self):
+    * corr : p x p rank correlation matrix, optional
+        target Spearman correlation between parameters, induced in samples
+        by rank reordering (Iman and Conover, 1982, see correlate). Only for
+        random designs: reordering would break the structure of nolh, sobol 
+        and halton designs, and of extended designs.
+
+    A joint multivariate normal prior over NAME,NAME,... (see Param.parse) is
+    expanded into one parameter per component, sampled, mapped to the unit
+    hypercube and evaluated jointly. Its correlation replaces the corresponding
+    entries of `corr`.
+    """
+    def __init__(self, params, corr=None):
+        super(MultiParam, self).__init__([q for p in params for q in _expand_joint(p)])
+        if corr is not None:
+            corr = np.array(corr, dtype=float)
+            for joint, pos in _joint_groups(self):
+                sd = np.sqrt(np.diag(joint.cov))
+                corr[np.ix_(pos, pos)] = 6/np.pi*np.arcsin(joint.cov/np.outer(sd, sd)/2)  # rank correlation
+        self.corr = None if corr is None else check_corr(corr, len(self))
+
+
+    def product(self, fraction=None, orthogonal_array=False):
+        """Full factorial design (lazy, see XFactorial), or a subset of it:
+
+        * fraction : int, optional
+            resolution (3, 4 or 5) of a two-level fractional factorial design,
+            using the min and max of each parameter's values as levels
+        * orthogonal_array : bool, optional
+            strength-2 orthogonal array, if all parameters have the same prime 
+            number of values (e.g. 2, 3 or 5)
+        """
         for p in self:
             if not isinstance(p.dist, DiscreteDist):
                 raise TypeError("cannot make product of continuous distributions: "+p.name)
-        return XParams(list(itertools.product(*[p.dist.values.tolist() for p in self])), self.names)
+        levels = [p.dist.values.tolist() for p in self]
+
+        if fraction:
+            levels = [[min(l), max(l)] for l in levels]
+            return XFactorial(levels, self.names).subset(fracfact(len(levels), fraction))
+
+        if orthogonal_array:
+            nlevels = set(len(l) for l in levels)
+            if len(nlevels) > 1:
+                raise ValueError("orthogonal array: all parameters must have the same number of values")
+            return XFactorial(levels, self.names).subset(oa(len(levels), nlevels.pop()))
+
+        return XFactorial(levels, self.names)
+
+
+    def ppf(self, unit):
+        """Map samples from the unit hypercube (sample x parameters) to the
+        parameter space, through each parameter's ppf or jointly for joint
+        priors --> return array
+        """
+        pmatrix = np.empty(unit.shape)
+        for i, p in enumerate(self):
+            pmatrix[:,i] = p.dist.ppf(unit[:,i]) # take the quantile for the particular distribution
+        for joint, pos in _joint_groups(self):
+            pmatrix[:,pos] = joint.ppf(unit[:,pos])
+        return pmatrix
+
+
+    def bounds(self, names=None):
+        """Support of each parameter, e.g. for jittering within the prior 
+        (infinite for parameters without distribution or not in the prior)
+        --> return array (parameters x 2)
+        """
+        bounds = np.empty((len(names or self.names), 2))
+        bounds[:] = -np.inf, np.inf
+        for i, name in enumerate(names or self.names):
+            if name in self.index_map and hasattr(self[name].dist, 'support'):
+                bounds[i] = self[name].dist.support()
+        return bounds
 
 
     def sample_montecarlo(self, size, seed=None):
         """Basic montecarlo sampling --> return pmatrx
+
+        Each parameter (or joint prior) is drawn from its own stream, spawned 
+        from `seed` (see runner.tools.rng).
         """
         pmatrix = np.empty((size,len(self.names)))
+        rngs = spawn(seed, len(self))
 
-        for i, p in enumerate(self):
-            pmatrix[:,i] = p.dist.rvs(size=size, random_state=seed+i if seed else None) # scipy distribution: sample !
+        for i, (p, rng) in enumerate(zip(self, rngs)):
+            pmatrix[:,i] = p.dist.rvs(size=size, random_state=rng) # scipy distribution: sample !
+        for joint, pos in _joint_groups(self):
+            pmatrix[:,pos] = joint.rvs(size=size, random_state=rngs[pos[0]])
 
         return XParams(pmatrix, self.names)
 
@@ -215,51 +357,201 @@ class MultiParam(ParamList):
     def sample_lhs(self, size, seed=None, criterion=LHS_CRITERION, iterations=None):
         """Latin hypercube sampling --> return Xparams
         """
-        pmatrix = np.empty((size,len(self.names)))
-        np.random.seed(seed)
-        lhd = lhs(len(self.names), size, criterion, iterations) # sample x parameters, all in [0, 1]
+        lhd = lhs(len(self.names), size, criterion, iterations, random_state=seed) # sample x parameters, all in [0, 1]
+        return XParams(self.ppf(lhd), self.names)
+
+
+    def sample_lhsmdu(self, size, seed=None):
+        """Latin hypercube sampling with multi-dimensional uniformity 
+        (Deutsch and Deutsch, 2012) --> return XParams
+        """
+        lhd = lhsmdu.sample(len(self.names), size, randomSeed=seed) # parameters x sample, all in [0, 1]
+        return XParams(self.ppf(lhd.T), self.names)
+
+
+    def sample_nolh(self, size=None):
+        """Nearly orthogonal latin hypercube (Cioppa, 2007), with 17, 33, 65,
+        129 or 257 samples depending on the number of parameters (up to 29) 
+        --> return XParams
+        """
+        lhd = pynolh.design(len(self.names)) # sample x parameters, all in ]0, 1[
+        if size is not None and size != lhd.shape[0]:
+            raise ValueError("NOLH design for {} parameters has {} samples, got size={}".format(
+                len(self.names), lhd.shape[0], size))
+        return XParams(self.ppf(lhd), self.names)
+
+
+    def sample_qmc(self, size, seed=None, method="sobol", skip=0):
+        """Scrambled quasi-Monte Carlo sequence (sobol or halton) --> return XParams
 
+        * skip : number of points to skip. The same seed with skip=n extends 
+            a design of size n with the next points of the same sequence.
+            Sobol sequences are balanced for powers of 2 (size and skip).
+        """
+        from scipy.stats import qmc
+        if skip and seed is None:
+            raise ValueError("a seed is required to extend a scrambled sequence (skip)")
+        if method == "sobol":
+            for n, label in [(size, 'size'), (skip, 'skip')]:
+                if n & (n - 1):
+                    logging.warning("sobol: {}={} is not a power of 2, balance properties are lost".format(label, n))
+            engine = qmc.Sobol(len(self.names), scramble=True, seed=get_rng(seed))
+        elif method == "halton":
+            engine = qmc.Halton(len(self.names), scramble=True, seed=get_rng(seed))
+        else:
+            raise ValueError("unknown quasi-Monte Carlo method: "+method)
+        if skip:
+            engine.fast_forward(skip)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # already warned above
+            u = engine.random(size) # sample x parameters, all in [0, 1[
+
+        return XParams(self.ppf(u), self.names)
+
+
+    def to_unit(self, xparams):
+        """Map an ensemble to the unit hypercube through each parameter's cdf 
+        (discrete values to the middle of their probability step, so that ppf 
+        maps them back) --> return array (sample x parameters)
+        """
+        unit = np.empty((xparams.size, len(self.names)))
+        for i, p in enumerate(self):
+            x = xparams[p.name]
+            unit[:,i] = p.dist.cdf(x)
+            if isinstance(p.dist, DiscreteDist):
+                unit[:,i] -= p.dist.pmf(x)/2
+        for joint, pos in _joint_groups(self):
+            unit[:,pos] = joint.rosenblatt(np.array([xparams[self[i].name] for i in pos]).T)
+        return unit
+
+
+    def extend_design(self, xparams, size, seed=None):
+        """Add `size` space-filling samples to an existing ensemble: new points 
+        in the unit hypercube maximize their minimum distance to existing and 
+        new points (see runner.lib.doeaugment) --> return XParams, existing 
+        samples first
+        """
+        if self.corr is not None:
+            raise ValueError("rank correlation (corr) cannot be induced when extending a design")
+        missing = [name for name in self.names if name not in xparams.names]
+        if missing:
+            raise ValueError("parameters missing from the ensemble to extend: "+", ".join(missing))
+        new = augment(self.to_unit(xparams), size, random_state=seed)
+
+        pmatrix = np.empty((xparams.size + size, len(self.names)))
         for i, p in enumerate(self):
-            pmatrix[:,i] = p.dist.ppf(lhd[:,i]) # take the quantile for the particular distribution
+            pmatrix[:xparams.size,i] = xparams[p.name]
+        pmatrix[xparams.size:] = self.ppf(new)
 
         return XParams(pmatrix, self.names)
 
 
     def sample(self, size, seed=None, method="lhs", **kwargs):
         """Wrapper for the various sampling methods. Unused **kwargs are ignored.
+        The size is optional for the nolh method (deterministic).
         """
-        pmatrix = np.empty((size,len(self.names)))
+        if self.corr is not None and method in UNCORRELATED_METHODS:
+            raise ValueError("rank correlation (corr) is not supported by the {} method: "
+                             "reordering would break the design".format(method))
         if method == "lhs":
             opts = filterkeys(kwargs, ['criterion', 'iterations'])
             xparams = self.sample_lhs(size, seed, **opts)
+        elif method == "lhsmdu":
+            xparams = self.sample_lhsmdu(size, seed)
+        elif method == "nolh":
+            xparams = self.sample_nolh(size)
+        elif method in ("sobol", "halton"):
+            opts = filterkeys(kwargs, ['skip'])
+            xparams = self.sample_qmc(size, seed, method, **opts)
         else:
             xparams = self.sample_montecarlo(size, seed)
+        if self.corr is not None:
+            xparams = self.correlate(xparams, spawn(seed, 1)[0])
         return xparams
 
+    def correlate(self, xparams, seed=None):
+        """Reorder the samples of each parameter to match the rank correlation 
+        matrix `corr`, marginal distributions are unchanged --> return XParams
+        """
+        values = np.array([xparams[name] for name in self.names]).T
+        return XParams(iman_conover(values, self.corr, random_state=seed), self.names)
+
+    def pearson_corr(self):
+        """Pearson correlation equivalent to the rank correlation matrix, for 
+        normally distributed variables: 2 sin(pi r / 6)
+        """
+        return 2*np.sin(np.pi*self.corr/6)
+
     def __call__(self, **kw):
         return FrozenParams([p(kw.pop(p.name, p.default)) for p in self])
 
+    def freeze(self, xparams):
+        """Array-backed frozen parameters for a whole ensemble (missing 
+        parameters take their default value) --> return FrozenEnsemble
+        """
+        values = np.empty((xparams.size, len(self)))
+        for i, p in enumerate(self):
+            if p.name not in xparams.names and p.default is None:
+                raise ValueError("parameter missing from the ensemble (no default): "+p.name)
+            values[:,i] = xparams[p.name] if p.name in xparams.names else p.default
+        return FrozenEnsemble(self, values)
+
+    def logpdf(self, xparams):
+        """Log-density of the prior for each member of an ensemble (XParams), 
+        evaluated one parameter at a time --> return array (size)
+        """
+        return self.freeze(xparams).logpdf().sum(axis=1)
+
 
     def asdict(self, key=None):
-        return {key:[p.as_dict() for p in self]}
+        params = list(self)
+        for joint, pos in _joint_groups(self):  # back to NAME,NAME=MVN?...
+            params[pos[0]] = Param(",".join(self[i].name for i in pos), dist=joint)
+            for i in pos[1:]:
+                params[i] = None
+        kwds = {key:[p.as_dict() for p in params if p is not None]}
+        if self.corr is not None:
+            kwds['corr'] = self.corr.tolist()
+        return kwds
 
     @classmethod
     def fromdict(cls, kwds, key=None):
-        return cls([Param.fromkw(p) for p in kwds[key]])
+        return cls([Param.fromkw(**p) for p in kwds[key]], corr=kwds.get('corr'))
+
+    def write(self, path):
+        " write prior (and correlation matrix) to json file "
+        with open(path, 'w') as f:
+            json.dump(self.asdict('prior'), f, indent=2)
+
+    @classmethod
+    def read(cls, path):
+        " read prior from json file, see write "
+        with open(path) as f:
+            return cls.fromdict(json.load(f), 'prior')
 
 
 
 class FrozenParams(ParamList):
 
+    @property
+    def values(self):
+        return np.array([p.value for p in self])
+
     def as_dict(self):
         return odict([(p.name,p.value) for p in self if p.value is not None])
 
     def logpdf(self):
+        """log-density of each parameter: joint priors are split into 
+        conditional densities, which sum to the joint log-density
+        """
         #if np.isfinite(self.getvalue()) else 0.
-        return np.array([p.logpdf() for p in self])
+        logp = np.array([p.logpdf() for p in self], dtype=float)
+        for joint, pos in _joint_groups(self):
+            logp[pos] = joint.conditional_logpdf([self[i].value for i in pos])
+        return logp
 
     def pdf(self):
-        return np.array([p.pdf for p in self])
+        return np.array([p.pdf() for p in self])
 
     def isvalid(self, alpha=ALPHA):
         return np.array([p.isvalid(alpha) for p in self])
@@ -267,3 +559,54 @@ class FrozenParams(ParamList):
     # back-compat
     def cost(self):
         return np.array([p.cost for p in self])
+
+
+class FrozenEnsemble(object):
+    """Ensemble of frozen parameters: a sample x parameters array of values, 
+    with distributions shared by all members (compact counterpart of a list 
+    of FrozenParams, see MultiParam.freeze). Evaluated one parameter at a time,
+    for the whole ensemble.
+    """
+    __slots__ = ('params', 'values')
+
+    def __init__(self, params, values):
+        self.params = params
+        self.values = np.asarray(values, dtype=float)
+        if self.values.ndim != 2 or self.values.shape[1] != len(params):
+            raise ValueError("expected sample x {} values, got: {}".format(len(params), self.values.shape))
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def __getitem__(self, i):
+        " FrozenParams of member i "
+        return FrozenParams([FrozenParam(p, v) for p, v in zip(self.params, self.values[i])])
+
+    def _dists(self):
+        return [p.dist if p.dist else DummyDist(p.default) for p in self.params]
+
+    def logpdf(self):
+        """log-density of each member and parameter (sample x parameters), 
+        joint priors split into conditional densities (see FrozenParams.logpdf)
+        """
+        logp = np.empty(self.values.shape)
+        for i, dist in enumerate(self._dists()):
+            logp[:,i] = dist.logpdf(self.values[:,i])
+        for joint, pos in _joint_groups(self.params):
+            logp[:,pos] = joint.conditional_logpdf(self.values[:,pos])
+        return logp
+
+    def pdf(self):
+        return np.exp(self.logpdf())
+
+    def isvalid(self, alpha=ALPHA):
+        " values in the confidence interval (sample x parameters) "
+        valid = np.empty(self.values.shape, dtype=bool)
+        for i, dist in enumerate(self._dists()):
+            x = self.values[:,i]
+            if hasattr(dist, 'isvalid'):
+                valid[:,i] = dist.isvalid(x, alpha)
+            else:
+                lo, hi = dist.interval(alpha)
+                valid[:,i] = np.isfinite(x) & (x >= lo) & (x <= hi)
+        return valid
@@ -74,6 +74,7 @@ in NSSPW - Nonlinear Statistical Signal Processing Workshop 2006,
 from __future__ import division, print_function
 import logging
 import numpy as np
+from runner.tools.rng import get_rng, spawn
 
 
 RESAMPLING_METHOD = "residual"
@@ -82,6 +83,7 @@ EPSILON_BOUNDS = (1e-3, 0.1)  # has priority over NEFF_BOUNDS
 NEFF_BOUNDS = (0.5, 0.9)
 DEFAULT_SIZE = 500
 DEFAULT_ALPHA_TARGET = 0.95
+JITTER_MAXTRIES = 100  # redraws of out-of-bound jitter
 
 
 
@@ -197,15 +199,16 @@ def _build_ids(counts):
         start += count
     return ids
 
-def multinomial_resampling(weights, size):
+def multinomial_resampling(weights, size, random_state=None):
     """
     weights : (normalized) weights 
     size : sample size to draw from the weights
+    random_state : seed, SeedSequence or Generator (see runner.tools.rng)
     """
-    counts = np.random.multinomial(size, weights)
+    counts = get_rng(random_state).multinomial(size, weights)
     return _build_ids(counts)
 
-def residual_resampling(weights, size):
+def residual_resampling(weights, size, random_state=None):
     """
     Deterministic resampling of the particles for the integer part of the counts
     Random sampling of the residual.
@@ -217,74 +220,53 @@ def residual_resampling(weights, size):
     # sample randomly from residual weights
     weights_resid = counts_decimal - counts_copy
     weights_resid /= weights_resid.sum()
-    counts_resid = np.random.multinomial(size - counts_copy.sum(), weights_resid)
+    counts_resid = get_rng(random_state).multinomial(size - counts_copy.sum(), weights_resid)
     # make the ids
     return _build_ids(counts_copy + counts_resid)
 
 # Jitter step
 # ===========
 
-def sample_with_bounds_check(params, covjitter, bounds):
-    """ Sample from covariance matrix and update parameters
-
-    Parameters
-    ----------
-    params : 1-D numpy array (p)
-    covjitter : covariance matrix p * p
-    bounds : p*2 array (p x 2)
-        parameter bounds: array([(min, max), (min, max), ...])
-
-    Returns
-    -------
-    newparams : 1-D numpy array of resampled parameters
-    """
-    assert params.ndim == 1
-
-    # prepare the jitter
-    tries = 0
-    maxtries = 100
-    while True:
-        tries += 1
-        if seed is not None:
-            np.random.seed(seed+tries) 
-        newparams = np.random.multivariate_normal(params, covjitter)
-        params_within_bounds = not np.any((newparams < bounds[:,0]) | (newparams > bounds[:,1]), axis=0)
-        if params_within_bounds:
-            logging.debug("Required {} time(s) sampling jitter to match bounds".format(tries, i))
-            break
-        if tries > maxtries : 
-            logging.warning("Could not add jitter within parameter bounds")
-            newparams = params
-            break
-    return newparams
-
-
-def add_jitter(params, epsilon, bounds=None, seed=None):
+def add_jitter(params, epsilon, bounds=None, seed=None, corr=None):
     """ Add noise with variance equal to epsilon times ensemble variance
 
     params : size x p
     epsilon : float
     bounds : p x 2, optional
+    seed : seed, SeedSequence or Generator (see runner.tools.rng)
+    corr : p x p correlation matrix, optional
+        prior correlation of the jitter, instead of the ensemble correlation
     """
     size = params.shape[0]
     covjitter = np.cov(params.T)*epsilon
     if covjitter.ndim == 0: 
         covjitter = covjitter.reshape([1,1]) # make it 2-D
+    if corr is not None:
+        sd = np.sqrt(np.diag(covjitter))
+        covjitter = sd[:, None]*np.asarray(corr)*sd[None, :]
 
-    if seed is not None:
-        np.random.seed(seed)  # NOTE: only apply to first sampling (bounds=None)
-    jitter = np.random.multivariate_normal(np.zeros(params.shape[1]), covjitter, size)
+    rng = get_rng(seed)
+    jitter = rng.multivariate_normal(np.zeros(params.shape[1]), covjitter, size)
     newparams = params + jitter
 
     # Check that params remain within physically-motivated "hard" bounds:
     if bounds is not None:
-        bad = np.any((newparams < bounds[:,0][np.newaxis, :]) | (newparams > bounds[:,1][np.newaxis, :]), axis=0)
-        ibad = np.where(bad)[0]
+        def outside(x):
+            return np.any((x < bounds[:,0][np.newaxis, :]) | (x > bounds[:,1][np.newaxis, :]), axis=1)
+        ibad = np.where(outside(newparams))[0]
         if ibad.size > 0:
             logging.warning("{} particles are out-of-bound after jittering: resample within bounds".format(len(ibad)))
-            # newparams[ibad] = resampled_params[ibad]
-            for i in ibad:
-                newparams[i] = sample_with_bounds_check(params[i], covjitter, bounds, seed=seed)
+        # redraw the jitter of all out-of-bound particles at once
+        tries = 0
+        while ibad.size > 0 and tries < JITTER_MAXTRIES:
+            tries += 1
+            jitter = rng.multivariate_normal(np.zeros(params.shape[1]), covjitter, ibad.size)
+            newparams[ibad] = params[ibad] + jitter
+            ibad = ibad[outside(newparams[ibad])]
+        logging.debug("Required {} time(s) sampling jitter to match bounds".format(tries))
+        if ibad.size > 0:
+            logging.warning("Could not add jitter within parameter bounds for {} particles".format(ibad.size))
+            newparams[ibad] = params[ibad]
 
     return newparams
 
@@ -297,20 +279,21 @@ class Resampler(object):
             weights = weights / weights.sum()
         self.weights = weights
 
-    def sample_residual(self, size):
-        return residual_resampling(self.weights, size)
+    def sample_residual(self, size, random_state=None):
+        return residual_resampling(self.weights, size, random_state)
 
-    def sample_multinomal(self, size):
-        return multinomial_resampling(self.weights, size)
+    def sample_multinomal(self, size, random_state=None):
+        return multinomial_resampling(self.weights, size, random_state)
 
     def sample(self, size, seed=None, method=RESAMPLING_METHOD):
         """wrapper resampler method 
+
+        seed : seed, SeedSequence or Generator (see runner.tools.rng)
         """
-        np.random.seed(seed) # random state
         if method == 'residual':
-            ids = self.sample_residual(size)
-        elif method == 'residual':
-            ids = self.sample_multinomal(size)
+            ids = self.sample_residual(size, seed)
+        elif method == 'multinomial':
+            ids = self.sample_multinomal(size, seed)
         elif method in ("stratified", "deterministic"):
             raise NotImplementedError(method) # todo
         else:
@@ -334,7 +317,7 @@ class Resampler(object):
         """
         return adaptive_posterior_exponent(self.weights, epsilon, neff_bounds)
 
-    def iis(self, params, epsilon=None, size=None, bounds=None, seed=None, neff_bounds=NEFF_BOUNDS, **kwargs):
+    def iis(self, params, epsilon=None, size=None, bounds=None, seed=None, neff_bounds=NEFF_BOUNDS, corr=None, **kwargs):
         """Iterative importance (re)sampling with scaled weights and jittering
 
         params : size x p
@@ -343,11 +326,14 @@ class Resampler(object):
             see Resampler.autoepsilon
         bounds : p x 2, optional
             parameter bounds, force resampling if outside
+        corr : p x p correlation matrix, optional
+            jitter correlation (see add_jitter)
         """
         if epsilon is None:
             epsilon = self.autoepsilon(neff_bounds)
         size = size or len(params)
-        ids = self.scaled(epsilon).sample(size, seed=seed, **kwargs)
-        return add_jitter(params[ids], epsilon, seed=seed, bounds=bounds)
+        resampling, jitter = spawn(seed, 2)  # independent streams
+        ids = self.scaled(epsilon).sample(size, seed=resampling, **kwargs)
+        return add_jitter(params[ids], epsilon, seed=jitter, bounds=bounds, corr=corr)
 
 
@@ -2,6 +2,7 @@
 """
 import numpy as np
 from runner.tools.misc import parse_val
+from runner.tools.rng import get_rng
 
 class LazyDist(object):
     " lazy loading of scipy distributions "
@@ -20,9 +21,185 @@ rv_discrete = LazyDist('rv_discrete')
 rv_frozen = LazyDist('rv_frozen')
 
 
+# Built-in distributions (numpy)
+# ==============================
+# Same parameterization as scipy.stats (shapes, loc, scale), without its import 
+# time and per-call overhead. Normal quantiles need scipy.special (ndtri, ndtr), 
+# imported on first use.
+
+class LocScaleDist(object):
+    """Base class for built-in distributions: x = loc + scale * z, where z 
+    follows the standard distribution defined by _rvs, _ppf, _cdf and _logpdf
+    """
+    name = None
+    shapes = ()
+    _support = (-np.inf, np.inf)
+
+    def __init__(self, loc=0., scale=1.):
+        if not scale > 0:
+            raise ValueError("{}: scale must be positive, got: {}".format(self.name, scale))
+        self.loc = loc
+        self.scale = scale
+
+    def rvs(self, size=None, random_state=None):
+        return self.loc + self.scale*self._rvs(get_rng(random_state), size)
+
+    def ppf(self, q):
+        q = np.asarray(q, dtype=float)
+        q = np.where((q >= 0) & (q <= 1), q, np.nan)
+        return self.loc + self.scale*self._ppf(q)
+
+    def cdf(self, x):
+        return self._cdf((np.asarray(x, dtype=float) - self.loc)/self.scale)
+
+    def logpdf(self, x):
+        return self._logpdf((np.asarray(x, dtype=float) - self.loc)/self.scale) - np.log(self.scale)
+
+    def pdf(self, x):
+        return np.exp(self.logpdf(x))
+
+    def interval(self, alpha):
+        return self.ppf(0.5 - alpha/2), self.ppf(0.5 + alpha/2)
+
+    def support(self):
+        lo, hi = self._support
+        return self.loc + self.scale*lo, self.loc + self.scale*hi
+
+    def todict(self):
+        kw = {'name': self.name, 'loc': self.loc, 'scale': self.scale}
+        if self.shapes:
+            kw['shapes'] = self.shapes
+        return kw
+
+
+class NormalDist(LocScaleDist):
+    name = 'norm'
+
+    def _rvs(self, rng, size):
+        return rng.standard_normal(size)
+
+    def _ppf(self, q):
+        from scipy.special import ndtri
+        return ndtri(q)
+
+    def _cdf(self, z):
+        from scipy.special import ndtr
+        return ndtr(z)
+
+    def _logpdf(self, z):
+        return -0.5*(z**2 + np.log(2*np.pi))
+
+    def mean(self):
+        return self.loc
+
+    def __str__(self):
+        return "N?{},{}".format(self.loc, self.scale)
+
+
+class UniformDist(LocScaleDist):
+    " uniform in [loc, loc+scale] "
+    name = 'uniform'
+    _support = (0., 1.)
+
+    def _rvs(self, rng, size):
+        return rng.uniform(0., 1., size)
+
+    def _ppf(self, q):
+        return q
+
+    def _cdf(self, z):
+        return np.clip(z, 0, 1)
+
+    def _logpdf(self, z):
+        return np.where((z >= 0) & (z <= 1), 0., -np.inf)
+
+    def mean(self):
+        return self.loc + self.scale/2
+
+    def __str__(self):
+        return "U?{},{}".format(self.loc, self.loc+self.scale)
+
+
+class LogNormalDist(LocScaleDist):
+    " log(z) ~ N(0, s) with z = (x - loc)/scale, as scipy.stats.lognorm "
+    name = 'lognorm'
+    _support = (0., np.inf)
+
+    def __init__(self, s, loc=0., scale=1.):
+        if not s > 0:
+            raise ValueError("lognorm: shape s must be positive, got: {}".format(s))
+        super(LogNormalDist, self).__init__(loc, scale)
+        self.s = s
+        self.shapes = (s,)
+
+    def _rvs(self, rng, size):
+        return np.exp(self.s*rng.standard_normal(size))
+
+    def _ppf(self, q):
+        from scipy.special import ndtri
+        return np.exp(self.s*ndtri(q))
+
+    def _cdf(self, z):
+        from scipy.special import ndtr
+        with np.errstate(divide='ignore'):
+            return np.where(z > 0, ndtr(np.log(np.maximum(z, 0))/self.s), 0.)
+
+    def _logpdf(self, z):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            logz = np.log(z)
+            logp = -0.5*(logz/self.s)**2 - logz - np.log(self.s) - 0.5*np.log(2*np.pi)
+        return np.where(z > 0, logp, -np.inf)
+
+    def mean(self):
+        return self.loc + self.scale*np.exp(self.s**2/2)
+
+    def __str__(self):
+        return "lognorm?{},{},{}".format(self.s, self.loc, self.scale)
+
+
+class DummyDist(object):
+    """Flat (improper) distribution for parameters without prior: pdf is 1, 
+    logpdf 0, the interval is infinite, and samples are the default value.
+    """
+    def __init__(self, default=None):
+        self.default = default
+
+    def rvs(self, size=None, random_state=None):
+        return np.zeros(size)+self.default if size is not None else self.default
+
+    def ppf(self, q): # for interval to work
+        return np.where(np.asarray(q) >= 0.5, np.inf, -np.inf)
+
+    def cdf(self, x):
+        return np.zeros(np.shape(x)) + 0.5
+
+    def logpdf(self, x):
+        return np.zeros(np.shape(x))
+
+    def pdf(self, x):
+        return np.ones(np.shape(x))
+
+    def interval(self, alpha):
+        return -np.inf, np.inf
+
+    def support(self):
+        return -np.inf, np.inf
+
+    def mean(self):
+        return self.default
+
+    def __str__(self):
+        return "none"
+
+# scipy.stats names of the built-in distributions
+BUILTIN_DISTS = {cls.name: cls for cls in (NormalDist, UniformDist, LogNormalDist)}
+
+
 def dist_todict(dist):
     """scipy dist to keywords
     """
+    if isinstance(dist, LocScaleDist):
+        return dist.todict()
     dist_gen = dist.dist
     n = len(dist_gen.shapes.split()) if dist_gen.shapes else 0
     shapes = dist.args[:n]
@@ -39,10 +216,13 @@ def dist_todict(dist):
 
 
 def dist_fromkw(name, **kwargs):
-    """scipy dist to keywords
+    """scipy dist to keywords (built-in distribution if available)
     """
-    import scipy.stats.distributions as mod
-    dist = getattr(mod, name)
+    if name in BUILTIN_DISTS:
+        dist = BUILTIN_DISTS[name]
+    else:
+        import scipy.stats.distributions as mod
+        dist = getattr(mod, name)
     args = list(kwargs.pop('shapes', [])) + [kwargs.pop('loc',0), kwargs.pop('scale',1)]
     assert not kwargs, name
     return dist(*args)
@@ -56,6 +236,8 @@ def dist_fromkw(name, **kwargs):
 def dist_to_str(dist):
     """format scipy-dist distribution
     """
+    if isinstance(dist, (LocScaleDist, DummyDist)):
+        return str(dist)
     dname=dist.dist.name
     dargs=dist.args
 
@@ -93,18 +275,35 @@ def parse_dist(string):
 
     N?MEAN,STD or U?MIN,MAX or TYPE?ARG1[,ARG2 ...] 
     where TYPE is any scipy.stats distribution with *shp, loc, scale parameters.
+    Any of the above followed by [LOWER,UPPER] is truncated (a missing bound 
+    is infinite), e.g. N?0,1[-2,3] or N?0,1[0,]
+    MVN?MEANFILE,COVFILE or MVN?MEAN1,MEAN2,...;COV11,COV12,...;COV21,...
+    for a multivariate normal distribution (array variable, or joint prior).
     """
     name,spec = string.split('?')
+    if name == "MVN":
+        return MultivariateNormal.parse(spec)
+
+    if spec.endswith(']'):
+        spec, bounds = spec[:-1].split('[')
+        lower, upper = bounds.split(',')
+        return TruncatedDist(parse_dist(name+'?'+spec), 
+                             float(lower) if lower.strip() else -np.inf, 
+                             float(upper) if upper.strip() else np.inf)
+
     args = [float(a) for a in spec.split(',')]
     
     # alias for common cases
     if name == "N":
         mean, std = args
-        dist = norm(mean, std)
+        dist = NormalDist(mean, std)
 
     elif name == "U":
         lo, hi = args  # note: uniform?loc,scale differs !
-        dist = uniform(lo, hi-lo) 
+        dist = UniformDist(lo, hi-lo) 
+
+    elif name in BUILTIN_DISTS:
+        dist = BUILTIN_DISTS[name](*args)
 
     else:
         dist = LazyDist(name)(*args)
@@ -118,12 +317,34 @@ class DiscreteDist(object):
     def __init__(self, values):
         self.values = np.asarray(values)
 
-    def rvs(self, size):
-        indices = np.random.randint(0, len(self.values), size)
+    def rvs(self, size=None, random_state=None):
+        indices = get_rng(random_state).integers(0, len(self.values), size)
         return self.values[indices]
 
     def ppf(self, q, interpolation='nearest'):
-        return np.percentile(self.values, q*100, interpolation=interpolation)
+        try:
+            return np.percentile(self.values, q*100, method=interpolation)
+        except TypeError:  # numpy < 1.22
+            return np.percentile(self.values, q*100, interpolation=interpolation)
+
+    def pmf(self, x):
+        return (self.values == np.asarray(x)[..., None]).mean(axis=-1)
+
+    def cdf(self, x):
+        return (self.values <= np.asarray(x)[..., None]).mean(axis=-1)
+
+    def logpdf(self, x):
+        with np.errstate(divide='ignore'):
+            return np.log(self.pmf(x))
+
+    def pdf(self, x):
+        return self.pmf(x)
+
+    def interval(self, alpha):
+        return self.ppf(0.5 - alpha/2), self.ppf(0.5 + alpha/2)
+
+    def support(self):
+        return self.values.min(), self.values.max()
 
     def __str__(self):
         return ",".join(*[str(v) for v in self.values])
@@ -137,6 +358,184 @@ class DiscreteDist(object):
         return cls(values)
 
 
+class TruncatedDist(object):
+    """Continuous distribution truncated to [lower, upper]
+
+    Sampling and transforms go through the base distribution's cdf and ppf, 
+    restricted to [cdf(lower), cdf(upper)], so that they are vectorized and
+    never rejected.
+    """
+    def __init__(self, dist, lower=-np.inf, upper=np.inf):
+        if not lower < upper:
+            raise ValueError("truncation: expected lower < upper, got: {}, {}".format(lower, upper))
+        self.base = dist
+        self.lower = lower
+        self.upper = upper
+        self._cdflo = dist.cdf(lower)
+        self._mass = dist.cdf(upper) - self._cdflo
+        if not self._mass > 0:
+            raise ValueError("truncation: no probability mass in [{}, {}]".format(lower, upper))
+
+    def cdf(self, x):
+        return np.clip((self.base.cdf(x) - self._cdflo)/self._mass, 0, 1)
+
+    def ppf(self, q):
+        return np.clip(self.base.ppf(self._cdflo + np.asarray(q)*self._mass), self.lower, self.upper)
+
+    def logpdf(self, x):
+        x = np.asarray(x)
+        inside = (x >= self.lower) & (x <= self.upper)
+        return np.where(inside, self.base.logpdf(x) - np.log(self._mass), -np.inf)
+
+    def pdf(self, x):
+        return np.exp(self.logpdf(x))
+
+    def rvs(self, size=None, random_state=None):
+        return self.ppf(get_rng(random_state).random(size))
+
+    def interval(self, alpha):
+        return self.ppf(0.5 - alpha/2), self.ppf(0.5 + alpha/2)
+
+    def support(self):
+        return self.lower, self.upper
+
+    def mean(self, n=1000):
+        " mean of n equiprobable quantiles "
+        return self.ppf((np.arange(n) + 0.5)/n).mean()
+
+    def __str__(self):
+        bounds = ['' if np.isinf(b) else str(b) for b in (self.lower, self.upper)]
+        return "{}[{}]".format(dist_to_str2(self.base), ",".join(bounds))
+
+
+class MultivariateNormal(object):
+    """Multivariate normal distribution for array variables (e.g. time series)
+
+    The Cholesky factor of the covariance matrix is computed once, so that
+    `logpdf` evaluates the Mahalanobis distance of a whole ensemble 
+    (N x n array) with a single triangular solve.
+    """
+    multivariate = True
+
+    def __init__(self, mean, cov):
+        self._mean = np.asarray(mean, dtype=float)
+        self.cov = np.asarray(cov, dtype=float)
+        n = self._mean.size
+        if self._mean.ndim != 1 or self.cov.shape != (n, n):
+            raise ValueError("MVN: expected mean of size n and n x n covariance, got: {} and {}".format(self._mean.shape, self.cov.shape))
+        self._chol = np.linalg.cholesky(self.cov)
+        self._logdet = 2*np.log(np.diag(self._chol)).sum()
+
+    def mean(self):
+        return self._mean
+
+    def _whiten(self, x):
+        " z = L^-1 (x - mean) along the last axis of x (NaN rows stay NaN) "
+        from scipy.linalg import solve_triangular
+        d = np.asarray(x, dtype=float) - self._mean
+        z = solve_triangular(self._chol, d.reshape(-1, self._mean.size).T, 
+                             lower=True, check_finite=False)
+        return z.T.reshape(d.shape)
+
+    def mahalanobis2(self, x):
+        " squared Mahalanobis distance, along the last axis of x "
+        return (self._whiten(x)**2).sum(axis=-1)
+
+    def logpdf(self, x):
+        n = self._mean.size
+        return -0.5*(self.mahalanobis2(x) + self._logdet + n*np.log(2*np.pi))
+
+    def pdf(self, x):
+        return np.exp(self.logpdf(x))
+
+    def isvalid(self, x, alpha):
+        " x within the `alpha` confidence region (ellipsoid) "
+        from scipy.stats import chi2
+        d2 = self.mahalanobis2(x)
+        return np.isfinite(d2) & (d2 <= chi2.ppf(alpha, self._mean.size))
+
+    def rvs(self, size=None, random_state=None):
+        z = get_rng(random_state).normal(size=(size or 1, self._mean.size))
+        x = self._mean + np.dot(z, self._chol.T)
+        return x if size else x[0]
+
+    def ppf(self, q):
+        """transform from the unit hypercube (along the last axis of q): 
+        x = mean + L z with z = norm.ppf(q) and L the Cholesky factor, i.e. 
+        component i is the conditional quantile q_i given x_0...x_{i-1}
+        """
+        from scipy.special import ndtri
+        return self._mean + np.dot(ndtri(q), self._chol.T)
+
+    def rosenblatt(self, x):
+        " inverse of ppf: x to the unit hypercube "
+        from scipy.special import ndtr
+        return ndtr(self._whiten(x))
+
+    def conditional_logpdf(self, x):
+        """log p(x_i | x_0...x_{i-1}) along the last axis of x, which sums 
+        to logpdf (chain rule)
+        """
+        z = self._whiten(x)
+        return -0.5*(z**2 + np.log(2*np.pi)) - np.log(np.diag(self._chol))
+
+    def marginal(self, i):
+        " marginal distribution of component i, see MarginalNormal "
+        return MarginalNormal(self, i)
+
+    def __str__(self):
+        rows = [self._mean] + list(self.cov)
+        return "MVN?"+";".join(",".join(str(v) for v in row) for row in rows)
+
+    @classmethod
+    def parse(cls, spec):
+        """MEANFILE,COVFILE or MEAN1,MEAN2...;COV11,COV12...;COV21,COV22...
+        """
+        if ';' in spec:
+            rows = [[float(v) for v in row.split(',')] for row in spec.split(';')]
+            return cls(rows[0], rows[1:])
+        meanfile, covfile = spec.split(',')
+        return cls(np.loadtxt(meanfile, ndmin=1), np.loadtxt(covfile, ndmin=2))
+
+
+class MarginalNormal(object):
+    """Normal marginal of a multivariate normal prior (joint over several 
+    parameters), with a reference to the joint distribution and component index, 
+    so that MultiParam samples and evaluates the components jointly.
+    """
+    def __init__(self, joint, index):
+        self.joint = joint
+        self.index = index
+        self._norm = NormalDist(joint.mean()[index], np.sqrt(joint.cov[index, index]))
+
+    def rvs(self, size=None, random_state=None):
+        return self._norm.rvs(size=size, random_state=get_rng(random_state))
+
+    def ppf(self, q):
+        return self._norm.ppf(q)
+
+    def cdf(self, x):
+        return self._norm.cdf(x)
+
+    def logpdf(self, x):
+        return self._norm.logpdf(x)
+
+    def pdf(self, x):
+        return self._norm.pdf(x)
+
+    def interval(self, alpha):
+        return self._norm.interval(alpha)
+
+    def support(self):
+        return -np.inf, np.inf
+
+    def mean(self):
+        return self.joint.mean()[self.index]
+
+    def __str__(self):
+        return "{}[{}]".format(self.joint, self.index)
+
+
 def parse_dist2(string):
     if '?' in string:
         return parse_dist(string)
@@ -144,7 +543,7 @@ def parse_dist2(string):
         return DiscreteDist.parse(string)
 
 def dist_to_str2(dist):
-    if isinstance(dist, DiscreteDist):
+    if isinstance(dist, (DiscreteDist, MultivariateNormal, TruncatedDist, MarginalNormal)):
         return str(dist)
     else:
         return dist_to_str(dist)
@@ -152,11 +551,26 @@ def dist_to_str2(dist):
 def dist_todict2(dist):
     if isinstance(dist, DiscreteDist):
         return {'values':dist.values.tolist(), 'name':'discrete'}
+    if isinstance(dist, MultivariateNormal):
+        return {'mean':dist.mean().tolist(), 'cov':dist.cov.tolist(), 'name':'mvn'}
+    if isinstance(dist, MarginalNormal):
+        kw = dist_todict2(dist.joint)
+        kw['index'] = dist.index
+        return kw
+    if isinstance(dist, TruncatedDist):
+        return {'name':'truncated', 'base':dist_todict2(dist.base), 
+                'lower':dist.lower, 'upper':dist.upper}  # json: -Infinity, Infinity
     return dist_todict(dist)
 
 def dist_fromkw2(name, **kwargs):
     if name == 'discrete':
         return DiscreteDist(**kwargs)
+    if name == 'mvn':
+        index = kwargs.pop('index', None)
+        dist = MultivariateNormal(**kwargs)
+        return dist if index is None else dist.marginal(index)
+    if name == 'truncated':
+        return TruncatedDist(dist_fromkw2(**kwargs.pop('base')), **kwargs)
     return dist_fromkw(name, **kwargs)
 
 
@@ -170,7 +584,7 @@ def cost(dist, value):
 
 
 def dummydist(default):
-    """dummy distribution built on rv_continuous
+    """dummy distribution (back-compat, see DummyDist)
 
     Example
     -------
@@ -184,14 +598,4 @@ def dummydist(default):
     >>> dummy.rvs(2)
     np.array([3.0, 3.0])
     """
-    from scipy.stats import rv_continuous
-    class dummy_gen(rv_continuous): 
-        def _pdf(self, x):
-            return 1
-        def _ppf(self, x): # for interval to work
-            return np.inf if x >= 0.5 else -np.inf
-        def rvs(self, size=None, loc=0, **kwargs):
-            return np.zeros(size)+loc if size is not None else loc
-    dummy = dummy_gen('none')
-    return dummy(loc=default)
-
+    return DummyDist(default)
@@ -1,10 +1,14 @@
 """Pandas-like printing
 """
-def str_dataframe(pnames, pmatrix, max_rows=1e20, include_index=False, index=None):
-    """Pretty-print matrix like in pandas, but using only basic python functions
-    """
-    #assert isinstance(pmatrix[0][0], float), type(pmatrix[0][0])
-    # determine columns width
+import itertools
+import os
+import sys
+
+CHUNKSIZE = 10000  # rows per block for streaming I/O
+
+
+def _column_formats(pnames):
+    " columns width and format "
     col_width_default = 6
     col_fmt = []
     col_width = []
@@ -12,6 +16,15 @@ def str_dataframe(pnames, pmatrix, max_rows=1e20, include_index=False, index=Non
         w = max(col_width_default, len(p))
         col_width.append( w )
         col_fmt.append( "{:>"+str(w)+"}" )
+    return col_width, col_fmt
+
+
+def str_dataframe(pnames, pmatrix, max_rows=1e20, include_index=False, index=None):
+    """Pretty-print matrix like in pandas, but using only basic python functions
+    """
+    #assert isinstance(pmatrix[0][0], float), type(pmatrix[0][0])
+    # determine columns width
+    col_width, col_fmt = _column_formats(pnames)
 
     # also add index !
     if include_index:
@@ -44,16 +57,125 @@ def str_dataframe(pnames, pmatrix, max_rows=1e20, include_index=False, index=Non
         return "\n".join([header]+lines[:max_rows//2]+[sep]+lines[-max_rows//2:])
 
 
-def read_dataframe(pfile):
+def write_dataframe_header(file, pnames):
+    " header line of the str_dataframe table (without index) "
+    file.write(" ".join(_column_formats(pnames)[1]).format(*pnames))
+
+
+def write_dataframe_rows(file, pnames, block):
+    " append a block of rows to a table started with write_dataframe_header "
+    line_fmt = " ".join(_column_formats(pnames)[1])
+    if hasattr(block, 'tolist'):
+        block = block.tolist()  # python scalars format faster, the same way
+    if len(block):
+        file.write("\n" + "\n".join(line_fmt.format(*pset) for pset in block))
+
+
+def write_dataframe_blocks(file, pnames, blocks):
+    """Stream the str_dataframe table (without index) to an open file, 
+    formatting one block of rows at a time
+    """
+    write_dataframe_header(file, pnames)
+    for block in blocks:
+        write_dataframe_rows(file, pnames, block)
+
+
+def write_dataframe_text(file, pnames, pmatrix, chunksize=CHUNKSIZE):
+    " stream pmatrix to an open file by chunks of rows, see write_dataframe_blocks "
+    blocks = (pmatrix[start:start+chunksize] for start in range(0, len(pmatrix), chunksize))
+    write_dataframe_blocks(file, pnames, blocks)
+
+
+BINARY_FORMATS = ('.npy', '.npz')  # selected by file extension, text otherwise
+
+
+def is_binary(pfile):
+    return os.path.splitext(pfile)[1] in BINARY_FORMATS
+
+
+def _structured_to_values(array, pnames):
+    import numpy as np
+    pvalues = np.empty((array.size, len(pnames)), dtype=array.dtype[0] if pnames else float)
+    for j, name in enumerate(pnames):
+        pvalues[:, j] = array[name]
+    return pvalues
+
+
+def _text_blocks(f, chunksize):
+    import numpy as np
+    try:
+        while True:
+            lines = list(itertools.islice(f, chunksize))
+            if not lines:
+                break
+            lines = [line for line in lines if line.strip()]
+            if lines:
+                yield np.loadtxt(lines, ndmin=2)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def open_dataframe(pfile, chunksize=CHUNKSIZE):
+    """return names and an iterator over blocks of (at most) `chunksize` rows,
+    from text file (`-` for standard input), or binary file (.npy or .npz)
+    """
     import numpy as np
-    header = open(pfile).readline().strip()
+    ext = os.path.splitext(pfile)[1]
+    if ext == '.npy':
+        # structured array with one field per column
+        array = np.load(pfile, mmap_mode='r')
+        pnames = list(array.dtype.names)
+        return pnames, (_structured_to_values(array[start:start+chunksize], pnames)
+                        for start in range(0, array.size, chunksize))
+    if ext == '.npz':
+        with np.load(pfile) as data:
+            pnames = [str(name) for name in data['names']]
+            pvalues = data['values']
+        return pnames, (pvalues[start:start+chunksize] 
+                        for start in range(0, len(pvalues), chunksize))
+    f = sys.stdin if pfile == '-' else open(pfile)
+    header = f.readline().strip()
     if header.startswith('#'):
         header = header[1:]
-    pnames = header.split()
-    pvalues = np.loadtxt(pfile, skiprows=1)  
-    if np.ndim(pvalues) == 1:
-        pvalues = pvalues[:, None]
-    return pnames, pvalues
+    return header.split(), _text_blocks(f, chunksize)
+
+
+def iter_dataframe(pfile, chunksize=CHUNKSIZE):
+    " iterate over blocks of rows as (names, values), see open_dataframe "
+    pnames, blocks = open_dataframe(pfile, chunksize)
+    for block in blocks:
+        yield pnames, block
+
+
+def read_dataframe(pfile):
+    """read names and values from text file (`-` for standard input), 
+    or binary file (.npy or .npz)
+    """
+    import numpy as np
+    pnames, blocks = open_dataframe(pfile)
+    blocks = list(blocks)
+    if not blocks:
+        return pnames, np.empty((0, len(pnames)))
+    return pnames, np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+
+
+def write_dataframe(pfile, pnames, pvalues):
+    """write names and values to binary file (.npy or .npz), 
+    see DataFrame.write for text files
+    """
+    import numpy as np
+    ext = os.path.splitext(pfile)[1]
+    pvalues = np.asarray(pvalues)
+    if ext == '.npy':
+        array = np.empty(pvalues.shape[0], dtype=[(str(name), pvalues.dtype) for name in pnames])
+        for j, name in enumerate(pnames):
+            array[name] = pvalues[:, j]
+        np.save(pfile, array)
+    elif ext == '.npz':
+        np.savez(pfile, values=pvalues, names=np.array(pnames, dtype=str))
+    else:
+        raise ValueError("unknown binary format: "+pfile)
 
 
 # 2-D data structure
@@ -81,9 +203,22 @@ class DataFrame(object):
         names, values = read_dataframe(pfile)
         return cls(values, names)
 
-    def write(self, pfile):
+    @classmethod 
+    def iter_read(cls, pfile, chunksize=CHUNKSIZE):
+        " iterate over blocks of (at most) `chunksize` rows, without reading the whole file "
+        for names, values in iter_dataframe(pfile, chunksize):
+            yield cls(values, names)
+
+    def write(self, pfile, chunksize=CHUNKSIZE):
+        """write to text file (streamed by chunks, also accepts an open file), 
+        or binary file for .npy and .npz extensions
+        """
+        if hasattr(pfile, 'write'):
+            return write_dataframe_text(pfile, self.names, self.values, chunksize)
+        if is_binary(pfile):
+            return write_dataframe(pfile, self.names, self.values)
         with open(pfile, "w") as f:
-            f.write(str(self))
+            write_dataframe_text(f, self.names, self.values, chunksize)
 
     # make it like a pandas DataFrame
     def __getitem__(self, k):
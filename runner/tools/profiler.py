@@ -0,0 +1,111 @@
+"""Profiling of job commands and ensemble workers
+
+`job --profile[=FILE] CMD ...` runs CMD under cProfile (or a sampling profiler
+when requested and available) and prints the top hot functions. Ensemble
+workers started by XRun are profiled too: each member run dumps its own
+profile in a temporary directory (passed through the environment, so that
+it is inherited by worker processes), and these are merged with pstats into
+a second file once the command returns.
+"""
+from __future__ import print_function, absolute_import
+import os
+import sys
+import glob
+import shutil
+import logging
+import tempfile
+import cProfile
+import pstats
+from contextlib import contextmanager
+
+PROFILE_FILE = 'job.prof'
+PROFILE_DIR_ENV = 'RUNNER_PROFILE_DIR'  # where workers write their profiles
+PROFILE_PID_ENV = 'RUNNER_PROFILE_PID'  # main process, already profiled
+PROFILE_TOP = 20
+
+
+def workers_file(file):
+    " file for the merged worker profiles, e.g. job.workers.prof "
+    root, ext = os.path.splitext(file)
+    return root + '.workers' + (ext or '.prof')
+
+
+@contextmanager
+def worker_profile(name):
+    """profile the block if running in a worker of a profiled job
+    (no-op otherwise)
+    """
+    folder = os.environ.get(PROFILE_DIR_ENV)
+    if not folder or os.environ.get(PROFILE_PID_ENV) == str(os.getpid()):
+        yield
+        return
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        prof.dump_stats(os.path.join(folder, '{}-{}.prof'.format(os.getpid(), name)))
+
+
+def print_stats(file, top=PROFILE_TOP, stream=None):
+    stats = pstats.Stats(file, stream=stream or sys.stderr)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(top)
+
+
+def merge_stats(files, file):
+    " merge several profiles into one file "
+    stats = pstats.Stats(*files)
+    stats.dump_stats(file)
+    return stats
+
+
+def _sampling_profiler():
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        logging.warning("sampling profiler (pyinstrument) not available, use cProfile")
+        return None
+    return Profiler()
+
+
+@contextmanager
+def profile(file=PROFILE_FILE, top=PROFILE_TOP, sampling=False):
+    """profile the block (main process and ensemble workers),
+    write results and print a summary to stderr
+    """
+    folder = tempfile.mkdtemp(prefix='runner-profile-')
+    environ = {PROFILE_DIR_ENV: folder, PROFILE_PID_ENV: str(os.getpid())}
+    os.environ.update(environ)
+
+    sampler = _sampling_profiler() if sampling else None
+    prof = sampler or cProfile.Profile()
+    if sampler:
+        sampler.start()
+    else:
+        prof.enable()
+    try:
+        yield
+    finally:
+        if sampler:
+            sampler.stop()
+            text = sampler.output_text()
+            with open(file, 'w') as f:
+                f.write(text)
+            print(text, file=sys.stderr)
+        else:
+            prof.disable()
+            prof.dump_stats(file)
+            print("Profile written to "+file, file=sys.stderr)
+            print_stats(file, top)
+
+        for name in environ:
+            del os.environ[name]
+        files = glob.glob(os.path.join(folder, '*.prof'))
+        if files:
+            wfile = workers_file(file)
+            merge_stats(files, wfile)
+            print("Profiles of {} worker runs merged into {}".format(len(files), wfile),
+                  file=sys.stderr)
+            print_stats(wfile, top)
+        shutil.rmtree(folder)
@@ -0,0 +1,26 @@
+"""Random number generators
+
+Sampling and resampling functions accept a `random_state`, which may be None,
+an integer seed, a numpy SeedSequence or Generator, and draw from a numpy
+Generator (see get_rng) instead of the global random state. Independent
+streams, e.g. one per parameter, or for the resampling and jitter steps, are
+spawned from a single seed (see spawn), so that results are reproducible bit
+for bit from one `--seed`.
+"""
+import numpy as np
+
+
+def get_rng(random_state=None):
+    " numpy Generator from a seed, SeedSequence or Generator "
+    if isinstance(random_state, np.random.Generator):
+        return random_state
+    return np.random.default_rng(random_state)
+
+
+def spawn(random_state, n):
+    " n independent Generators derived from a seed, SeedSequence or Generator "
+    if isinstance(random_state, np.random.Generator):
+        return random_state.spawn(n)
+    if not isinstance(random_state, np.random.SeedSequence):
+        random_state = np.random.SeedSequence(random_state)
+    return [np.random.default_rng(s) for s in random_state.spawn(n)]
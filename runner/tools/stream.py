@@ -0,0 +1,207 @@
+"""Streaming statistics
+
+Estimators are updated chunk-wise, in bounded memory, and their partial
+states can be merged (e.g. across workers or experiment shards).
+"""
+from __future__ import division
+from collections import OrderedDict as odict
+import numpy as np
+
+QUANTILE_K = 1024  # capacity of each compactor level of QuantileSketch
+
+
+class RunningStats(object):
+    """Mean, standard deviation, min and max along the first axis
+
+    Chunks are combined with the parallel form of Welford's algorithm
+    (Chan et al., 1979), which is also used to merge two partial states.
+    """
+    def __init__(self, count=0, mean=0., m2=0., min=np.inf, max=-np.inf):
+        self.count = count
+        self.mean = np.asarray(mean, dtype=float)
+        self.m2 = np.asarray(m2, dtype=float)
+        self.min = np.asarray(min, dtype=float)
+        self.max = np.asarray(max, dtype=float)
+
+    def _combine(self, count, mean, m2, min, max):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta**2 * self.count * count / total
+        self.min = np.minimum(self.min, min)
+        self.max = np.maximum(self.max, max)
+        self.count = total
+
+    def update(self, values):
+        " add a chunk of values (first axis is the sample dimension) "
+        values = np.asarray(values, dtype=float)
+        if values.shape[0] == 0:
+            return self
+        mean = values.mean(axis=0)
+        self._combine(values.shape[0], mean, ((values - mean)**2).sum(axis=0),
+                      values.min(axis=0), values.max(axis=0))
+        return self
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    def var(self, ddof=0):
+        return self.m2 / (self.count - ddof) if self.count > ddof else self.m2 * np.nan
+
+    def std(self, ddof=0):
+        return np.sqrt(self.var(ddof))
+
+    def as_dict(self):
+        return {'count': self.count, 'mean': self.mean.tolist(), 'm2': self.m2.tolist(),
+                'min': self.min.tolist(), 'max': self.max.tolist()}
+
+    @classmethod
+    def fromkw(cls, **kwargs):
+        return cls(**kwargs)
+
+
+class QuantileSketch(object):
+    """Mergeable quantile sketch (compactor hierarchy, as in MRL / KLL sketches)
+
+    Items at level h carry a weight 2**h. When a level holds more than `k`
+    items, it is sorted and every other item is promoted to the next level.
+    Quantiles are exact as long as fewer than `k` items were added, and their
+    rank error otherwise decreases as 1/k. Several columns are handled at once.
+    """
+    def __init__(self, k=QUANTILE_K, levels=None, offset=0):
+        self.k = k
+        self.levels = [np.asarray(l, dtype=float) for l in levels] if levels else []
+        if self.levels:
+            # empty levels (e.g. from as_dict) take the shape of the top level
+            shape = (-1,) + self.levels[-1].shape[1:]
+            self.levels = [level.reshape(shape) for level in self.levels]
+        self._offset = offset
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if level.shape[0] > self.k:
+                level = np.sort(level, axis=0)
+                n = level.shape[0] // 2 * 2
+                promoted = level[self._offset:n:2]
+                self._offset = 1 - self._offset  # alternate to avoid bias
+                self.levels[h] = level[n:]
+                if h + 1 == len(self.levels):
+                    self.levels.append(promoted)
+                else:
+                    self.levels[h+1] = np.concatenate([self.levels[h+1], promoted])
+            h += 1
+
+    def update(self, values):
+        " add a chunk of values (first axis is the sample dimension) "
+        values = np.asarray(values, dtype=float)
+        if not self.levels:
+            self.levels.append(values)
+        else:
+            self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        for h, level in enumerate(other.levels):
+            if h < len(self.levels):
+                self.levels[h] = np.concatenate([self.levels[h], level])
+            else:
+                self.levels.append(level.copy())
+        self._compress()
+        return self
+
+    @property
+    def count(self):
+        return sum(level.shape[0] * 2**h for h, level in enumerate(self.levels))
+
+    def percentile(self, q):
+        """like np.percentile(values, q, axis=0) (exact for small samples)
+        """
+        if not self.levels:
+            return np.full(len(q), np.nan) if np.ndim(q) else np.nan
+        if len(self.levels) == 1:
+            return np.percentile(self.levels[0], q, axis=0)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.zeros(level.shape[0]) + 2**h
+                                  for h, level in enumerate(self.levels)])
+        order = np.argsort(values, axis=0)
+        total = weights.sum()
+        res = []
+        for j in range(values.shape[1]):
+            w = weights[order[:, j]]
+            rank = (np.cumsum(w) - 0.5*w) / total
+            res.append(np.interp(q/100, rank, values[order[:, j], j]))
+        return np.array(res)
+
+    def as_dict(self):
+        return {'k': self.k, 'levels': [level.tolist() for level in self.levels],
+                'offset': self._offset}
+
+    @classmethod
+    def fromkw(cls, **kwargs):
+        return cls(**kwargs)
+
+
+class EnsembleStats(object):
+    """Summary statistics of ensemble output, as written in stats.txt
+
+    Updated chunk-wise with the output of a block of members, their total
+    log-likelihood and validity flags. Members with undefined log-likelihood
+    are ignored for `best`.
+    """
+    def __init__(self, names, k=QUANTILE_K):
+        self.names = list(names)
+        self.moments = RunningStats()
+        self.quantiles = QuantileSketch(k)
+        self.best = np.zeros(len(names)) + np.nan
+        self.best_loglik = -np.inf
+        self.valids = odict()
+
+    def update(self, output, loglik, valid, valids=None):
+        """
+        * output : chunk of output values (members x names)
+        * loglik : total log-likelihood of each member
+        * valid : boolean mask of members to include in the statistics
+        * valids : [(label, members x names boolean array)], counted per name
+        """
+        output = np.asarray(output, dtype=float)
+        loglik = np.asarray(loglik, dtype=float)
+        if np.any(np.isfinite(loglik)):
+            i = np.where(np.isfinite(loglik), loglik, -np.inf).argmax()
+            if loglik[i] > self.best_loglik:
+                self.best_loglik = loglik[i]
+                self.best = output[i]
+        self.moments.update(output[valid])
+        if np.any(valid):
+            self.quantiles.update(output[valid])
+        for label, flags in (valids or []):
+            self.valids[label] = self.valids.get(label, 0) + np.asarray(flags).sum(axis=0)
+        return self
+
+    def merge(self, other):
+        if other.best_loglik > self.best_loglik:
+            self.best_loglik = other.best_loglik
+            self.best = other.best
+        self.moments.merge(other.moments)
+        self.quantiles.merge(other.quantiles)
+        for label, count in other.valids.items():
+            self.valids[label] = self.valids.get(label, 0) + count
+        return self
+
+    def table(self):
+        """[(label, values)] rows, in stats.txt order (NaN if no member is valid)
+        """
+        if self.moments.count == 0:
+            nan = np.zeros(len(self.names)) + np.nan
+            moments = [nan]*7
+        else:
+            pct = self.quantiles.percentile
+            moments = [self.moments.mean, self.moments.std(), self.moments.min, 
+                       pct(5), pct(50), pct(95), self.moments.max]
+        labels = ["mean", "std", "min", "p05", "med", "p95", "max"]
+        return [("best", self.best)] + list(zip(labels, moments)) + list(self.valids.items())
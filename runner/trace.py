@@ -0,0 +1,106 @@
+"""Per-phase tracing of member execution
+
+Timed spans are appended as JSON lines to the experiment directory, e.g.
+
+    {"name": "model", "start": 1476871834.2, "duration": 12.1, "pid": 4242, "runid": 3}
+
+Member phases (see ModelInterface.run) are:
+
+- setup : run directory creation, command and parameter file rendering
+- spawn : subprocess creation
+- model : model execution (waiting for the subprocess)
+- postprocess : reading model output
+- write : runner.json writes
+
+and `member` spans the whole member execution in the worker, journal
+included. XRun.run adds orchestration spans (pool start-up, task submission,
+and `gather`, i.e. the wall time of waiting for all members) with a `null`
+runid. Spans are buffered by the Tracer and written at once with
+runner.journal.append_lines.
+"""
+from __future__ import division
+import os
+import time
+from collections import OrderedDict as odict
+from contextlib import contextmanager
+import numpy as np
+from runner.journal import append_lines, read_lines
+
+TRACE = 'trace.jsonl'
+PHASES = ('setup', 'spawn', 'model', 'postprocess', 'write')
+
+
+class Tracer(object):
+    """Collect timed spans, written to `file` on flush (disabled if None)
+    """
+    def __init__(self, file=None, **context):
+        self.file = file
+        self.context = context
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, **info):
+        start = time.time()
+        try:
+            yield
+        finally:
+            if self.file is not None:
+                span = odict([('name', name), ('start', start),
+                              ('duration', time.time()-start), ('pid', os.getpid())])
+                span.update(self.context)
+                span.update(info)
+                self.spans.append(span)
+
+    def flush(self):
+        if self.file is not None and self.spans:
+            append_lines(self.file, self.spans)
+        self.spans = []
+
+
+def read_trace(file):
+    return read_lines(file)[0]
+
+
+def to_chrome(spans):
+    """convert spans to Chrome trace event format (chrome://tracing, Perfetto)
+    with one row per process (worker)
+    """
+    events = []
+    for s in spans:
+        args = {k: v for k, v in s.items() if k not in ('name', 'start', 'duration', 'pid')}
+        events.append({'name': s['name'], 'ph': 'X', 'ts': s['start']*1e6,
+                       'dur': s['duration']*1e6, 'pid': s['pid'], 'tid': s['pid'],
+                       'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def summarize(spans, top=5):
+    """per-phase duration percentiles, and top overheads (non-model time)
+    """
+    durations = odict()
+    for s in spans:
+        durations.setdefault(s['name'], []).append(s['duration'])
+
+    names = [n for n in PHASES + ('member',) if n in durations] + \
+        sorted(n for n in durations if n not in PHASES + ('member',))
+    lines = ["{:<12} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "phase", "count", "total", "p50", "p90", "p99", "max")]
+    for name in names:
+        d = np.array(durations[name])
+        p50, p90, p99 = np.percentile(d, [50, 90, 99])
+        lines.append("{:<12} {:>7} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            name, d.size, d.sum(), p50, p90, p99, d.max()))
+
+    # overheads: anything but the model itself, including time spent in the
+    # worker outside of the traced phases (journal, pickling...)
+    overheads = [(n, sum(durations[n])) for n in names if n not in ('model', 'member', 'gather')]
+    if 'member' in durations:
+        phases = sum(sum(durations.get(n, [])) for n in PHASES)
+        overheads.append(('untraced', max(sum(durations['member']) - phases, 0)))
+    overheads = sorted(overheads, key=lambda x: -x[1])[:top]
+    total = sum(durations.get('member', durations.get('model', [])))
+    lines.append("")
+    lines.append("Top overheads (seconds, % of member time):")
+    for name, t in overheads:
+        lines.append("  {:<12} {:>10.3f} {:>6.1f}%".format(name, t, 100*t/total if total else np.nan))
+    return "\n".join(lines)
@@ -1,6 +1,12 @@
 # XParams
+import json
+import operator
 from collections import OrderedDict as odict
+from functools import reduce
+import six
+import numpy as np
 from runner.tools import DataFrame
+from runner.tools.frame import CHUNKSIZE, is_binary, write_dataframe_blocks
 from runner.resample import Resampler, RESAMPLING_METHOD, NEFF_BOUNDS
 
 
@@ -15,6 +21,20 @@ class XParams(DataFrame):
         self.names = names
         self.default = default
 
+    @classmethod
+    def read(cls, pfile):
+        " also read factorial designs saved as levels (.json, see XFactorial) "
+        if pfile.endswith('.json'):
+            return XFactorial.read(pfile)
+        return super(XParams, cls).read(pfile)
+
+    @classmethod
+    def iter_read(cls, pfile, chunksize=CHUNKSIZE):
+        " iterate over blocks of rows, also for factorial designs (.json) "
+        if pfile.endswith('.json'):
+            return XFactorial.read(pfile).iter_chunks(chunksize)
+        return super(XParams, cls).iter_read(pfile, chunksize)
+
     def pset_as_array(self, i=None):
         if i is None:
             pvalues = self.default
@@ -24,6 +44,12 @@ class XParams(DataFrame):
             pvalues = pvalues.tolist() # numpy array
         return pvalues
 
+    def __getitem__(self, k):
+        " column values by name, or rows for a slice (as XParams) "
+        if isinstance(k, slice):
+            return XParams(self.values[k], self.names)
+        return super(XParams, self).__getitem__(k)
+
     def pset_as_dict(self, i=None):
         """return parameter set as a dictionary
         """
@@ -38,7 +64,7 @@ class XParams(DataFrame):
         return params
 
     def resample(self, weights, size=None, seed=None, method=RESAMPLING_METHOD, 
-                 iis=False, epsilon=None, neff_bounds=NEFF_BOUNDS, bounds=None):
+                 iis=False, epsilon=None, neff_bounds=NEFF_BOUNDS, bounds=None, corr=None):
         """
         Parameters
         ----------
@@ -57,6 +83,8 @@ class XParams(DataFrame):
         neff_bounds : target effective ensemble size to determine epsilon automatically
         bounds : authorized parameter range (experimental). If jitter addition yields parameters
             outside the specified range, try again a number of times. [iis method only]
+        corr : correlation matrix of the jitter, e.g. prior correlation (see 
+            MultiParam.pearson_corr), instead of the resampled ensemble's [iis method only]
 
 
         Returns
@@ -71,9 +99,114 @@ class XParams(DataFrame):
             vals = resampler.iis(self.values, 
                            size=size, seed=seed, method=method, 
                            bounds=bounds, neff_bounds=neff_bounds, 
-                           epsilon=epsilon)
+                           epsilon=epsilon, corr=corr)
 
         else:
             idx = resampler.sample(size=size, seed=seed, method=method)
             vals = self.values[idx]
         return XParams(vals, self.names)
+
+
+class XFactorial(XParams):
+    """Lazy full factorial design
+
+    Row i is computed on demand from its mixed-radix index (the last factor 
+    varies fastest, as in itertools.product), so that huge grids can be 
+    indexed, iterated by chunks and written without being built in memory.
+    The `values` property materializes the full design.
+    """
+    def __init__(self, levels, names, default=None):
+        """
+        * levels : list of sequences, the values of each factor
+        * names : factor names
+        """
+        self.levels = [list(l) for l in levels]
+        self.names = names
+        self.default = default
+        arrays = [np.array(l) for l in self.levels]
+        dtypes = set(a.dtype for a in arrays)
+        # mixed types (e.g. int and float) are kept as python objects
+        self.dtype = dtypes.pop() if len(dtypes) == 1 else object
+        self._arrays = [np.array(l, dtype=self.dtype) for l in self.levels]
+
+    @property
+    def shape_levels(self):
+        return tuple(len(l) for l in self.levels)
+
+    @property
+    def size(self):
+        return reduce(operator.mul, self.shape_levels, 1)
+
+    def take(self, indices):
+        " rows for an array of (non-negative) indices, as 2-D array "
+        indices = np.asarray(indices, dtype=np.int64)
+        if indices.size and (indices.min() < 0 or indices.max() >= self.size):
+            raise IndexError("factorial design index out of range (size {})".format(self.size))
+        if not self.levels:
+            return np.empty((indices.size, 0), dtype=self.dtype)
+        return self._level_values(np.unravel_index(indices, self.shape_levels))
+
+    def _level_values(self, subs):
+        values = np.empty((len(subs[0]), len(self.levels)), dtype=self.dtype)
+        for j, (a, sub) in enumerate(zip(self._arrays, subs)):
+            values[:, j] = a[sub]
+        return values
+
+    def subset(self, design):
+        """rows of a design given as level indices (n x k array, e.g. a 
+        fractional factorial), as XParams
+        """
+        design = np.asarray(design)
+        return XParams(self._level_values(design.T), self.names)
+
+    @property
+    def values(self):
+        return self.take(np.arange(self.size))
+
+    def pset_as_array(self, i=None):
+        if i is None:
+            return self.default
+        return self.take([i])[0].tolist()
+
+    def __getitem__(self, k):
+        """column values by name, as for other XParams, or (materialized)
+        rows for an integer, slice or array of indices
+        """
+        if isinstance(k, six.string_types):
+            j = self.names.index(k)
+            inner = reduce(operator.mul, self.shape_levels[j+1:], 1)
+            outer = reduce(operator.mul, self.shape_levels[:j], 1)
+            return np.tile(np.repeat(self._arrays[j], inner), outer)
+        if isinstance(k, slice):
+            k = np.arange(*k.indices(self.size))
+        elif np.ndim(k) == 0:
+            return self.pset_as_array(k + self.size if k < 0 else k)
+        return XParams(self.take(k), self.names)
+
+    def iter_chunks(self, chunksize=CHUNKSIZE):
+        " iterate over blocks of rows, as XParams "
+        for start in six.moves.range(0, self.size, chunksize):
+            stop = min(start+chunksize, self.size)
+            yield XParams(self.take(np.arange(start, stop)), self.names)
+
+    @classmethod
+    def read(cls, pfile):
+        with open(pfile) as f:
+            js = json.load(f)
+        return cls(js['levels'], js['names'])
+
+    def write(self, pfile, chunksize=CHUNKSIZE):
+        """stream the design to a text file by chunks, or save its levels only 
+        for the .json extension (binary formats are materialized, see XParams.write)
+        """
+        if not hasattr(pfile, 'write') and pfile.endswith('.json'):
+            with open(pfile, 'w') as f:
+                json.dump({'names': self.names, 'levels': self.levels}, f)
+            return
+        if not hasattr(pfile, 'write') and is_binary(pfile):
+            return XParams(self.values, self.names).write(pfile)
+        blocks = (chunk.values for chunk in self.iter_chunks(chunksize))
+        if hasattr(pfile, 'write'):
+            return write_dataframe_blocks(pfile, self.names, blocks)
+        with open(pfile, 'w') as f:
+            write_dataframe_blocks(f, self.names, blocks)
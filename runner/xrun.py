@@ -6,19 +6,39 @@ import signal
 import time
 import json
 import copy
+import functools
 import os
 import sys
 import multiprocessing
 import six
+from collections import OrderedDict as odict
 from os.path import join
 import numpy as np
 
 from runner.tools.tree import autofolder
-from runner.tools.frame import str_dataframe
+from runner.tools.frame import str_dataframe, write_dataframe_header, write_dataframe_rows
+from runner.tools.stream import EnsembleStats
 from runner.model import Param, Model
 from runner.xparams import XParams
+from runner.journal import Journal, JOURNAL, FINAL_STATES
+from runner.trace import Tracer, TRACE
+from runner.tools.profiler import worker_profile
 
 XPARAM = 'params.txt'
+XPARAM_LEVELS = 'params.json'  # large factorial designs, as levels (see XFactorial)
+XPARAM_FILES = (XPARAM, 'params.npy', 'params.npz', XPARAM_LEVELS)  # text or binary (see DataFrame)
+XOUTPUT_ARRAY = 'output.{}.npy'  # ensemble-level array output, in expdir
+CHUNKSIZE = 10000  # members per block in streaming analysis
+ANAINDEX = 'analyze.json'  # members already read by incremental analysis
+XPRIOR = 'prior.json'  # sampling prior, if any (see MultiParam.write)
+
+def find_params_file(expdir):
+    " experiment params file, text or binary (None if not found) "
+    for name in XPARAM_FILES:
+        pfile = join(expdir, name)
+        if os.path.exists(pfile):
+            return pfile
+
 
 def nans(N):
     a = np.empty(N)
@@ -36,6 +56,7 @@ class XData(XParams):
 
 
 def _model_output_as_array(m, names=None):
+    " scalar output values, array output is reduced to its mean "
     if m.status == "success": 
         if names is None:
             names = m.output
@@ -45,6 +66,84 @@ def _model_output_as_array(m, names=None):
     return res
 
 
+class AnalysisIndex(object):
+    """Record of ensemble members already read by `XRun.analyze`
+
+    Members are keyed by run directory, along with the modification time and
+    size of their runner.json file, so that only new or changed members are
+    read again on the next incremental analysis.
+    """
+    def __init__(self, names, records=None):
+        self.names = list(names)
+        self.records = records or {}
+
+    @classmethod
+    def read(cls, file):
+        js = json.load(open(file))
+        return cls(js['names'], js['records'])
+
+    def write(self, file):
+        with open(file, 'w') as f:
+            json.dump({'names':self.names, 'records':self.records}, f)
+
+    def update(self, xrun):
+        """Read new or changed members, return the number of members read
+        """
+        count = 0
+        for m in xrun:
+            try:
+                st = os.stat(m.runfile)
+            except OSError:
+                self.records.pop(m.rundir, None)  # not started yet
+                continue
+            stamp = [st.st_mtime, st.st_size]
+            record = self.records.get(m.rundir)
+            if record is not None and record['stamp'] == stamp:
+                continue
+            m.load()
+            if m.status == 'success':
+                output = [float(v) for v in _model_output_as_array(m, self.names)]
+            else:
+                output = None
+            self.records[m.rundir] = {
+                'stamp': stamp,
+                'status': m.status,
+                'output': output,
+            }
+            count += 1
+        return count
+
+    def finished(self, xrun):
+        """True if all submitted members ended (success, failed or timeout), 
+        according to their runner.json file or to the experiment journal. 
+        Only members recorded in the journal are considered (e.g. `job run -j`), 
+        or all members if there is no journal.
+        """
+        states = xrun.journal.summary().states
+        status = self.status(xrun)
+        runids = [i for i in states if i is not None] if states else range(len(xrun))
+        return all(status[i] in FINAL_STATES or states.get(i) in FINAL_STATES for i in runids)
+
+    def status(self, xrun):
+        return [self.records.get(m.rundir, {}).get('status') for m in xrun]
+
+    def iter_output(self, xrun, chunksize=CHUNKSIZE):
+        " iterate over (slice, XData) blocks of at most `chunksize` members "
+        for start in six.moves.range(0, len(xrun), chunksize):
+            stop = min(start+chunksize, len(xrun))
+            values = nans((stop-start, len(self.names)))
+            for i in six.moves.range(start, stop):
+                output = self.records.get(xrun.get_rundir(i), {}).get('output')
+                if output is not None:
+                    values[i-start] = output
+            yield slice(start, stop), XData(values, self.names)
+
+    def get_output(self, xrun):
+        blocks = [xoutput.values for _, xoutput in self.iter_output(xrun)]
+        values = np.concatenate(blocks) if blocks else nans((0, len(self.names)))
+        return XData(values, self.names)
+
+
 def init_worker():
     # to handle KeyboardInterrupt manually
     # http://stackoverflow.com/a/6191991/2192272
@@ -85,7 +184,15 @@ class _PickableMethod(object):
 
 class XRun(object):
 
-    def __init__(self, model, params, expdir='./', autodir=False, rundir_template='{}', max_workers=None, timeout=31536000):
+    def __init__(self, model, params, expdir='./', autodir=False, rundir_template='{}', max_workers=None, timeout=31536000,
+                 params_file=XPARAM):
+        """
+        * model : Model instance
+        * params : XParams instance, ensemble parameters
+        * expdir : experiment directory
+        * params_file : name of the params file written in expdir, 
+            binary format for .npy or .npz extension (see XParams.write)
+        """
         self.model = model
         self.params = params  # XParams class
         self.expdir = expdir
@@ -93,18 +200,25 @@ class XRun(object):
         self.rundir_template = rundir_template
         self.max_workers = max_workers
         self.timeout = timeout
+        self.params_file = params_file
  
-    def setup(self, force=False):
-        """Create directory and write experiment params
+    def setup(self, force=False, segment=True):
+        """Create directory and write experiment params, and start a new 
+        journal segment (unless segment=False, e.g. to resume the experiment)
         """
         if not os.path.exists(self.expdir):
             logging.info("create directory: "+self.expdir)
             os.makedirs(self.expdir)
 
-        pfile = join(self.expdir, XPARAM)
-        if os.path.exists(pfile) and not force:
+        pfile = find_params_file(self.expdir)
+        if pfile is not None and not force:
             raise RuntimeError(repr(pfile)+" param file already exists")
-        self.params.write(join(self.expdir, XPARAM))
+        for name in XPARAM_FILES:
+            if name != self.params_file and os.path.exists(join(self.expdir, name)):
+                os.remove(join(self.expdir, name))  # only one params file
+        self.params.write(join(self.expdir, self.params_file))
+        if segment:
+            self.journal.segment(size=self.params.size)
 
     def get_rundir(self, runid):
         if runid is None:
@@ -137,8 +251,30 @@ class XRun(object):
             yield self[i]
 
 
+    @property
+    def journal(self):
+        return Journal(join(self.expdir, JOURNAL))
+
+    def tracer(self, runid=None):
+        return Tracer(join(self.expdir, TRACE), runid=None if runid is None else int(runid))
+
     def _run(self, i, **kwargs):
-        return self[i].run(**kwargs)
+        journal = self.journal
+        tracer = self.tracer(i)
+        try:
+            with worker_profile('run-{}'.format(i)), tracer.span('member'):
+                journal.append(i, 'running', pid=os.getpid())
+                start = time.time()
+                try:
+                    res = self[i].run(tracer=tracer, **kwargs)
+                except Exception as error:
+                    journal.append(i, 'failed', duration=time.time()-start, 
+                                   error="{}: {}".format(type(error).__name__, error)[:500])
+                    raise
+                journal.append(i, 'success', duration=time.time()-start)
+        finally:
+            tracer.flush()
+        return res
 
     def run(self, indices=None, callback=None, **kwargs):
         """Wrapper for multiprocessing.Pool.map
@@ -149,24 +285,37 @@ class XRun(object):
         else:
             N = len(indices)
 
-        # workers pool
-        pool = multiprocessing.Pool(self.max_workers or N, init_worker)
-
-        # prepare method
-        run_model = _PickableMethod(self, '_run')
-        run_model = _AbortableWorker(run_model, timeout=self.timeout)
+        tracer = self.tracer()
 
-        ares = [pool.apply_async(run_model, (i,), kwds=kwargs, callback=callback) for i in indices]
+        self.journal.extend(indices, 'queued')
 
-        res = []
-        successes = 0
-        for i,r in enumerate(ares):
-            try:
-                res.append(r.get(1e9))
-                successes += 1
-            except Exception as error:
-                logging.warn("run {} failed:{}:{}".format(i, type(error).__name__, str(error)))
-                res.append(None)
+        # spans are written also if the run fails or is interrupted
+        try:
+            # workers pool
+            with tracer.span('pool'):
+                pool = multiprocessing.Pool(self.max_workers or N, init_worker)
+
+            # prepare method
+            run_model = _PickableMethod(self, '_run')
+            run_model = _AbortableWorker(run_model, timeout=self.timeout)
+
+            with tracer.span('submit'):
+                ares = [pool.apply_async(run_model, (i,), kwds=kwargs, callback=callback) for i in indices]
+
+            res = []
+            successes = 0
+            with tracer.span('gather'):
+                for i,r in enumerate(ares):
+                    try:
+                        res.append(r.get(1e9))
+                        successes += 1
+                    except Exception as error:
+                        if isinstance(error, multiprocessing.TimeoutError):
+                            self.journal.append(indices[i], 'timeout', duration=self.timeout)
+                        logging.warn("run {} failed:{}:{}".format(i, type(error).__name__, str(error)))
+                        res.append(None)
+        finally:
+            tracer.flush()
 
         if successes == N:
             logging.info("all runs finished successfully")
@@ -179,9 +328,40 @@ class XRun(object):
         return res
 
 
-    def postprocess(self):
-        return [m.postprocess() if m.load().status == "success" else None 
-                for m in self]
+    def _postprocess(self, i, force=False):
+        with worker_profile('postprocess-{}'.format(i)):
+            return self._postprocess_member(i, force)
+
+    def _postprocess_member(self, i, force=False):
+        m = self[i]
+        if m.load().status != "success":
+            return None
+        if not force and m.is_postprocessed():
+            return False
+        m.postprocess()
+        return True
+
+
+    def postprocess(self, indices=None, force=False):
+        """Apply model postprocess to successful members, in parallel
+
+        Members already postprocessed after their output file was last 
+        modified are skipped, unless `force=True`. Return, for each member,
+        True (postprocessed), False (up-to-date) or None (not successful).
+        """
+        if indices is None:
+            indices = six.moves.range(len(self))
+
+        pool = multiprocessing.Pool(self.max_workers, init_worker)
+        try:
+            postprocess = _PickableMethod(self, '_postprocess')
+            res = pool.map(functools.partial(postprocess, force=force), indices)
+        finally:
+            pool.terminate()
+
+        logging.info("{} members postprocessed, {} up-to-date, {} not successful".format(
+            res.count(True), res.count(False), res.count(None)))
+        return res
 
 
     def get_first_valid(self):
@@ -195,9 +375,18 @@ class XRun(object):
         return self[self.get_first_valid()].load().output.keys()
 
 
-    def get_output(self, names=None):
+    def get_output(self, names=None, arrays=False):
+        """Model output of all ensemble members
+
+        By default return an XData table of scalar values, where any array
+        output is reduced to its mean. With `arrays=True`, return a dict of
+        read-only memory-mapped arrays of shape (N, ...), one per variable,
+        with NaNs for failed members (see `get_output_arrays`).
+        """
         if names is None:
             names = self.get_output_names()
+        if arrays:
+            return self.get_output_arrays(names)
         values = nans((len(self), len(names)))
         for i, m in enumerate(self):
             m.load()
@@ -206,6 +395,67 @@ class XRun(object):
         return XData(values, names)
 
 
+    def _runfiles_mtime(self):
+        mtime = 0
+        for m in self:
+            if os.path.exists(m.runfile):
+                mtime = max(mtime, os.path.getmtime(m.runfile))
+        return mtime
+
+
+    def get_output_arrays(self, names=None):
+        """Ensemble-level output arrays, stored as expdir/output.NAME.npy
+
+        The .npy files are (re)built in a single pass over the members if any
+        runner.json file is more recent or the number of members changed (e.g.
+        extended ensemble), and returned as memory-mapped arrays.
+        """
+        if names is None:
+            names = self.get_output_names()
+        files = [join(self.expdir, XOUTPUT_ARRAY.format(name)) for name in names]
+
+        mtime = self._runfiles_mtime()
+        stale = [name for name, file in zip(names, files) 
+                 if not os.path.exists(file) or os.path.getmtime(file) < mtime
+                 or np.load(file, mmap_mode='r').shape[0] != len(self)]
+
+        if stale:
+            logging.info("build ensemble output arrays: "+", ".join(stale))
+            # written to temporary files, renamed once complete
+            tmpfiles = odict((name, join(self.expdir, XOUTPUT_ARRAY.format(name))+'.tmp') 
+                             for name in stale)
+            arrays = {}
+            try:
+                for i, m in enumerate(self):
+                    if not os.path.exists(m.runfile) or m.load().status != "success":
+                        continue
+                    for name in stale:
+                        value = np.asarray(m.output[name], dtype=float)
+                        if name not in arrays:
+                            arrays[name] = np.lib.format.open_memmap(tmpfiles[name], mode='w+', 
+                                dtype=float, shape=(len(self),)+value.shape)
+                            arrays[name][:] = np.nan
+                        if value.shape != arrays[name].shape[1:]:
+                            raise ValueError("output {}: member {} ({}) has shape {}, expected {}".format(
+                                name, i, m.rundir, value.shape, arrays[name].shape[1:]))
+                        arrays[name][i] = value
+                for name in stale:
+                    if name not in arrays:
+                        raise ValueError("no successful run with output: "+name)
+                    arrays[name].flush()
+            except:
+                del arrays
+                for file in tmpfiles.values():
+                    if os.path.exists(file):
+                        os.remove(file)
+                raise
+            del arrays
+            for name in stale:
+                os.rename(tmpfiles[name], join(self.expdir, XOUTPUT_ARRAY.format(name)))
+
+        return odict([(name, np.load(file, mmap_mode='r')) for name, file in zip(names, files)])
+
+
     def _get_params(self, names=None):
         " for checking only "
         if names is None:
@@ -217,34 +467,73 @@ class XRun(object):
         return XData(values, names)
 
 
-    def get_logliks(self):
+    def _likelihood_arrays(self):
+        " memory-mapped (N, ...) ensemble arrays of multivariate likelihood variables "
+        multi = [c.name for c in self.model.likelihood 
+                 if getattr(c.dist, 'multivariate', False)]
+        return self.get_output_arrays(multi) if multi else {}
+
+
+    def _likelihood_output(self, xoutput, chunk=slice(None), arrays=None):
+        """output values for each likelihood variable: a column of xoutput,
+        or the `chunk` rows of the ensemble array for multivariate distributions
+        """
+        if arrays is None:
+            arrays = self._likelihood_arrays()
+        return [arrays[c.name][chunk] if c.name in arrays else xoutput[c.name] 
+                for c in self.model.likelihood]
+
+
+    def get_logliks(self, xoutput=None, chunk=slice(None), arrays=None):
+        """log-likelihood of each member and variable, evaluated at once 
+        for the whole ensemble (xoutput: output table, read if not provided),
+        or for the block of members `chunk` covered by xoutput
+        """
         names = self.model.likelihood.names
-        values = nans((len(self), len(names)))
-        for i, m in enumerate(self):
-            m.load()
-            if m.status == "success": 
-                values[i] = m.likelihood.logpdf()
+        if xoutput is None:
+            xoutput = self.get_output(names)
+        values = nans((xoutput.size, len(names)))
+        for j, (c, output) in enumerate(zip(self.model.likelihood, 
+                                self._likelihood_output(xoutput, chunk, arrays))):
+            values[:, j] = c.dist.logpdf(output)
         return XData(values, names)
 
 
+    def get_logprior(self, chunk=slice(None)):
+        """log-prior of each member, evaluated at once for the whole ensemble
+        or a block of members (zero for a flat prior, i.e. if the model has no prior)
+        """
+        if not self.model.prior:
+            return np.zeros(len(six.moves.range(*chunk.indices(self.params.size))))
+        return self.model.prior.logpdf(self.params[chunk])
+
+
     def get_weight(self):
         logliks = self.get_logliks().values
         return np.where(np.isnan(logliks), 0, np.exp(logliks.sum(axis=1)))
 
 
-    def get_valids(self, alpha, names=None):
+    def get_valids(self, alpha, names=None, xoutput=None, chunk=slice(None), arrays=None):
         if names is None:
             names = self.model.likelihood.names
+        if xoutput is None:
+            xoutput = self.get_output(names)
 
-        values = np.zeros((len(self), len(names)), dtype=bool)
-        for i, m in enumerate(self):
-            m.load()
-            if m.status != "success": 
-                continue
+        success = ~np.all(np.isnan(xoutput.values), axis=1)
+        values = np.zeros((xoutput.size, len(names)), dtype=bool)
+        outputs = dict(zip(self.model.likelihood.names, 
+                           self._likelihood_output(xoutput, chunk, arrays)))
+        for j, name in enumerate(names):
             if alpha is None:
-                values[i] = True
+                values[:, j] = success
+                continue
+            dist = self.model.likelihood[name].dist
+            output = outputs[name]
+            if hasattr(dist, 'isvalid'):
+                values[:, j] = dist.isvalid(output, alpha)
             else:
-                values[i] = [m.likelihood[name].isvalid(alpha) for name in names]
+                lo, hi = dist.interval(alpha)
+                values[:, j] = np.isfinite(output) & (output >= lo) & (output <= hi)
         return XData(values, names)
 
 
@@ -252,18 +541,16 @@ class XRun(object):
         return self.get_valids(alpha, names).values.all(axis=1)
 
 
-    def analyze(self, names=None, anadir=None):
+    def analyze(self, names=None, anadir=None, incremental=False):
         """Perform analysis of the ensemble (write to disk)
+
+        With `incremental=True`, members already read in a previous analysis
+        are taken from the index file in `anadir` (see `AnalysisIndex`), and
+        only new or changed members are read again. Return the index.
         """
         if anadir is None:
             anadir = self.expdir
 
-        # Check number of valid runs
-        print("Experiment directory: "+self.expdir)
-        print("Total number of runs: {}".format(len(self)))
-        print("Number of successful runs: {}".format(self.get_valid().sum()))
-
-
         # Check outputs
         # =============
         names = names or []
@@ -273,70 +560,86 @@ class XRun(object):
             names = self.get_output_names()
             logging.info("Detected output variables: "+", ".join(names))
 
+        # Read ensemble members
+        # =====================
+        indexfile = os.path.join(anadir, ANAINDEX)
+        index = None
+        if incremental and os.path.exists(indexfile):
+            index = AnalysisIndex.read(indexfile)
+            if index.names != list(names):
+                logging.info("output variables changed, read all members again")
+                index = None
+        if index is None:
+            index = AnalysisIndex(names)
+        count = index.update(self)
+        if incremental:
+            logging.info("{} new or updated members".format(count))
+            index.write(indexfile)
+
+        status = index.status(self)
 
-        # Write output variables
-        # ======================
-        if names:
-            xoutput = self.get_output(names)
-        else:
-            xoutput = None
-
-        if xoutput is not None:
-            outputfile = os.path.join(anadir, "output.txt")
-            logging.info("Write output variables to "+outputfile)
-            xoutput.write(outputfile)
-
-        # Derive likelihoods
-        # ==================
-        xlogliks = self.get_logliks()
-        file = os.path.join(anadir, 'logliks.txt')
-        logging.info('write logliks to '+ file)
-        xlogliks.write(file)
-
-        # Sum-up and apply custom distribution
-        # ====================================
-        logliksum = xlogliks.values.sum(axis=1)
-        file = os.path.join(anadir, "loglik.txt")
-        logging.info('write loglik (total) to '+ file)
-        np.savetxt(file, logliksum)
-
-        # Add statistics
-        # ==============
-        valid = np.isfinite(logliksum)
-        ii = [xoutput.names.index(c.name) for c in self.model.likelihood]
-        output = xoutput.values[:, ii] # sort !
-        pct = lambda p: np.percentile(output[valid], p, axis=0)
-
-        names = [c.name for c in self.model.likelihood]
+        # Check number of valid runs
+        print("Experiment directory: "+self.expdir)
+        print("Total number of runs: {}".format(len(self)))
+        print("Number of successful runs: {}".format(status.count('success')))
+
+        # Output, likelihood, prior and statistics
+        # ========================================
+        # derived and written by blocks of members: only one block of the 
+        # ensemble tables is held in memory at a time (next to the index records)
+        lnames = [c.name for c in self.model.likelihood]
+        ii = [names.index(name) for name in lnames]
+        arrays = self._likelihood_arrays()
+        stats = EnsembleStats(lnames)
 
         #TODO: include parameters in the stats
         #for c in self.model.prior:
         #    if c.name not in self.params.names:
         #        raise ValueError('prior name not in params: '+c.name)
 
-        res = [
-            ("obs", [c.dist.mean() for c in self.model.likelihood]),
-            ("best", output[np.argmax(logliksum)]),
-            ("mean", output[valid].mean(axis=0)),
-            ("std", output[valid].std(axis=0)),
-            ("min", output[valid].min(axis=0)),
-            ("p05", pct(5)),
-            ("med", pct(50)),
-            ("p95", pct(95)),
-            ("max", output[valid].max(axis=0)),
-            ("valid_99%", self.get_valids(0.99).values.sum(axis=0)),
-            ("valid_67%", self.get_valids(0.67).values.sum(axis=0)),
-        ]
-
-        index = [nm for nm,arr in res if arr is not None]
+        files = odict()
+        try:
+            # output.txt, logliks.txt, loglik.txt (total), logprior.txt and 
+            # logposterior.txt (flat prior if no prior is defined)
+            for name in ['output', 'logliks', 'loglik', 'logprior', 'logposterior']:
+                if name == 'output' and not names:
+                    continue
+                file = os.path.join(anadir, name+'.txt')
+                logging.info('write {} to {}'.format(name, file))
+                files[name] = open(file, 'w')
+            if 'output' in files:
+                write_dataframe_header(files['output'], names)
+            write_dataframe_header(files['logliks'], lnames)
+
+            for chunk, xoutput in index.iter_output(self, CHUNKSIZE):
+                if 'output' in files:
+                    write_dataframe_rows(files['output'], names, xoutput.values)
+                logliks = self.get_logliks(xoutput, chunk, arrays).values
+                write_dataframe_rows(files['logliks'], lnames, logliks)
+                logliksum = logliks.sum(axis=1)
+                np.savetxt(files['loglik'], logliksum)
+                logprior = self.get_logprior(chunk)
+                np.savetxt(files['logprior'], logprior)
+                np.savetxt(files['logposterior'], logliksum + logprior)
+
+                valids = [(label, self.get_valids(alpha, xoutput=xoutput, 
+                                                  chunk=chunk, arrays=arrays).values)
+                          for label, alpha in [("valid_99%", 0.99), ("valid_67%", 0.67)]]
+                stats.update(xoutput.values[:, ii], logliksum, np.isfinite(logliksum), 
+                             valids=valids)
+        finally:
+            for f in files.values():
+                f.close()
+
+        # array variables are summarized by their mean, as in output.txt
+        res = [("obs", [np.mean(c.dist.mean()) for c in self.model.likelihood])] + stats.table()
+
+        index_ = [nm for nm,arr in res if arr is not None]
         values = [arr for nm,arr in res if arr is not None]
 
-        stats = str_dataframe(names, values, include_index=True, index=index)
+        stats = str_dataframe(lnames, values, include_index=True, index=index_)
 
         with open(os.path.join(anadir, 'stats.txt'), 'w') as f:
             f.write(stats)
 
-        #import pandas as pd
-        #df = pd.DataFrame(np.array(values), columns=names, index=index)
-
-            #f.write(str(df))
+        return index
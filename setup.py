@@ -7,6 +7,11 @@ setup(name='runner',
       author='Mahe Perrette, Alexander Robinson',
       author_email='mahe.perrette@pik-potsdam.de',
       packages = ['runner', 'runner.lib', 'runner.ext', 'runner.tools', 'runner.job'],
-      install_requires = ['numpy', 'pandas', 'scipy', 'six', 'tox','tabulate'],
+      python_requires='>=3.9',
+      install_requires = ['numpy>=1.25', 'pandas', 'scipy>=1.7', 'six', 'tabulate'],
+      classifiers=[
+          'Programming Language :: Python :: 3',
+          'Programming Language :: Python :: 3 :: Only',
+      ],
       scripts = ['scripts/job','scripts/jobrun'], 
       )
@@ -5,7 +5,11 @@ from utils import runner
 
 from runner.tools.dist import dist_todict, dist_fromkw
 from runner.tools.dist import dist_todict2, dist_fromkw2, DiscreteDist
-from runner.param import Param
+from runner.tools.dist import parse_dist2, MultivariateNormal, TruncatedDist
+from runner.tools.dist import NormalDist, UniformDist, LogNormalDist, DummyDist
+from runner.param import Param, MultiParam
+from runner.resample import add_jitter
+import numpy as np
 
 
 class TestDistScipy(unittest.TestCase):
@@ -27,6 +31,37 @@ class TestDistScipy(unittest.TestCase):
         self.assertEqual(dist_todict(dist_fromkw(**self.kw)), self.kw)
 
 
+class TestDistBuiltin(unittest.TestCase):
+
+    def _compare(self, dist, ref, x):
+        q = np.array([0, 0.01, 0.5, 0.9, 1])
+        for method, arg in [('ppf', q), ('cdf', x), ('logpdf', x)]:
+            np.testing.assert_allclose(getattr(dist, method)(arg), getattr(ref, method)(arg), rtol=1e-12)
+        np.testing.assert_allclose(dist.interval(0.9), ref.interval(0.9), rtol=1e-12)
+        np.testing.assert_array_equal(dist.rvs(10, random_state=np.random.default_rng(1)),
+                                      ref.rvs(10, random_state=np.random.default_rng(1)))
+        self.assertEqual(dist_todict(dist), dist_todict(ref))
+
+    def test_scipy(self):
+        from scipy.stats import norm, uniform
+        x = np.array([-3, -1, 0.5, 1, 2.5, 10])
+        self._compare(NormalDist(1, 2), norm(1, 2), x)
+        self._compare(UniformDist(-1, 3), uniform(-1, 3), x)
+        self._compare(LogNormalDist(0.5, 1, 2), lognorm(0.5, 1, 2), x)
+
+    def test_parse(self):
+        self.assertIsInstance(parse_dist2('N?0,1'), NormalDist)
+        self.assertIsInstance(parse_dist2('U?0,1'), UniformDist)
+        self.assertIsInstance(parse_dist2('lognorm?0.5,0,1'), LogNormalDist)
+        self.assertEqual(str(parse_dist2('U?-1,1')), 'U?-1.0,1.0')
+
+    def test_dummy(self):
+        dummy = DummyDist(3)
+        self.assertEqual(dummy.interval(0.9), (-np.inf, np.inf))
+        self.assertEqual(dummy.logpdf(0), 0)
+        self.assertEqual(dummy.rvs(2).tolist(), [3, 3])
+
+
 class TestDistDiscrete(unittest.TestCase):
 
     kw = {'name':'discrete', 'values': [1,2,3]}
@@ -40,6 +75,91 @@ class TestDistDiscrete(unittest.TestCase):
         self.assertEqual(dist_todict2(dist_fromkw2(**self.kw)), self.kw)
 
 
+class TestDistMVN(unittest.TestCase):
+
+    def setUp(self):
+        self.dist = parse_dist2('MVN?1,2;1,0.5;0.5,2')
+
+    def test_parse(self):
+        self.assertIsInstance(self.dist, MultivariateNormal)
+        self.assertEqual(self.dist.mean().tolist(), [1, 2])
+        self.assertEqual(self.dist.cov.tolist(), [[1, 0.5], [0.5, 2]])
+
+    def test_roundtrip(self):
+        kw = dist_todict2(self.dist)
+        self.assertEqual(dist_todict2(dist_fromkw2(**kw)), kw)
+        self.assertEqual(str(parse_dist2(str(self.dist))), str(self.dist))
+
+    def test_logpdf(self):
+        from scipy.stats import multivariate_normal
+        x = [[0, 0], [1, 2], [3, -1]]
+        expected = multivariate_normal([1, 2], [[1, 0.5], [0.5, 2]]).logpdf(x)
+        self.assertTrue(((self.dist.logpdf(x) - expected)**2).sum() < 1e-20)
+
+
+class TestDistTruncated(unittest.TestCase):
+
+    def setUp(self):
+        self.dist = parse_dist2('N?0,1[-2,3]')
+
+    def test_parse(self):
+        self.assertIsInstance(self.dist, TruncatedDist)
+        self.assertEqual(self.dist.support(), (-2, 3))
+        self.assertEqual(parse_dist2('N?0,1[0,]').support(), (0, np.inf))
+        self.assertEqual(str(parse_dist2(str(self.dist))), str(self.dist))
+
+    def test_roundtrip(self):
+        kw = dist_todict2(self.dist)
+        self.assertEqual(dist_todict2(dist_fromkw2(**kw)), kw)
+
+    def test_logpdf(self):
+        from scipy.stats import truncnorm
+        x = np.array([-3, -2, 0, 1.5, 3, 4])
+        expected = truncnorm(-2, 3).logpdf(x)
+        np.testing.assert_allclose(self.dist.logpdf(x), expected)
+        np.testing.assert_allclose(self.dist.ppf([0.1, 0.5, 0.9]), truncnorm(-2, 3).ppf([0.1, 0.5, 0.9]))
+        x = self.dist.rvs(1000, random_state=0)
+        self.assertTrue((x >= -2).all() and (x <= 3).all())
+
+
+class TestJointPrior(unittest.TestCase):
+
+    def setUp(self):
+        self.prior = MultiParam([Param.parse('a,b=MVN?1,2;1,0.5;0.5,2'), Param.parse('c=U?0,1')])
+
+    def test_names(self):
+        self.assertEqual(self.prior.names, ['a', 'b', 'c'])
+        kw = self.prior.asdict('prior')
+        self.assertEqual(kw['prior'][0]['name'], 'a,b')
+        self.assertEqual(MultiParam.fromdict(kw, 'prior').asdict('prior'), kw)
+
+    def test_sample(self):
+        xparams = self.prior.sample(5000, seed=1)
+        np.testing.assert_allclose(np.cov(xparams.values[:, :2].T), [[1, 0.5], [0.5, 2]], atol=0.05)
+        np.testing.assert_allclose(self.prior.ppf(self.prior.to_unit(xparams)), xparams.values)
+
+    def test_logpdf(self):
+        logp = self.prior(a=0, b=1, c=0.5).logpdf()
+        joint = MultivariateNormal([1, 2], [[1, 0.5], [0.5, 2]]).logpdf([0, 1])
+        self.assertAlmostEqual(logp[:2].sum(), joint)
+        self.assertEqual(logp[2], 0)
+
+    def test_jitter_bounds(self):
+        params = np.random.default_rng(0).uniform(size=(200, 3))
+        bounds = self.prior.bounds(['c', 'a', 'b'])
+        self.assertEqual(bounds.tolist(), [[0, 1], [-np.inf, np.inf], [-np.inf, np.inf]])
+        new = add_jitter(params, 1, bounds=bounds, seed=1)
+        self.assertTrue((new[:, 0] >= 0).all() and (new[:, 0] <= 1).all())
+
+    def test_jitter_uniform_edge(self):
+        # on the edges of a uniform prior, half of the jitter falls outside
+        prior = MultiParam([Param.parse('a=U?0,1')])
+        params = np.repeat([[0.], [1.]], 100, axis=0)
+        new = add_jitter(params, 0.1, bounds=prior.bounds(), seed=2)
+        self.assertTrue((new >= 0).all() and (new <= 1).all())
+        self.assertTrue((new[:100] > 0).all() and (new[100:] < 1).all())  # all jittered
+
+
 class TestParamIO(unittest.TestCase):
     def setUp(self):
         self.a = Param.parse('a=N?3,2')
@@ -65,5 +185,38 @@ class TestParamIO(unittest.TestCase):
         self.assertEqual(Param.fromkw(**self.b.as_dict()), self.b)
 
 
+class TestParamList(unittest.TestCase):
+
+    def setUp(self):
+        self.prior = MultiParam([Param.parse('a=N?0,1'), Param.parse('b=U?0,1'), Param.parse('c=1,2,3')])
+
+    def test_index(self):
+        self.assertEqual(self.prior['b'].name, 'b')
+        self.assertEqual(self.prior[np.int64(2)].name, 'c')
+        self.prior.insert(0, Param.parse('d=U?0,1'))
+        self.assertEqual(self.prior['a'], self.prior[1])
+        del self.prior[1]
+        self.assertEqual(list(self.prior.index_map), ['d', 'b', 'c'])
+        with self.assertRaises(KeyError):
+            self.prior['a']
+
+    def test_pickle(self):
+        import pickle, copy
+        prior = MultiParam(self.prior, corr=np.eye(3))
+        for other in [pickle.loads(pickle.dumps(prior)), copy.deepcopy(prior)]:
+            self.assertEqual(other.names, prior.names)
+            self.assertEqual(other['b'].name, 'b')
+            np.testing.assert_array_equal(other.corr, prior.corr)
+
+    def test_freeze(self):
+        xparams = self.prior.sample(10, seed=1)
+        frozen = self.prior.freeze(xparams)
+        expected = np.array([frozen[i].logpdf() for i in range(10)])
+        np.testing.assert_allclose(frozen.logpdf(), expected)
+        np.testing.assert_allclose(self.prior.logpdf(xparams), expected.sum(axis=1))
+        expected = np.array([frozen[i].isvalid(0.9) for i in range(10)])
+        np.testing.assert_array_equal(frozen.isvalid(0.9), expected)
+
+
 if __name__ == '__main__':
     unittest.main()
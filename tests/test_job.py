@@ -3,6 +3,7 @@ import unittest
 import os, shutil
 import six
 import json
+import math
 import logging
 from subprocess import check_call
 
@@ -30,38 +31,64 @@ class TestSample(unittest.TestCase):
      4      1
                          """.strip())
 
+    def test_product_fraction(self):
+        out = getoutput(JOB+' product a=2,3 b=0,1 c=5,6 --fraction III')
+        self.assertEqual(out.strip(), """
+     a      b      c
+     2      0      5
+     2      1      6
+     3      0      6
+     3      1      5
+                         """.strip())
+
+    def test_product_orthogonal_array(self):
+        out = getoutput(JOB+' product a=1,2,3 b=4,5,6 c=7,8,9 d=0,1,2 --orthogonal-array')
+        rows = [line.split() for line in out.strip().split('\n')[1:]]
+        self.assertEqual(len(rows), 9)
+        # balanced: each pair of columns has every combination of values once
+        for i in range(4):
+            for j in range(i):
+                self.assertEqual(len(set((r[i], r[j]) for r in rows)), 9)
+
+    def test_sample_sobol_skip(self):
+        full = getoutput(JOB+' sample a=U?0,1 b=N?0,1 --method sobol --size 8 --seed 3').strip().split('\n')
+        first = getoutput(JOB+' sample a=U?0,1 b=N?0,1 --method sobol --size 4 --seed 3').strip().split('\n')
+        next_ = getoutput(JOB+' sample a=U?0,1 b=N?0,1 --method sobol --size 4 --seed 3 --skip 4').strip().split('\n')
+        self.assertEqual(len(full), 9)
+        self.assertEqual(full, first + next_[1:])
+
     def test_sample(self):
         out = getoutput(JOB+' sample a=U?0,1 b=N?0,1 --size 10 --seed 4')
-        if six.PY3:
-            # note: python3 uses more digits
-            self.assertEqual(out.strip(),"""
+        # note: numpy Generator streams (python 3 only)
+        self.assertEqual(out.strip(),"""
 a      b
-0.4252982362383444 0.9889538055947533
-0.90441600579315 2.6248228301550833
-0.6862993235599223 0.7054452199344784
-0.3976274454776242 -0.766770633921025
-0.5779382921793753 -0.5226094671315683
-0.09670298390136767 -0.1421540745795235
-0.71638422414047 0.04957259589653996
-0.2697728824597271 0.5196323235536475
-0.19726843599648844 -1.6006861519796032
-0.8008986097667555 -0.9483266285993096
-
-                             """.strip())
-        else:
-            self.assertEqual(out.strip(),"""
-     a      b
-0.425298236238 0.988953805595
-0.904416005793 2.62482283016
-0.68629932356 0.705445219934
-0.397627445478 -0.766770633921
-0.577938292179 -0.522609467132
-0.0967029839014 -0.14215407458
-0.71638422414 0.0495725958965
-0.26977288246 0.519632323554
-0.197268435996 -1.60068615198
-0.800898609767 -0.948326628599
-                             """.strip())
+0.19762437057077042 0.46461015811261847
+0.5902215079715989 1.7610515600187417
+0.8968932869316235 -0.11456707249518863
+0.38019012069858077 0.6340398106218305
+0.9177692585761982 -1.236784212363943
+0.260735583199503 -0.7138865791387757
+0.09430561055723677 1.242113407449478
+0.4871635274187657 -1.6339682828391067
+0.6430496277729414 -0.47483362636766396
+0.7984152999931122 0.11989125092743069
+                         """.strip())
+
+    def test_sample_streams(self):
+        from runner.param import MultiParam, Param
+        from runner.tools.rng import get_rng
+        prior = MultiParam([Param.parse('a=U?0,1'), Param.parse('b=N?0,1')])
+        for method in ('montecarlo', 'lhs', 'lhsmdu'):
+            x1 = prior.sample(20, seed=7, method=method)
+            x2 = prior.sample(20, seed=get_rng(7), method=method)
+            self.assertEqual(x1.values.tolist(), x2.values.tolist())
+        # no global state
+        import numpy as np
+        np.random.seed(0)
+        state = np.random.get_state()[1].copy()
+        prior.sample(20, seed=7)
+        self.assertTrue((np.random.get_state()[1] == state).all())
+
 
 class TestRunBase(unittest.TestCase):
 
@@ -168,6 +195,143 @@ b 1
         self.assertEqual(json.load(open('out/1/runner.json'))['output'], {'a':2,'b':1})
 
 
+class TestBinaryParams(TestRunBase):
+
+    def test_roundtrip(self):
+        from runner.xparams import XParams
+        os.makedirs('out')
+        text = getoutput(JOB+' sample a=U?0,1 b=N?0,1 --size 10 --seed 4')
+        for ext in ('npy', 'npz'):
+            getoutput(JOB+' sample a=U?0,1 b=N?0,1 --size 10 --seed 4 -o out/params.'+ext)
+            xparams = XParams.read('out/params.'+ext)
+            self.assertEqual(str(xparams).split(), text.split())
+
+    def test_run(self):
+        getoutput(JOB+' product a=2,3 b=0,1 -o params.npy')
+        try:
+            out = getoutput(JOB+' run -i params.npy -o out --shell -- echo --a {a} --b {b}')
+        finally:
+            os.remove('params.npy')
+        self.assertEqual(out.split('\n'), ['--a 2 --b 0', '--a 2 --b 1', '--a 3 --b 0', '--a 3 --b 1'])
+        self.assertTrue(os.path.exists('out/params.npy'))
+        self.assertFalse(os.path.exists('out/params.txt'))
+
+
+class TestLazyProduct(TestRunBase):
+
+    def test_index(self):
+        # 1002001 members: saved as levels, only selected members are built
+        out = getoutput(JOB+' run -p a=0:1:1001 b=0:1:1001 -j 1000000,1002000 -o out --shell -- echo {a} {b}')
+        self.assertEqual(out.split('\n'), ['0.999 0.001', '1.0 1.0'])
+        self.assertTrue(os.path.exists('out/params.json'))
+        self.assertFalse(os.path.exists('out/params.txt'))
+        out = getoutput(JOB+' run -o out --continue -j 1001 --shell -- echo {a} {b}')
+        self.assertEqual(out, '0.001 0.0')
+
+    def test_product(self):
+        from runner.param import MultiParam, DiscreteParam
+        prior = MultiParam([DiscreteParam.parse('a=2,3,4'), DiscreteParam.parse('b=0.5,1.')])
+        xparams = prior.product()
+        self.assertEqual(xparams.size, 6)
+        self.assertEqual(xparams.pset_as_array(3), [3, 1.0])
+        self.assertEqual(xparams[1:3].values.tolist(), [[2, 1.0], [3, 0.5]])
+        self.assertEqual([chunk.size for chunk in xparams.iter_chunks(4)], [4, 2])
+
+    def test_column(self):
+        from runner.xparams import XFactorial
+        xparams = XFactorial([[1, 2], [10, 20, 30], [0.5, 1.5]], ['a', 'b', 'c'])
+        for j, name in enumerate(xparams.names):
+            self.assertEqual(xparams[name].tolist(), xparams.values[:, j].tolist())
+
+
+class TestExtend(TestRunBase):
+
+    def test_resume(self):
+        os.makedirs('out')
+        getoutput(JOB+' sample a=U?0,1 b=1,2,3 --size 4 --seed 1 -o out/p4.txt')
+        out = getoutput(JOB+' run -i out/p4.txt -o out/exp --shell -- echo {a} {b}')
+        self.assertEqual(len(out.split('\n')), 4)
+        getoutput(JOB+' sample a=U?0,1 b=1,2,3 --size 3 --seed 2 --extend out/p4.txt -o out/p7.txt')
+        p4 = open('out/p4.txt').read().split('\n')
+        p7 = open('out/p7.txt').read().split('\n')
+        self.assertEqual(p7[:5], p4)
+        self.assertEqual(len(p7), 8)
+        # only the new members run
+        out = getoutput(JOB+' run --resume -i out/p7.txt -o out/exp --shell -- echo {a} {b}')
+        self.assertEqual(out.split('\n'), [' '.join(line.split()) for line in p7[5:]])
+        out = getoutput(JOB+' run --resume -o out/exp --shell -- echo {a} {b}')
+        self.assertEqual(out, '')
+        # the existing members must be kept
+        out = getoutput(JOB+' run --resume -i out/p4.txt -o out/exp --shell -- echo {a} {b}')
+        self.assertIn('must start with the existing members', out)
+
+    def test_iter_read(self):
+        from utils import runner
+        from runner.xparams import XParams
+        os.makedirs('out')
+        getoutput(JOB+' product a=1,2,3,4,5 b=0,1 -o out/params.txt')
+        blocks = list(XParams.iter_read('out/params.txt', chunksize=4))
+        self.assertEqual([block.size for block in blocks], [4, 4, 2])
+        self.assertEqual(blocks[0].names, ['a', 'b'])
+        self.assertEqual(blocks[-1].values.tolist(), [[5, 0], [5, 1]])
+
+    def test_resume_no_journal(self):
+        getoutput(JOB+' run -p a=1,2,3 -o out --shell -- echo {a}')
+        os.remove('out/journal.jsonl')  # e.g. experiment run by an older version
+        with open('out/1/runner.json') as f:
+            info = json.load(f)
+        info['status'] = 'failed'
+        with open('out/1/runner.json', 'w') as f:
+            json.dump(info, f)
+        out = getoutput(JOB+' run --resume -o out --shell -- echo {a}')
+        self.assertEqual(out, '2.0')  # params read back from params.txt
+
+
+class TestWatch(TestRunBase):
+
+    def test_subset(self):
+        # only members 0 and 1 are submitted: the analysis has finished
+        getoutput(JOB+' run -p a=1,2,3 -j 0,1 -o out --shell -- echo {a}')
+        # raises if the watch loop is still waiting after 20 seconds
+        check_call('timeout 20 '+JOB+' analyze out --watch 0.1', shell=True)
+
+    def test_timeout(self):
+        getoutput(JOB+' run -p a=1,2 -o out --shell -- echo {a}')
+        with open('out/1/runner.json') as f:
+            info = json.load(f)
+        info['status'] = 'running'  # abandoned by a timeout
+        with open('out/1/runner.json', 'w') as f:
+            json.dump(info, f)
+        with open('out/journal.jsonl', 'a') as f:
+            f.write(json.dumps({'runid': 1, 'state': 'timeout', 'time': 0})+'\n')
+        # raises if the watch loop is still waiting after 20 seconds
+        check_call('timeout 20 '+JOB+' analyze out --watch 0.1', shell=True)
+
+
+class TestCorrelatedPrior(TestRunBase):
+
+    def test_resample_iis(self):
+        import numpy as np
+        os.makedirs('out')
+        getoutput(JOB+' sample a=U?0,1 b=N?0,1 c=N?0,1 --corr a,b=0.9 -N 500 --seed 1 -o out/params.txt')
+        prior = json.load(open('out/params.prior.json'))
+        self.assertEqual(prior['corr'][0], [1, 0.9, 0])
+        np.savetxt('out/loglik.txt', np.zeros(500))
+        getoutput(JOB+' resample out/params.txt -w out/loglik.txt --log --iis --epsilon 1 --seed 2 -o out/new.txt')
+        self.assertEqual(json.load(open('out/new.prior.json')), prior)
+        new = np.loadtxt('out/new.txt', skiprows=1)
+        self.assertGreater(np.corrcoef(new, rowvar=False)[0, 1], 0.7)
+        self.assertTrue((new[:, 0] >= 0).all() and (new[:, 0] <= 1).all())  # prior support
+
+    def test_structured_designs(self):
+        # rank reordering would break these designs
+        for opts in ['--method nolh', '--method sobol -N 8', '--method halton -N 8', 
+                     '-N 4 --extend out/params.txt']:
+            out = getoutput(JOB+' sample a=U?0,1 b=N?0,1 --corr a,b=0.5 '+opts)
+            self.assertIn('--corr', out)
+            self.assertNotIn('Traceback', out)
+
+
 class TestRunSubmit(TestRunBase):
 
     def test_shell(self):
@@ -194,6 +358,55 @@ class TestRunSubmit(TestRunBase):
                          """.strip())
 
 
+    def test_pipe(self):
+        out = getoutput(JOB+' product a=2,3 b=0,1 | '+JOB+' run -i - -o out --shell -- echo --a {a} --b {b}')
+        # values read from text are floats
+        self.assertEqual(out.split('\n'), ['--a 2.0 --b 0.0', '--a 2.0 --b 1.0', '--a 3.0 --b 0.0', '--a 3.0 --b 1.0'])
+
+    def test_status(self):
+        getoutput(JOB+' run -p a=2,3,4 b=0,1 -o out -- echo --a {a} --b {b} --out {}')
+        out = getoutput(JOB+' status out')
+        self.assertIn("Members: 6 (queued 0, running 0, success 6, failed 0, timeout 0)", out)
+        self.assertNotIn("Recent failures", out)
+
+    def test_status_force(self):
+        getoutput(JOB+' run -p a=2,3,4 b=0,1 -o out -- echo --a {a} --b {b} --out {}')
+        # a new run starts a new journal segment
+        getoutput(JOB+' run -p a=2,3 -o out -f -- echo --a {a} --out {}')
+        out = getoutput(JOB+' status out')
+        self.assertIn("Members: 2 (queued 0, running 0, success 2, failed 0, timeout 0)", out)
+
+    def test_trace(self):
+        getoutput(JOB+' run -p a=2,3,4 b=0,1 -o out -- echo --a {a} --b {b} --out {}')
+        out = getoutput(JOB+' trace out --chrome out/trace.json')
+        lines = {line.split()[0]: line.split() for line in out.splitlines()[1:7]}
+        self.assertEqual(lines['model'][1], '6')
+        self.assertEqual(lines['write'][1], '12')
+        self.assertIn("Top overheads", out)
+        events = json.load(open('out/trace.json'))['traceEvents']
+        self.assertIn('spawn', [e['name'] for e in events])
+
+    def test_profile(self):
+        os.makedirs('out')
+        out = getoutput(JOB+' --profile=out/job.prof run -p a=2,3 -o out -f -- echo --a {a}')
+        self.assertIn("Profiles of 2 worker runs merged into out/job.workers.prof", out)
+        self.assertTrue(os.path.exists('out/job.prof'))
+        self.assertTrue(os.path.exists('out/job.workers.prof'))
+
+    def test_profile_default(self):
+        from runner.tools.profiler import PROFILE_FILE
+        os.makedirs('out')
+        try:
+            out = getoutput(JOB+' --profile run -p a=2 -o out --shell -- echo --profile {a}')
+            self.assertTrue(os.path.exists(PROFILE_FILE))
+        finally:
+            for file in [PROFILE_FILE, PROFILE_FILE.replace('.prof', '.workers.prof')]:
+                if os.path.exists(file):
+                    os.remove(file)
+        # subcommand arguments are left untouched
+        self.assertIn('--profile 2', out)
+
+
 class TestRunIndices(TestRunBase):
 
     def test_shell(self):
@@ -251,10 +464,169 @@ class TestAnalyze(unittest.TestCase):
 -2.918938533204672670e+00
                          """.strip())
 
+    def test_posterior(self):
+        check_call(JOB+' analyze out -l aa=N?0,1', shell=True)
+        self.assertEqual([float(v) for v in open('out/logprior.txt')], [0, 0])  # flat
+        check_call(JOB+' analyze out -l aa=N?0,1 --prior a=N?1,1 b=U?-1,1', shell=True)
+        logprior = [float(v) for v in open('out/logprior.txt')]
+        loglik = [float(v) for v in open('out/loglik.txt')]
+        logpost = [float(v) for v in open('out/logposterior.txt')]
+        self.assertAlmostEqual(logprior[0], -0.5*math.log(2*math.pi) - math.log(2))
+        self.assertAlmostEqual(logprior[1], -0.5 - 0.5*math.log(2*math.pi) - math.log(2))
+        self.assertEqual(logpost, [l+p for l, p in zip(loglik, logprior)])
+
+    def test_incremental(self):
+        check_call(JOB+' analyze out -v aa bb --incremental', shell=True)
+        index = json.load(open('out/analyze.json'))
+        self.assertEqual(index['names'], ['aa', 'bb'])
+        self.assertEqual(len(index['records']), 2)
+        check_call(JOB+' analyze out -v aa bb --incremental', shell=True)
+        out = open('out/output.txt').read()
+        self.assertEqual(out.strip(),"""
+	aa     bb
+   1.0    0.0
+   2.0    0.0
+                         """.strip())
+        # unchanged members are not read again: their indexed output is kept
+        for record in index['records'].values():
+            record['output'] = [record['output'][0] + 10, record['output'][1]]
+        json.dump(index, open('out/analyze.json', 'w'))
+        check_call(JOB+' analyze out -v aa bb --incremental', shell=True)
+        out = open('out/output.txt').read()
+        os.remove('out/analyze.json')
+        self.assertEqual(out.strip(),"""
+	aa     bb
+  11.0    0.0
+  12.0    0.0
+                         """.strip())
+
+    def test_postprocess(self):
+        out = getoutput(JOB+' postprocess out')
+        self.assertEqual(out.strip(), '0 members postprocessed, 2 up-to-date, 0 not successful')
+        # model output file modified after postprocess
+        original = open('out/1/'+self.fileout).read()
+        with open('out/1/'+self.fileout, 'w') as f:
+            f.write('{"aa": 3, "bb": 1}' if self.fileout.endswith('.json') else 'aa 3\nbb 1\n')
+        out = getoutput(JOB+' postprocess out')
+        self.assertEqual(out.strip(), '1 members postprocessed, 1 up-to-date, 0 not successful')
+        self.assertEqual(json.load(open('out/1/runner.json'))['output'], {'aa':3, 'bb':1})
+        with open('out/1/'+self.fileout, 'w') as f:
+            f.write(original)
+        out = getoutput(JOB+' postprocess out --force')
+        self.assertEqual(out.strip(), '2 members postprocessed, 0 up-to-date, 0 not successful')
+        self.assertEqual(json.load(open('out/1/runner.json'))['output'], {'aa':2, 'bb':0})
+
 class TestAnalyzeLineSep(TestAnalyze):
     fileout = 'output'
 
 
+class TestCustomInterface(TestRunBase):
+
+    def test_run_without_tracer(self):
+        from utils import runner
+        from runner.model import Model, ModelInterface
+        from runner.trace import Tracer
+
+        class Interface(ModelInterface):
+            # written before the tracer argument existed
+            def run(self, rundir, params, background=True, shell=False):
+                return super(Interface, self).run(rundir, params, background, shell)
+
+        model = Model(Interface(['echo', '{a}']))
+        m = model('out/0', {'a': 1}).run(tracer=Tracer('out/trace.jsonl'))
+        self.assertEqual(m.status, 'success')
+        self.assertEqual(json.load(open('out/0/runner.json'))['status'], 'success')
+
+
+class TestTraceFailure(TestRunBase):
+
+    def test_flush(self):
+        import numpy as np
+        from utils import runner
+        from runner.model import Model
+        from runner.xrun import XRun, XParams
+        from runner.trace import read_trace
+        xrun = XRun(Model(), XParams(np.zeros((2, 1)), ['a']), expdir='out', max_workers=-1)
+        xrun.setup()
+        with self.assertRaises(ValueError):
+            xrun.run()  # the pool cannot be created
+        self.assertEqual([s['name'] for s in read_trace('out/trace.jsonl')], ['pool'])
+
+
+class TestArrayOutput(TestRunBase):
+
+    def test_arrays(self):
+        from utils import runner
+        from runner.model import Model
+        from runner.xrun import XRun, XParams
+        check_call(JOB+' run -p a=1,2 b=0.5 -o out --file-out output.json'
+                   +' --shell python examples/dummy.py {} --aa {a} --bb {b} --ts 3', shell=True)
+        info = json.load(open('out/1/runner.json'))
+        self.assertEqual(info['output']['ts'], {'npy':'runner.ts.npy', 'shape':[3]})
+        self.assertTrue(os.path.exists('out/1/runner.ts.npy'))
+
+        xrun = XRun(Model(), XParams.read('out/params.txt'), expdir='out')
+        arrays = xrun.get_output(['aa', 'ts'], arrays=True)
+        self.assertEqual(arrays['ts'].shape, (2, 3))
+        self.assertEqual(arrays['ts'].tolist(), [[1, 1.5, 2], [2, 2.5, 3]])
+        self.assertEqual(arrays['aa'].tolist(), [1, 2])
+        self.assertEqual(xrun.get_output(['ts']).values.tolist(), [[1.5], [2.5]])
+
+    def test_arrays_check(self):
+        from utils import runner
+        from runner.model import Model
+        from runner.xrun import XRun, XParams
+        check_call(JOB+' run -p a=2,3 b=0.5 -o out --file-out output.json'
+                   +' --shell python examples/dummy.py {} --aa {a} --bb {b} --ts {a}', shell=True)
+        xrun = XRun(Model(), XParams.read('out/params.txt'), expdir='out')
+        with self.assertRaisesRegex(ValueError, 'member 1'):
+            xrun.get_output(['ts'], arrays=True)
+        self.assertEqual([f for f in os.listdir('out') if f.startswith('output.')], [])
+        # rebuilt for a different number of members (e.g. extended ensemble)
+        self.assertEqual(xrun.get_output(['aa'], arrays=True)['aa'].tolist(), [2, 3])
+        xrun = XRun(Model(), XParams.read('out/params.txt')[:1], expdir='out')
+        self.assertEqual(xrun.get_output(['aa'], arrays=True)['aa'].tolist(), [2])
+
+    def test_mvn_likelihood(self):
+        import numpy as np
+        from scipy.stats import multivariate_normal
+        check_call(JOB+' run -p a=1,2 b=0.5 -o out --file-out output.json'
+                   +' --shell python examples/dummy.py {} --aa {a} --bb {b} --ts 3', shell=True)
+        obs = np.array([1.5, 2, 2.5])
+        cov = np.array([[1, .5, .2], [.5, 1, .5], [.2, .5, 1]])
+        np.savetxt('out/obs.txt', obs)
+        np.savetxt('out/cov.txt', cov)
+        check_call(JOB+' analyze out -l ts=MVN?out/obs.txt,out/cov.txt aa=N?1,1', shell=True)
+        expected = multivariate_normal(obs, cov).logpdf([[1, 1.5, 2], [2, 2.5, 3]])
+        logliks = np.loadtxt('out/logliks.txt', skiprows=1)
+        np.testing.assert_allclose(logliks[:, 0], expected)
+
+    def test_chunks(self):
+        import numpy as np
+        import runner.xrun
+        from runner.model import Model
+        from runner.param import Param, MultiParam
+        from runner.xrun import XRun, XParams
+        check_call(JOB+' run -p a=1,2,3,4,5 b=0.5 -o out --file-out output.json'
+                   +' --shell python examples/dummy.py {} --aa {a} --bb {b} --ts 3', shell=True)
+        np.savetxt('out/obs.txt', [1.5, 2, 2.5])
+        np.savetxt('out/cov.txt', np.eye(3))
+        model = Model(prior=MultiParam([Param.parse('a=U?0,10')]), 
+                      likelihood=[Param.parse('ts=MVN?out/obs.txt,out/cov.txt'), 
+                                  Param.parse('aa=N?2,1')])
+        xrun = XRun(model, XParams.read('out/params.txt'), expdir='out')
+        files = ['output.txt', 'logliks.txt', 'loglik.txt', 'logposterior.txt', 'stats.txt']
+        xrun.analyze()
+        expected = [open('out/'+file).read() for file in files]
+        chunksize = runner.xrun.CHUNKSIZE
+        runner.xrun.CHUNKSIZE = 2
+        try:
+            xrun.analyze()
+        finally:
+            runner.xrun.CHUNKSIZE = chunksize
+        self.assertEqual([open('out/'+file).read() for file in files], expected)
+
+
 
 if __name__ == '__main__':
     unittest.main()
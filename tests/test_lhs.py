@@ -0,0 +1,161 @@
+from __future__ import absolute_import
+import unittest
+import numpy as np
+from utils import runner
+
+from runner.lib.doelhs import lhs, _lhsclassic, _pdist, _phisum
+from runner.lib import lhsmdu, pynolh
+from runner.lib.doeaugment import augment
+from runner.lib.imanconover import iman_conover
+from runner.param import MultiParam, Param
+
+
+class TestMaximin(unittest.TestCase):
+
+    def test_pdist(self):
+        x = np.random.RandomState(0).uniform(size=(6, 3))
+        expected = [np.sqrt(((x[j] - x[i])**2).sum()) for i in range(5) for j in range(i+1, 6)]
+        np.testing.assert_allclose(_pdist(x), expected)
+
+    def test_ese(self):
+        random = _lhsclassic(4, 50, np.random.default_rng(1))
+        H = lhs(4, 50, 'ese', 5, random_state=1)
+        # still a latin hypercube
+        for j in range(4):
+            self.assertEqual(len(np.unique(np.floor(H[:, j]*50))), 50)
+        self.assertLess(_phisum(H), _phisum(random))
+        self.assertGreater(_pdist(H).min(), _pdist(random).min())
+
+
+class TestLHSMDU(unittest.TestCase):
+
+    def test_sample(self):
+        H = lhsmdu.sample(3, 200, randomSeed=2)
+        self.assertEqual(H.shape, (3, 200))
+        for j in range(3):
+            self.assertEqual(len(np.unique(np.floor(H[j]*200))), 200)
+        np.random.seed(2)
+        random = np.random.random((200, 3))
+        self.assertGreater(_pdist(H.T).min(), _pdist(random).min())
+        np.testing.assert_array_equal(H, lhsmdu.sample(3, 200, randomSeed=2))
+
+    def test_brute_force(self):
+        # same neighbours without k-d tree
+        np.random.seed(3)
+        R = np.random.random((4, 100))
+        expected = lhsmdu.eliminateRealizationsToStrata(R, 20)
+        maxdim, lhsmdu.kdTreeMaxDimensions = lhsmdu.kdTreeMaxDimensions, 0
+        try:
+            np.testing.assert_array_equal(lhsmdu.eliminateRealizationsToStrata(R, 20), expected)
+        finally:
+            lhsmdu.kdTreeMaxDimensions = maxdim
+
+    def test_multiparam(self):
+        prior = MultiParam([Param.parse('a=U?0,1'), Param.parse('b=N?0,1'), Param.parse('c=1,2,3')])
+        xparams = prior.sample(30, seed=1, method='lhsmdu')
+        self.assertEqual(xparams.values.shape, (30, 3))
+        self.assertTrue(((xparams['a'] >= 0) & (xparams['a'] <= 1)).all())
+        self.assertEqual(set(xparams['c']), {1, 2, 3})
+
+
+class TestNOLH(unittest.TestCase):
+
+    def test_conf(self):
+        for conf, remove in pynolh.CONF.values():
+            repaired = pynolh._repair(conf)
+            self.assertEqual(sorted(repaired), list(range(1, len(conf)+1)))
+            self.assertLessEqual((repaired != np.array(conf)).sum(), 2)
+        # vendored tables are kept as published
+        self.assertEqual(pynolh.CONF[29][0][96], 141)
+
+    def test_design(self):
+        for dim, size in [(3, 17), (10, 33), (20, 129)]:
+            H = pynolh.design(dim)
+            self.assertEqual(H.shape, (size, dim))
+            for j in range(dim):
+                self.assertEqual(len(np.unique(H[:, j])), size)
+            self.assertLess(pynolh._max_correlation(H)[0], 0.03)
+
+    def test_multiparam(self):
+        prior = MultiParam([Param.parse('a=U?0,1'), Param.parse('b=N?0,1')])
+        xparams = prior.sample(None, method='nolh')
+        self.assertEqual(xparams.values.shape, (17, 2))
+        self.assertTrue(np.isfinite(xparams.values).all())
+        self.assertRaises(ValueError, prior.sample, 10, method='nolh')
+
+
+class TestAugment(unittest.TestCase):
+
+    def test_maximin(self):
+        rng = np.random.RandomState(0)
+        design = rng.uniform(size=(50, 3))
+        new = augment(design, 50, random_state=1)
+        random = rng.uniform(size=(50, 3))
+        self.assertEqual(new.shape, (50, 3))
+        self.assertGreater(_pdist(np.concatenate([design, new])).min(),
+                           _pdist(np.concatenate([design, random])).min())
+        np.testing.assert_array_equal(new, augment(design, 50, random_state=1))
+
+
+class TestSpawn(unittest.TestCase):
+
+    def test_generator(self):
+        from runner.tools.rng import spawn
+        a = [g.random(3) for g in spawn(np.random.default_rng(1), 2)]
+        b = [g.random(3) for g in spawn(np.random.default_rng(1), 2)]
+        np.testing.assert_array_equal(a, b)  # reproducible
+        self.assertFalse(np.allclose(a[0], a[1]))  # independent streams
+        rng = np.random.default_rng(1)
+        self.assertFalse(np.allclose(spawn(rng, 1)[0].random(3), spawn(rng, 1)[0].random(3)))
+
+
+class TestImanConover(unittest.TestCase):
+
+    def _spearman(self, x):
+        ranks = np.argsort(np.argsort(x, axis=0), axis=0)
+        return np.corrcoef(ranks, rowvar=False)
+
+    def test_corr(self):
+        corr = np.array([[1, 0.7, -0.3], [0.7, 1, 0], [-0.3, 0, 1]])
+        x = lhs(3, 5000, random_state=0)
+        y = iman_conover(x, corr, random_state=1)
+        np.testing.assert_array_equal(np.sort(x, axis=0), np.sort(y, axis=0))  # marginals
+        np.testing.assert_allclose(self._spearman(y), corr, atol=0.03)
+        np.testing.assert_array_equal(y, iman_conover(x, corr, random_state=1))
+
+    def test_small_sample(self):
+        # the sample correlation of the scores is accounted for: closer to corr
+        # than correlating the permuted scores with the Cholesky factor of corr only
+        from scipy.special import ndtri
+        corr = np.array([[1, 0.7, -0.3], [0.7, 1, 0], [-0.3, 0, 1]])
+        chol = np.linalg.cholesky(corr)
+        scores = ndtri(np.arange(1, 41) / 41.)
+        errors, plain = [], []
+        for seed in range(50):
+            x = lhs(3, 40, random_state=seed)
+            errors.append(np.abs(self._spearman(iman_conover(x, corr, random_state=seed)) - corr).max())
+            rng = np.random.default_rng(seed)
+            M = np.array([rng.permutation(scores) for j in range(3)]).T
+            plain.append(np.abs(self._spearman(M.dot(chol.T)) - corr).max())
+        self.assertLess(np.mean(errors), np.mean(plain))
+        self.assertLess(np.mean(errors), 0.07)  # 0.078 with M Q^-1 P^T instead of M Q^-T P^T
+
+    def test_multiparam(self):
+        prior = MultiParam([Param.parse('a=U?0,1'), Param.parse('b=N?0,1'), Param.parse('c=1,2,3')],
+                           corr=[[1, 0.8, 0], [0.8, 1, 0.5], [0, 0.5, 1]])
+        xparams = prior.sample(2000, seed=3)
+        np.testing.assert_allclose(self._spearman(xparams.values[:, :2])[0, 1], 0.8, atol=0.03)
+        roundtrip = MultiParam.fromdict(prior.asdict('prior'), 'prior')
+        self.assertEqual(roundtrip.names, prior.names)
+        np.testing.assert_array_equal(roundtrip.corr, prior.corr)
+        with self.assertRaises(ValueError):
+            MultiParam(prior, corr=[[1, 1.5, 0], [1.5, 1, 0], [0, 0, 1]])
+        for method in ['nolh', 'sobol', 'halton']:
+            with self.assertRaises(ValueError):
+                prior.sample(16, seed=3, method=method)
+        with self.assertRaises(ValueError):
+            prior.extend_design(xparams, 10, seed=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+from six.moves.urllib.request import urlopen
+from utils import runner
+
+from runner.journal import Journal, JournalSummary
+from runner.metrics import JournalMetrics, MetricsServer
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.journal = Journal(os.path.join(self.tmpdir, 'journal.jsonl'))
+        self.journal.extend(range(4), 'queued')
+        self.journal.extend(range(2), 'running')
+        self.journal.append(0, 'success', duration=3.)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_render(self):
+        metrics = JournalMetrics(self.journal, max_workers=2)
+        text = metrics.render()
+        self.assertIn('runner_members{state="queued"} 2', text)
+        self.assertIn('runner_members{state="running"} 1', text)
+        self.assertIn('runner_members{state="success"} 1', text)
+        self.assertIn('runner_member_runtime_seconds_bucket{le="5"} 1', text)
+        self.assertIn('runner_member_runtime_seconds_bucket{le="1"} 0', text)
+        self.assertIn('runner_dispatch_latency_seconds_count 2', text)
+        self.assertIn('runner_worker_utilisation 0.5', text)
+        # incremental
+        self.journal.append(1, 'failed', duration=1.)
+        text = metrics.render()
+        self.assertIn('runner_members{state="running"} 0', text)
+        self.assertIn('runner_member_runtime_seconds_count 2', text)
+
+    def test_server(self):
+        server = MetricsServer(self.journal, 0).start()
+        try:
+            text = urlopen('http://127.0.0.1:{}/metrics'.format(server.port)).read().decode('utf-8')
+        finally:
+            server.stop()
+        self.assertIn('runner_members{state="success"} 1', text)
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.journal = Journal(os.path.join(self.tmpdir, 'journal.jsonl'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_segment(self):
+        self.journal.extend(range(4), 'queued')
+        self.journal.extend(range(4), 'running')
+        self.journal.extend(range(4), 'success', duration=1.)
+        self.journal.segment()
+        self.journal.extend(range(2), 'queued')
+        summary = self.journal.summary()
+        self.assertEqual(summary.states, {0: 'queued', 1: 'queued'})
+        metrics = JournalMetrics(self.journal)
+        metrics.update()
+        self.assertEqual(metrics.counts()['queued'], 2)
+        self.assertEqual(metrics.counts()['success'], 0)
+        self.assertEqual(metrics.runtime.count, 0)
+        self.assertEqual(metrics.latency.count, 0)
+        self.journal.append(0, 'running')
+        self.journal.append(0, 'success', duration=2.)
+        metrics.update()
+        self.assertEqual(metrics.runtime.count, 1)
+        self.assertEqual(metrics.latency.count, 1)
+        self.assertIn('runner_member_runtime_seconds_count 1', metrics.render())
+
+    def test_timeout(self):
+        self.journal.extend(range(2), 'queued')
+        self.journal.extend(range(2), 'running')
+        self.journal.append(0, 'timeout')
+        self.journal.append(0, 'success')  # abandoned worker
+        self.journal.append(1, 'success')
+        self.assertEqual(self.journal.summary().states, {0: 'timeout', 1: 'success'})
+        # queued again
+        self.journal.append(0, 'queued')
+        self.journal.append(0, 'success')
+        self.assertEqual(self.journal.summary().states, {0: 'success', 1: 'success'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+import unittest
+import numpy as np
+from utils import runner
+
+from runner.tools.stream import RunningStats, QuantileSketch, EnsembleStats
+
+
+class TestRunningStats(unittest.TestCase):
+
+    def setUp(self):
+        self.values = np.random.RandomState(0).normal(size=(1000, 3))
+
+    def test_chunks(self):
+        stats = RunningStats()
+        for i in range(0, 1000, 64):
+            stats.update(self.values[i:i+64])
+        self.assertEqual(stats.count, 1000)
+        np.testing.assert_allclose(stats.mean, self.values.mean(axis=0))
+        np.testing.assert_allclose(stats.std(), self.values.std(axis=0))
+        np.testing.assert_equal(stats.min, self.values.min(axis=0))
+        np.testing.assert_equal(stats.max, self.values.max(axis=0))
+
+    def test_merge(self):
+        a = RunningStats().update(self.values[:300])
+        b = RunningStats().update(self.values[300:])
+        a.merge(RunningStats.fromkw(**b.as_dict()))
+        np.testing.assert_allclose(a.mean, self.values.mean(axis=0))
+        np.testing.assert_allclose(a.std(), self.values.std(axis=0))
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def test_exact(self):
+        values = np.random.RandomState(1).normal(size=(500, 2))
+        sketch = QuantileSketch().update(values[:200]).update(values[200:])
+        for q in (5, 50, 95):
+            np.testing.assert_allclose(sketch.percentile(q), np.percentile(values, q, axis=0))
+
+    def test_large(self):
+        values = np.random.RandomState(2).uniform(size=(200000, 2))
+        a = QuantileSketch(k=256)
+        b = QuantileSketch(k=256)
+        for i in range(0, 100000, 5000):
+            a.update(values[i:i+5000])
+            b.update(values[100000+i:100000+i+5000])
+        a.merge(b)
+        self.assertEqual(a.count, 200000)
+        self.assertLess(sum(level.shape[0] for level in a.levels), 256*20)
+        for q in (5, 50, 95):
+            np.testing.assert_allclose(a.percentile(q), np.percentile(values, q, axis=0), atol=0.01)
+
+    def test_dict(self):
+        values = np.random.RandomState(3).uniform(size=(3000, 2))
+        a = QuantileSketch(k=64).update(values[:1001])
+        b = QuantileSketch.fromkw(**a.as_dict())
+        a.update(values[1001:])
+        b.update(values[1001:])
+        for la, lb in zip(a.levels, b.levels):
+            np.testing.assert_array_equal(la, lb)
+
+    def test_empty(self):
+        self.assertTrue(np.isnan(QuantileSketch().percentile(50)))
+        self.assertEqual(QuantileSketch().percentile([5, 50, 95]).shape, (3,))
+
+
+class TestEnsembleStats(unittest.TestCase):
+
+    def test_best(self):
+        output = np.arange(8.).reshape(4, 2)
+        loglik = np.array([-3, np.nan, -1, -2.])
+        stats = EnsembleStats(['a', 'b'])
+        stats.update(output[:2], loglik[:2], np.isfinite(loglik[:2]))
+        stats.update(output[2:], loglik[2:], np.isfinite(loglik[2:]))
+        table = dict(stats.table())
+        np.testing.assert_equal(table['best'], [4, 5])
+        np.testing.assert_allclose(table['mean'], output[[0, 2, 3]].mean(axis=0))
+
+    def test_no_valid(self):
+        stats = EnsembleStats(['a', 'b'])
+        stats.update(np.zeros((3, 2)) + np.nan, np.zeros(3) + np.nan, np.zeros(3, dtype=bool))
+        for label, values in stats.table():
+            self.assertEqual(len(values), 2)
+            self.assertTrue(np.all(np.isnan(values)), label)
+
+
+if __name__ == '__main__':
+    unittest.main()